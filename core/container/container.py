@@ -27,13 +27,19 @@
 #
 import os
 import enum
+from copy import copy
 import utils.config as config
 from uuid import uuid4
 from magic import Magic
 #
 from utils.crypto import randstr
 from utils.crypto import hashbuf
-from utils.crypto import hashfile
+from utils.crypto import treehash
+from utils.crypto import hexdigest
+from utils.crypto import hashbf_multi
+from utils.crypto import multihasher
+from utils.crypto import FUZZY_HASH_FUNC
+from utils.hash_cache import hashfile_multi
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.wrapper import trace_static
@@ -46,6 +52,8 @@ from workspace.workspace import workspace
 # GLOBAL
 # =============================================================================
 LGR = get_logger(__name__)
+MAGIC = {}  # (magic_file, mime) -> Magic instance cache
+MAGIC_BUF_SZ = 1024 * 1024  # data given to libmagic for virtual containers
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
@@ -67,6 +75,7 @@ class Container(object):
         WHITELISTED = 0x08
         BLACKLISTED = 0x10 | FLAGGED  # blacklisted => flagged
         CARVING_REQUIRED = 0x20
+        BLOCK_SCAN_REQUIRED = 0x40
     ##
     ## @brief      { function_description }
     ##
@@ -81,44 +90,182 @@ class Container(object):
             hash_func = config.value('hash_func', 'sha256')
             LGR.info("computing <{}> {}... please wait...".format(path,
                                                                   hash_func))
-            return hashfile(hash_func, path).hex()
+            digests = hashfile_multi([hash_func], path)
+            if digests is None:
+                return None
+            return digests[hash_func].hex()
         return None
     ##
+    ## @brief      Returns configured hash functions, 'hash_func' comes first
+    ##             followed by additional 'hash_funcs'. The fuzzy hash is
+    ##             added when 'fuzzy_threshold' enables similarity lookups.
+    ##
+    ## @return     list of hash functions
+    ##
+    @staticmethod
+    @trace_static('Container')
+    def hash_funcs():
+        hash_funcs = [config.value('hash_func', 'sha256')]
+        for hash_func in config.value('hash_funcs', []):
+            if hash_func not in hash_funcs:
+                hash_funcs.append(hash_func)
+        if (config.value('fuzzy_threshold', 0) > 0 and
+           FUZZY_HASH_FUNC not in hash_funcs):
+            hash_funcs.append(FUZZY_HASH_FUNC)
+        return hash_funcs
+    ##
+    ## @brief      Computes all configured digests in a single pass.
+    ##
+    ## @param      path    The path
+    ## @param      device  The virtual file holding data, if any
+    ##
+    ## @return     dict mapping hash function to hexdigest or None
+    ##
+    @staticmethod
+    @trace_static('Container')
+    def hashes(path, device=None):
+        if device is None and not BinaryFile.exists(path):
+            return None
+
+        hash_funcs = Container.hash_funcs()
+        LGR.info("computing <{}> {}... please wait...".format(
+            path, ', '.join(hash_funcs)))
+        if device is None:
+            digests = hashfile_multi(hash_funcs, path)
+        else:
+            with copy(device) as bf:
+                digests = hashbf_multi(hash_funcs, bf)
+        if digests is None:
+            return None
+        return {hash_func: hexdigest(hash_func, digest)
+                for (hash_func, digest) in digests.items()}
+    ##
+    ## @brief      Computes a tree hash of a file when it is larger than
+    ##             'tree_hash_min_size', chunks are hashed in parallel using
+    ##             'hash_threads' threads.
+    ##
+    ## @param      path  The path
+    ##
+    ## @return     dict describing the tree hash or None
+    ##
+    @staticmethod
+    @trace_static('Container')
+    def tree_hash(path):
+        min_size = config.value('tree_hash_min_size', 0)
+        if min_size <= 0 or not BinaryFile.exists(path):
+            return None
+
+        if os.path.getsize(path) < min_size:
+            return None
+
+        hash_func = config.value('hash_func', 'sha256')
+        chunk_size = config.value('tree_hash_chunk_size', 64 * 1024 * 1024)
+        LGR.info("computing <{}> {} tree hash... please wait...".format(
+            path, hash_func))
+        result = treehash(hash_func, path, chunk_size,
+                          config.value('hash_threads', 1))
+        if result is None:
+            return None
+
+        (root, leaves) = result
+        return {
+            'hash_func': hash_func,
+            'chunk_size': chunk_size,
+            'root': root.hex(),
+            'leaves': [leaf.hex() for leaf in leaves]
+        }
+    ##
+    ## @brief      Returns a cached Magic instance, loading magic database only
+    ##             once per process. Call it before forking workers to share
+    ##             loaded database with them.
+    ##
+    ## @param      magic_file  The magic file
+    ## @param      mime        Return MIME type instead of text
+    ##
+    ## @return     Magic instance
+    ##
+    @staticmethod
+    @trace_static('Container')
+    def magic(magic_file, mime=False):
+        key = (magic_file, mime)
+        instance = MAGIC.get(key)
+        if instance is None:
+            instance = Magic(magic_file=magic_file, mime=mime)
+            MAGIC[key] = instance
+        return instance
+    ##
     ## @brief      { function_description }
     ##
     ## @param      magic_file  The magic file
     ## @param      path        The path
+    ## @param      device      The virtual file holding data, if any, its
+    ##                         first bytes are given to libmagic
     ##
     ## @return     { description_of_the_return_value }
     ##
     @staticmethod
     @trace_static('Container')
-    def mimes(magic_file, path):
-        return (Magic(magic_file=magic_file).from_file(path),
-                Magic(magic_file=magic_file, mime=True).from_file(path))
+    def mimes(magic_file, path, device=None):
+        if device is None:
+            return (Container.magic(magic_file).from_file(path),
+                    Container.magic(magic_file, mime=True).from_file(path))
+
+        with copy(device) as bf:
+            buf = bf.read(MAGIC_BUF_SZ, 0)
+        return (Container.magic(magic_file).from_buffer(buf),
+                Container.magic(magic_file, mime=True).from_buffer(buf))
     ##
     ## @brief      Constructs the object.
     ##
     ## @param      path        The path
     ## @param      realname    The realname
     ## @param      magic_file  The magic file
-    ##
-    def __init__(self, path, realname, magic_file=None):
+    ## @param      digests     Digests computed while data was written, see
+    ##                         Container.obf(). Data is not read again to
+    ##                         compute them.
+    ## @param      device      Virtual file holding container's data, path
+    ##                         is then a virtual path which does not exist,
+    ##                         see utils.virtual_file
+    ##
+    def __init__(self, path, realname, magic_file=None, digests=None,
+                 device=None):
         super(Container, self).__init__()
         ## @brief Container's unique id
         self.uuid = uuid4()
         ## @brief Parent container's unique id for hierarchy
         self.parent_uuid = None
+        ## @brief Number of ancestors of this container
+        self.depth = 0
         ## @brief Container's data file path
         self.path = path
         ## @brief Container's real name
         self.realname = realname
+        ## @brief Container's virtual file, None when data is stored at path
+        self.device = device
         ## @brief Container's data hash value
         self.hashed = ''
+        ## @brief Container's data hash values by hash function
+        self.hashes = {}
         if not config.value('skip_hash', False):
-            self.hashed = Container.hash(path)
+            if digests is None:
+                self.hashes = Container.hashes(path, device) or {}
+            else:
+                self.hashes = {hash_func: hexdigest(hash_func, digest)
+                               for (hash_func, digest) in digests.items()}
+            self.hashed = self.hashes.get(Container.hash_funcs()[0])
+        ## @brief Container's data fuzzy hash signature
+        self.fuzzy_hash = self.hashes.get(FUZZY_HASH_FUNC)
+        ## @brief Container's data tree hash, see Container.tree_hash(),
+        ##        leaves are read concurrently from a file on disk only
+        self.tree_hash = None
+        if device is None:
+            self.tree_hash = Container.tree_hash(path)
+        ## @brief Number of blocks matching known files, by known file
+        self.block_matches = {}
+        ## @brief Similarity score of blacklisted files, by blacklisted file
+        self.similar_matches = {}
         #
-        (mime_text, mime_type) = Container.mimes(magic_file, path)
+        (mime_text, mime_type) = Container.mimes(magic_file, path, device)
         ## @brief Container's data MIME text
         self.mime_text = mime_text
         ## @brief Container's data MIME type
@@ -127,6 +274,20 @@ class Container(object):
         self.flags = Container.Flag.NONE
         # unexpected dissection results will fill this list of errors
         self.__errors = []
+        # size is computed where container is built, scheduling it in pool
+        # master must not read devices
+        self.__size = None
+        try:
+            self.size()
+        except OSError as e:
+            LGR.warn("cannot compute size of <{}>: {}".format(path, e))
+    ##
+    ## @brief      Returns a string representation of the object.
+    ##
+    ## @return     String representation of the object.
+    ##
+    def __str__(self):
+        return "{} ({})".format(self.realname, self.uuid)
     ##
     ## @brief      { function_description }
     ##
@@ -144,6 +305,11 @@ class Container(object):
             'path': self.path,
             'realname': self.realname,
             'hashed': self.hashed,
+            'hashes': self.hashes,
+            'tree_hash': self.tree_hash,
+            'block_matches': self.block_matches,
+            'fuzzy_hash': self.fuzzy_hash,
+            'similar_matches': self.similar_matches,
             'mime': {
                 'type': self.mime_type,
                 'text': self.mime_text
@@ -161,7 +327,8 @@ class Container(object):
     ##
     @trace()
     def set_parent(self, container):
-        self.parent = container.uuid
+        self.parent_uuid = container.uuid
+        self.depth = container.depth + 1
     ##
     ## @brief      Sets the flag.
     ##
@@ -193,6 +360,20 @@ class Container(object):
     def has_flag(self, flag):
         return (self.flags & flag) == flag
     ##
+    ## @brief      Returns container's data size in bytes, it is computed once.
+    ##
+    ## @return     Size in bytes.
+    ##
+    @trace()
+    def size(self):
+        if self.__size is None:
+            if self.device is not None:
+                with copy(self.device) as bf:
+                    self.__size = bf.size()
+            else:
+                self.__size = os.path.getsize(self.path)
+        return self.__size
+    ##
     ## @brief      { function_description }
     ##
     ## @return     { description_of_the_return_value }
@@ -216,23 +397,36 @@ class Container(object):
     ##
     ## @brief      { function_description }
     ##
+    ## @param      mapped  File is memory-mapped and reads return memoryview
+    ##                     slices, devices ignore it.
+    ##
     ## @return     { description_of_the_return_value }
     ##
     @trace()
-    def ibf(self):
-        bf = BinaryFile(self.path, 'r')
+    def ibf(self, mapped=False):
+        if self.device is not None:
+            # device is kept closed to be sent to workers
+            bf = copy(self.device)
+        else:
+            # dissectors read at given offsets, they may share it
+            bf = BinaryFile(self.path, 'r', positional=True, mapped=mapped)
         bf.open()
         return bf
     ##
-    ## @brief      { function_description }
+    ## @brief      Creates an output file, configured digests are computed
+    ##             while it is written. Pass obf.digests() to the Container
+    ##             built from it.
     ##
-    ## @param      suffix  The suffix
+    ## @param      prefix  The prefix
     ##
-    ## @return     { description_of_the_return_value }
+    ## @return     BinaryFile instance
     ##
     @trace()
     def obf(self, prefix=''):
-        return workspace().tmpfile(prefix=prefix, suffix='ds')
+        bf = workspace().tmpfile(prefix=prefix, suffix='ds')
+        if not config.value('skip_hash', False):
+            bf.set_hasher(multihasher(Container.hash_funcs()))
+        return bf
 ##
 ## @brief      Class for container action group.
 ##
@@ -258,7 +452,13 @@ class ContainerActionGroup(ActionGroup):
                 LGR.warn("{}: invalid path => skipped.".format(f))
                 continue
 
-            print("{}: {}".format(f, Container.hash(f)))
+            hashes = Container.hashes(f)
+            if hashes is None:
+                LGR.warn("{}: failed to compute digests.".format(f))
+                continue
+
+            for (hash_func, hexdigest) in hashes.items():
+                print("{}: {}: {}".format(f, hash_func, hexdigest))
 
         return True
     ##
@@ -33,6 +33,7 @@ from utils.wrapper import trace_func
 from utils.wrapper import trace_static
 from hashdb.hashdb import HashDB
 from utils.workerpool import WorkerPool
+from utils.fuzzy_hash import available as fuzzy_available
 from utils.action_group import ActionGroup
 from container.container import Container
 from utils.plugin_importer import PluginImporter
@@ -41,6 +42,9 @@ from dissectiondb.dissectiondb import DissectionDB
 # GLOBAL
 # =============================================================================
 LGR = get_logger(__name__)
+# containers handled by a dissector are read entirely and produce children,
+# their estimated cost is weighted accordingly
+DISSECTABLE_WEIGHT = 4
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
@@ -87,22 +91,66 @@ def carve(container, carvers):
 
     return containers
 ##
+## @brief      Looks up blocks of a container in the block hash database,
+##             container is flagged if blocks of known files are found.
+##
+## @param      container     The container
+## @param      blockhash_db  The block hash database
+##
+@trace_func(__name__)
+def block_scan(container, blockhash_db):
+    ibf = container.ibf()
+    matches = blockhash_db.scan_blocks(ibf)
+    ibf.close()
+    if not matches:
+        return
+
+    for (reference, count) in matches.items():
+        LGR.warn("{} block(s) of <{}> found in <{}> => flagged.".format(
+            count, reference, container.realname))
+    container.block_matches = matches
+    container.set_flag(Container.Flag.FLAGGED)
+##
+## @brief      Looks up files similar to a container in the blacklist,
+##             container is flagged if their similarity score reaches
+##             'fuzzy_threshold'.
+##
+## @param      container     The container
+## @param      blacklist_db  The blacklist database
+##
+@trace_func(__name__)
+def fuzzy_scan(container, blacklist_db):
+    threshold = config.value('fuzzy_threshold', 0)
+    if threshold <= 0 or not container.fuzzy_hash:
+        return
+
+    matches = blacklist_db.similar(container.fuzzy_hash, threshold)
+    if not matches:
+        return
+
+    for (reference, score) in matches.items():
+        LGR.warn("<{}> is {}% similar to blacklisted <{}> => "
+                 "flagged.".format(container.realname, score, reference))
+    container.similar_matches = matches
+    container.set_flag(Container.Flag.FLAGGED)
+##
 ## @brief      { function_description }
 ##
 ## @param      container      The container
 ## @param      whitelist_db   The whitelist database
 ## @param      blacklist_db   The blacklist database
-## @param      dissection_db  The dissection database
+## @param      blockhash_db   The block hash database
 ## @param      dissectors     The dissectors
 ## @param      carvers        The carvers
 ##
-## @return     { description_of_the_return_value }
+## @return     new containers to process and container's dictionary to be
+##             persisted in the dissection database
 ##
 @trace_func(__name__)
 def dissection_routine(container,
                        whitelist_db,
                        blacklist_db,
-                       dissection_db,
+                       blockhash_db,
                        dissectors,
                        carvers):
     iq = []
@@ -111,14 +159,20 @@ def dissection_routine(container,
     if whitelist_db.contains(container):
         LGR.info("whitelisted container => skipping!")
         container.set_flag(Container.Flag.WHITELISTED)
-        dissection_db.persist(container)
+        oq.append(container.to_dict())
         return (iq, oq)     # interrupt dissection process here
     # is the container blacklisted ?
     if blacklist_db.contains(container):
         LGR.warn("blacklisted container => flagged!")
         container.set_flag(Container.Flag.BLACKLISTED)
-        dissection_db.persist(container)
+        oq.append(container.to_dict())
         return (iq, oq)     # interrupt dissection process here
+    # is the container similar to a blacklisted one ? a similar file may
+    # differ in any way so whitelists are never searched that way
+    fuzzy_scan(container, blacklist_db)
+    # does the container hold blocks of known files ?
+    if container.has_flag(Container.Flag.BLOCK_SCAN_REQUIRED):
+        block_scan(container, blockhash_db)
     # is dissection required ?
     if not container.has_flag(Container.Flag.DISSECTED):
         # dissect container and iterate over children
@@ -135,8 +189,8 @@ def dissection_routine(container,
             new_container.set_parent(container)
             iq.append(new_container)
         # container carving: OK
-    # finally persist container
-    dissection_db.persist(container)
+    # finally send container to the writer
+    oq.append(container.to_dict())
     return (iq, oq)
 # =============================================================================
 # CLASSES
@@ -164,6 +218,14 @@ class Dissection(object):
         'action_group'
     ])
     ##
+    ## Order in which pending containers are dissected
+    ##
+    SCHEDULING_POLICIES = [
+        'largest-first',    # minimizes overall dissection time
+        'smallest-first',   # quick feedback for triage
+        'none'              # most recently discovered first
+    ]
+    ##
     ## @brief      Constructs the object.
     ##
     def __init__(self):
@@ -174,6 +236,10 @@ class Dissection(object):
         self._carvers = []
         self.__whitelist = None
         self.__blacklist = None
+        self.__blockhash = None
+        self.__dissection = None
+        self.__reopen = []
+        self.__pool = None
     ##
     ## @brief      Loads dissectors.
     ##
@@ -276,55 +342,183 @@ class Dissection(object):
     def carvers(self):
         return [carver.name for carver in self._carvers]
     ##
-    ## @brief      { function_description }
+    ## @brief      Estimates the cost of dissecting given container. Size
+    ##             was computed by the worker which built the container, no
+    ##             data is read here.
     ##
-    ## @param      path         The path
-    ## @param      num_threads  The number threads
+    ## @param      container  The container
     ##
-    ## @return     { description_of_the_return_value }
+    ## @return     Estimated cost
+    ##
+    @trace()
+    def cost(self, container):
+        try:
+            size = container.size()
+        except OSError:
+            LGR.warn("cannot estimate size of <{}>.".format(container))
+            return 0
+
+        if container.mime_type in self._dissectors:
+            return size * DISSECTABLE_WEIGHT
+
+        return size
+    ##
+    ## @brief      Returns worker pool priority function matching given
+    ##             scheduling policy. Shallower containers are preferred on
+    ##             equal costs as they are more likely to produce children.
+    ##
+    ## @param      policy  The policy
+    ##
+    ## @return     Priority function or None
     ##
     @trace()
-    def dissect(self, path, num_threads=1):
+    def priority(self, policy):
+        if policy == 'largest-first':
+            return lambda c: (-self.cost(c), c.depth)
+
+        if policy == 'smallest-first':
+            return lambda c: (self.cost(c), c.depth)
+
+        return None
+    ##
+    ## @brief      Opens databases and forks the worker pool once, it is then
+    ##             reused to dissect every input until stop() is called.
+    ##
+    ##             Plugins must be loaded before calling this method so that
+    ##             workers share them.
+    ##
+    ## @return     True if dissection can begin, False otherwise.
+    ##
+    @trace()
+    def start(self):
         LGR.info("starting dissection processes...")
 
+        if (config.value('fuzzy_threshold', 0) > 0 and
+           not fuzzy_available(config.value('fuzzy_python', False))):
+            return False
+
         LGR.info("preparing dissection database...")
-        dissection_db = DissectionDB(self.conf)
-        if not dissection_db.init('w'):
+        self.__dissection = DissectionDB(self.conf)
+        if not self.__dissection.init('w'):
             LGR.error("failed to init dissection db.")
             return False
 
+        # hash databases are only checked here, connections can't be shared
+        # across fork so each worker opens its own
+        self.__reopen = []
+
         LGR.info("preparing whitelist database...")
         whitelist_conf = config.load_from_value('whitelist_config')
-        whitelist_db = HashDB(whitelist_conf)
-        if not whitelist_db.init('r'):
+        self.__whitelist = HashDB(whitelist_conf)
+        if self.__whitelist.init('r'):
+            self.__whitelist.term()
+            self.__reopen.append(self.__whitelist)
+        else:
             LGR.warn("failed to init whitelist db.")
 
         LGR.info("preparing blacklist database...")
         blacklist_conf = config.load_from_value('blacklist_config')
-        blacklist_db = HashDB(blacklist_conf)
-        if not blacklist_db.init('r'):
+        self.__blacklist = HashDB(blacklist_conf)
+        if self.__blacklist.init('r'):
+            self.__blacklist.term()
+            self.__reopen.append(self.__blacklist)
+        else:
             LGR.warn("failed to init blacklist db.")
 
-        LGR.info("preparing first container...")
-        container = Container(path, os.path.basename(path))
+        self.__blockhash = HashDB(None)
+        if config.value('blockhashdb_config') is not None:
+            LGR.info("preparing block hash database...")
+            blockhash_conf = config.load_from_value('blockhashdb_config')
+            self.__blockhash = HashDB(blockhash_conf)
+            if self.__blockhash.block_size() <= 0:
+                LGR.warn("block hash database configuration must have "
+                         "'block_size' key => block scan disabled.")
+            elif self.__blockhash.init('r'):
+                self.__blockhash.term()
+                self.__reopen.append(self.__blockhash)
+            else:
+                LGR.warn("failed to init block hash db.")
+
+        LGR.info("loading magic databases...")
+        magic_file = config.value('magic_file')
+        Container.magic(magic_file)
+        Container.magic(magic_file, mime=True)
 
         kwargs = {
             'carvers': self._carvers,
             'dissectors': self._dissectors,
-            'whitelist_db': whitelist_db,
-            'blacklist_db': blacklist_db,
-            'dissection_db': dissection_db
+            'whitelist_db': self.__whitelist,
+            'blacklist_db': self.__blacklist,
+            'blockhash_db': self.__blockhash
         }
 
-        LGR.info("starting recursive processing of containers...")
-        pool = WorkerPool(config.value('num_workers', 1))
-        pool.map(dissection_routine, kwargs, tasks=[container])
+        policy = config.value('scheduling_policy', 'largest-first')
+        if policy not in Dissection.SCHEDULING_POLICIES:
+            LGR.warn("unknown scheduling policy <{}>, expected one of {} => "
+                     "using largest-first.".format(
+                        policy, Dissection.SCHEDULING_POLICIES))
+            policy = 'largest-first'
+        LGR.info("scheduling policy: {}".format(policy))
+
+        LGR.info("forking workers...")
+        self.__pool = WorkerPool(config.value('num_workers', 1),
+                                 priority=self.priority(policy))
+        return self.__pool.start(dissection_routine, kwargs,
+                                 init=self.__open_hashdbs)
+    ##
+    ## @brief      Opens hash databases in a worker.
+    ##
+    @trace()
+    def __open_hashdbs(self):
+        for hashdb in self.__reopen:
+            if not hashdb.init('r'):
+                LGR.error("worker failed to open <{}> hash "
+                          "database.".format(hashdb.name))
+    ##
+    ## @brief      Stops the worker pool and closes databases.
+    ##
+    @trace()
+    def stop(self):
+        if self.__pool is not None:
+            self.__pool.stop()
+            self.__pool = None
 
         LGR.info("closing databases...")
-        whitelist_db.term()
-        blacklist_db.term()
-        dissection_db.term()
+        for db in [self.__whitelist, self.__blacklist, self.__blockhash,
+                   self.__dissection]:
+            if db is not None:
+                db.term()
+        self.__whitelist = None
+        self.__blacklist = None
+        self.__blockhash = None
+        self.__dissection = None
         LGR.info("dissection done.")
+    ##
+    ## @brief      Recursively dissects given file using running workers.
+    ##
+    ## @param      path  The path
+    ##
+    ## @return     True if dissection succeeded, False otherwise.
+    ##
+    @trace()
+    def dissect(self, path):
+        if self.__pool is None or not self.__pool.is_running():
+            LGR.error("dissection must be started first.")
+            return False
+
+        LGR.info("preparing first container...")
+        container = Container(path, os.path.basename(path))
+
+        LGR.info("starting recursive processing of containers...")
+        # workers send containers, this process is the only writer
+        batch_size = config.value('db_batch_size', 1000)
+        container_dicts = []
+        for container_dict in self.__pool.process([container]):
+            container_dicts.append(container_dict)
+            if len(container_dicts) >= batch_size:
+                self.__dissection.persist_many(container_dicts)
+                container_dicts = []
+        self.__dissection.persist_many(container_dicts)
 
         return True
 ##
@@ -444,16 +638,23 @@ class DissectionActionGroup(ActionGroup):
     @staticmethod
     @trace_static('DissectionActionGroup')
     def dissect(keywords, args):
+        if len(args.files) == 0:
+            LGR.error("give at least one file to dissect.")
+            return False
+
         dissection = Dissection()
         dissection.load_carvers()
         dissection.load_dissectors()
-        if len(args.files) == 0:
-            LGR.error("give at least one file to dissect.")
+        if not dissection.start():
+            dissection.stop()
             return False
 
-        for f in args.files:
-            if not dissection.dissect(f):
-                return False
+        try:
+            for f in args.files:
+                if not dissection.dissect(f):
+                    return False
+        finally:
+            dissection.stop()
 
         return True
     ##
@@ -30,11 +30,16 @@ from utils.binary_file import BinaryFile
 from utils.action_group import ActionGroup
 from container.container import Container
 from helpers.vdi.vdi_disk import VdiDisk
+from helpers.vdi.vdi_device import VdiDevice
 from helpers.vdi.vdi_extractor import VdiExtractor
 # =============================================================================
 # GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# allocated blocks holding only zeros are left as holes in extracted data
+DETECT_ZEROS = False
+# raw disk is extracted to workspace instead of being read from the image
+EXTRACT = False
 # =============================================================================
 # PUBLIC FUNCTIONS
 # =============================================================================
@@ -59,6 +64,10 @@ def mimes():
 ##
 @trace_func(__name__)
 def configure(config):
+    global DETECT_ZEROS, EXTRACT
+    if config is not None:
+        DETECT_ZEROS = config.get('detect_zeros', False)
+        EXTRACT = config.get('extract', False)
     return True
 ##
 ## @brief      Determines ability to dissect given container.
@@ -95,16 +104,30 @@ def can_dissect(container):
 def dissect(container):
     containers = []
 
+    if not EXTRACT:
+        device = VdiDevice(container.device or container.path,
+                           '{}#vdi.raw'.format(container.path))
+        if device.open():
+            device.close()
+            # raw disk blocks are read from the image on demand
+            return [Container(device.path, 'vdi.raw', device=device)]
+
+        LGR.warn("cannot read VDI as a device => extracting it.")
+
     obf = container.obf('vdi.raw')
     ibf = container.ibf()
 
-    extractor = VdiExtractor(container.wdir(), VdiDisk(ibf), obf)
-    if extractor.extract():
-        containers.append(Container(obf.abspath, 'vdi.raw'))
+    extractor = VdiExtractor(container.wdir(), VdiDisk(ibf), obf,
+                             DETECT_ZEROS)
+    extracted = extractor.extract()
+    obf.close()
+    if extracted:
+        # output was hashed while written, it is not read again
+        containers.append(Container(obf.abspath, 'vdi.raw',
+                                    digests=obf.digests()))
     else:
         LGR.error("failed to extract data from VDI.")
 
-    obf.close()
     ibf.close()
     return containers
 ##
@@ -30,6 +30,7 @@ from utils.binary_file import BinaryFile
 from utils.action_group import ActionGroup
 from container.container import Container
 from helpers.vhd.vhd_disk import VhdDisk
+from helpers.vhd.vhd_device import VhdDevice
 from helpers.vhd.vhd_extractor import VhdExtractor
 # =============================================================================
 # GLOBAL
@@ -38,6 +39,10 @@ from helpers.vhd.vhd_extractor import VhdExtractor
 # GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# allocated blocks holding only zeros are left as holes in extracted data
+DETECT_ZEROS = False
+# raw disk is extracted to workspace instead of being read from the image
+EXTRACT = False
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
@@ -62,6 +67,10 @@ def mimes():
 ##
 @trace_func(__name__)
 def configure(config):
+    global DETECT_ZEROS, EXTRACT
+    if config is not None:
+        DETECT_ZEROS = config.get('detect_zeros', False)
+        EXTRACT = config.get('extract', False)
     return True
 ##
 ## @brief      Determines ability to dissect given container.
@@ -98,16 +107,30 @@ def can_dissect(container):
 def dissect(container):
     containers = []
 
+    if not EXTRACT:
+        device = VhdDevice(container.device or container.path,
+                           '{}#vhd.raw'.format(container.path))
+        if device.open():
+            device.close()
+            # raw disk blocks are read from the image on demand
+            return [Container(device.path, 'vhd.raw', device=device)]
+
+        LGR.warn("cannot read VHD as a device => extracting it.")
+
     obf = container.obf('vhd.raw')
     ibf = container.ibf()
 
-    extractor = VhdExtractor(container.wdir(), VhdDisk(ibf), obf)
-    if extractor.extract():
-        containers.append(Container(obf.abspath, 'vhd.raw'))
+    extractor = VhdExtractor(container.wdir(), VhdDisk(ibf), obf,
+                             DETECT_ZEROS)
+    extracted = extractor.extract()
+    obf.close()
+    if extracted:
+        # output was hashed while written, it is not read again
+        containers.append(Container(obf.abspath, 'vhd.raw',
+                                    digests=obf.digests()))
     else:
         LGR.error("failed to extract data from VDI.")
 
-    obf.close()
     ibf.close()
     return containers
 ##
@@ -33,6 +33,7 @@ from utils.action_group import ActionGroup
 from container.container import Container
 # dissection helpers
 from helpers.vmdk.vmdk_disk import VmdkDisk
+from helpers.vmdk.vmdk_device import VmdkDevice
 from helpers.vmdk.descriptor_file import DescriptorFile
 from helpers.vmdk.flat_extent_extractor import FlatExtentExtractor
 from helpers.vmdk.sparse_extent_extractor import SparseExtentExtractor
@@ -40,6 +41,10 @@ from helpers.vmdk.sparse_extent_extractor import SparseExtentExtractor
 # GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# allocated blocks holding only zeros are left as holes in extracted data
+DETECT_ZEROS = False
+# raw disk is extracted to workspace instead of being read from the image
+EXTRACT = False
 # =============================================================================
 # PRIVATE FUNCTIONS
 # =============================================================================
@@ -62,7 +67,7 @@ def __dissect_from_vmdk(wdir, vmdk, obf):
         return False
 
     if df.is_sparse():
-        see = SparseExtentExtractor(wdir, vmdk, obf)
+        see = SparseExtentExtractor(wdir, vmdk, obf, DETECT_ZEROS)
         return see.extract()
 
     elif df.is_flat():
@@ -123,6 +128,10 @@ def mimes():
 ##
 @trace_func(__name__)
 def configure(config):
+    global DETECT_ZEROS, EXTRACT
+    if config is not None:
+        DETECT_ZEROS = config.get('detect_zeros', False)
+        EXTRACT = config.get('extract', False)
     return True
 ##
 ## @brief      Determines ability to dissect given container.
@@ -162,24 +171,39 @@ def dissect(container):
     containers = []
     wdir = container.wdir()
     ibf = container.ibf()
-    obf = container.obf('vmdk.raw')
     vmdk = VmdkDisk(ibf)
+    # extents are found next to the image, it must be a file on disk
+    if (not EXTRACT and container.device is None and
+       vmdk.header() is not None and VmdkDevice.supports(vmdk)):
+        device = VmdkDevice(container.path,
+                            '{}#vmdk.raw'.format(container.path))
+        if device.open():
+            device.close()
+            ibf.close()
+            # raw disk grains are read from the image on demand
+            return [Container(device.path, 'vmdk.raw', device=device)]
+
+        LGR.warn("cannot read VMDK as a device => extracting it.")
+
+    obf = container.obf('vmdk.raw')
     # find and parse descriptor file
     if vmdk.header() is None:
         df = DescriptorFile(ibf.read_text(offset=0))
 
-        if __dissect_from_vmx(wdir, df, obf):
-            containers.append(Container(obf.abspath, 'vmdk.raw'))
-        else:
+        extracted = __dissect_from_vmx(wdir, df, obf)
+        if not extracted:
             LGR.warn('failed to dissect from vmx file.')
 
     else:
-        if __dissect_from_vmdk(wdir, vmdk, obf):
-            containers.append(Container(obf.abspath, 'vmdk.raw'))
-        else:
+        extracted = __dissect_from_vmdk(wdir, vmdk, obf)
+        if not extracted:
             LGR.warn('failed to dissect from vmdk file.')
 
     obf.close()
+    if extracted:
+        # output was hashed while written, it is not read again
+        containers.append(Container(obf.abspath, 'vmdk.raw',
+                                    digests=obf.digests()))
     ibf.close()
     return containers
 ##
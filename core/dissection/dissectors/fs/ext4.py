@@ -77,7 +77,7 @@ def can_dissect(container):
     if 'Linux rev 1.0 ext4 filesystem data' not in container.mime_text:
         return False
 
-    ibf = container.ibf()
+    ibf = container.ibf(mapped=True)
     fs = Ext4FS(ibf)
     valid = fs.is_valid()
     ibf.close()
@@ -126,7 +126,7 @@ def action_group():
                 continue
 
             sb = None
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -156,7 +156,7 @@ def action_group():
                 continue
 
             sb = None
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -183,7 +183,7 @@ def action_group():
                 LGR.warn("invalid path <{}> => skipped.".format(f))
                 continue
 
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -208,7 +208,7 @@ def action_group():
                 LGR.warn("invalid path <{}> => skipped.".format(f))
                 continue
 
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -244,7 +244,7 @@ def action_group():
                 LGR.warn("invalid path <{}> => skipped.".format(f))
                 continue
 
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -285,7 +285,7 @@ def action_group():
                 LGR.warn("invalid path <{}> => skipped.".format(f))
                 continue
 
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
@@ -334,7 +334,7 @@ def action_group():
                 LGR.warn("invalid path <{}> => skipped.".format(f))
                 continue
 
-            with BinaryFile(f, 'r') as bf:
+            with BinaryFile(f, 'r', mapped=True) as bf:
                 fs = Ext4FS(bf)
 
                 if not fs.is_valid():
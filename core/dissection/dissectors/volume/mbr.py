@@ -28,6 +28,7 @@
 from utils.logging import get_logger
 from utils.wrapper import trace_func
 from utils.binary_file import BinaryFile
+from utils.virtual_file import WindowFile
 from utils.action_group import ActionGroup
 from container.container import Container
 from helpers.mbr.mbr import MBR
@@ -35,26 +36,43 @@ from helpers.mbr.mbr import MBR
 # GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# sectors are copied to workspace instead of being read from parent container
+EXTRACT = False
 # =============================================================================
 # PRIVATE FUNCTIONS
 # =============================================================================
+def _extract_memory_map(container, mm, name):
+    obf = container.obf(name)
+
+    LGR.info("extracting {} sectors...".format(mm.size))
+    copied = mm.copy_to(obf)
+    if copied < mm.unit * mm.size:
+        LGR.warn("{} is truncated, {} bytes extracted.".format(name,
+                                                             copied))
+
+    obf.close()
+    # data was hashed while written
+    return Container(obf.abspath, name, digests=obf.digests())
+
 def _extract_memory_maps(container, mem_maps, prefix):
     containers = []
 
     n = 1
     for mm in mem_maps:
         name = '{}.{}'.format(prefix, n)
-        obf = container.obf(name)
-
-        LGR.info("extracting {} sectors...".format(mm.size))
-        for i in range(0, mm.size):
-            obf.write(mm.read_one(i))
-
-            if (i+1) % 20480 == 0:
-                LGR.info("{}/{} sectors extracted.".format(i+1, mm.size))
 
-        containers.append(Container(obf.abspath, name))
-        obf.close()
+        if EXTRACT:
+            new_container = _extract_memory_map(container, mm, name)
+        else:
+            # sectors are read from parent container on demand
+            device = WindowFile(container.device or container.path,
+                                mm.unit * mm.start,
+                                mm.unit * mm.size,
+                                '{}#{}'.format(container.path, name))
+            new_container = Container(device.path, name, device=device)
+        # raw sectors may hold fragments of known files
+        new_container.set_flag(Container.Flag.BLOCK_SCAN_REQUIRED)
+        containers.append(new_container)
         n += 1
 
     return containers
@@ -82,6 +100,9 @@ def mimes():
 ##
 @trace_func(__name__)
 def configure(config):
+    global EXTRACT
+    if config is not None:
+        EXTRACT = config.get('extract', False)
     return True
 ##
 ## @brief      Determines ability to dissect given container.
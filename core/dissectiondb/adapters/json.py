@@ -28,6 +28,7 @@ from utils.json import json_dumps
 from utils.logging import get_logger
 from utils.wrapper import trace
 from utils.wrapper import trace_func
+from utils.configobj import ConfigObj
 from utils.binary_file import BinaryFile
 from dissectiondb.dissectiondb_adapter import DissectionDBAdapter
 # =============================================================================
@@ -134,16 +135,29 @@ class JsonDB(DissectionDBAdapter):
     ##
     @trace()
     def insert(self, container_dict):
-        data = json_dumps(container_dict)
+        return self.insert_many([container_dict])
+    ##
+    ## @brief      Inserts several containers using a single write
+    ##
+    ## @param      container_dicts  The container dictionaries
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, container_dicts):
+        if len(container_dicts) == 0:
+            return True
+        data = ','.join([json_dumps(cd) for cd in container_dicts])
         self._lock.acquire()
         # protect counter increment
         if self.cnt > 0:
             data = ',' + data
-        self.cnt += 1
+        self.cnt += len(container_dicts)
         # protect file writing
         self.bf.write_text(data)
         self.bf.flush()
         self._lock.release()
+        return True
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
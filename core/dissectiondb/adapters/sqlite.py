@@ -106,7 +106,13 @@ class SQLiteDB(DissectionDBAdapter):
         c.execute("DROP INDEX IF EXISTS container_parent_uuid")
         c.execute("DROP INDEX IF EXISTS container_uuid")
         c.execute("DROP TABLE IF EXISTS container")
-        c.execute("CREATE TABLE container(uuid,parent_uuid,path,realname,hashed,mime_type,mime_text,flagged,whitelisted,blacklisted)")
+        c.execute("DROP TABLE IF EXISTS tree_hash_leaf")
+        c.execute("DROP TABLE IF EXISTS block_match")
+        c.execute("DROP TABLE IF EXISTS similar_match")
+        c.execute("CREATE TABLE container(uuid,parent_uuid,path,realname,hashed,mime_type,mime_text,flagged,whitelisted,blacklisted,tree_hash,tree_hash_chunk_size,fuzzy_hash)")
+        c.execute("CREATE TABLE tree_hash_leaf(uuid,idx,hashed,PRIMARY KEY(uuid,idx))")
+        c.execute("CREATE TABLE block_match(uuid,path,blocks)")
+        c.execute("CREATE TABLE similar_match(uuid,path,score)")
         c.execute("CREATE INDEX container_uuid ON container(uuid)")
         c.execute("CREATE INDEX container_parent_uuid ON container(parent_uuid)")
         c.close()
@@ -138,20 +144,52 @@ class SQLiteDB(DissectionDBAdapter):
     ##
     @trace()
     def insert(self, container_dict):
+        return self.insert_many([container_dict])
+    ##
+    ## @brief      Inserts several containers within a single transaction
+    ##
+    ## @param      container_dicts  The container dictionaries
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, container_dicts):
+        rows = []
+        leaves = []
+        matches = []
+        similar = []
+        for container_dict in container_dicts:
+            tree_hash = container_dict.get('tree_hash') or {}
+            rows.append((container_dict.get('uuid'),
+                         container_dict.get('parent_uuid'),
+                         container_dict.get('path'),
+                         container_dict.get('realname'),
+                         container_dict.get('hashed'),
+                         container_dict.get('mime', {}).get('type'),
+                         container_dict.get('mime', {}).get('text'),
+                         container_dict.get('flagged'),
+                         container_dict.get('whitelisted'),
+                         container_dict.get('blacklisted'),
+                         tree_hash.get('root'),
+                         tree_hash.get('chunk_size'),
+                         container_dict.get('fuzzy_hash')))
+            for (idx, leaf) in enumerate(tree_hash.get('leaves', [])):
+                leaves.append((container_dict.get('uuid'), idx, leaf))
+            for (path, blocks) in container_dict.get('block_matches',
+                                                     {}).items():
+                matches.append((container_dict.get('uuid'), path, blocks))
+            for (path, score) in container_dict.get('similar_matches',
+                                                    {}).items():
+                similar.append((container_dict.get('uuid'), path, score))
+
         self._lock.acquire()
 
         c = self.conn.cursor()
-        c.execute("INSERT INTO container VALUES (?,?,?,?,?,?,?,?,?,?)",
-                  (container_dict.get('uuid'),
-                   container_dict.get('parent_uuid'),
-                   container_dict.get('path'),
-                   container_dict.get('realname'),
-                   container_dict.get('hashed'),
-                   container_dict.get('mime', {}).get('type'),
-                   container_dict.get('mime', {}).get('text'),
-                   container_dict.get('flagged'),
-                   container_dict.get('whitelisted'),
-                   container_dict.get('blacklisted')))
+        c.executemany("INSERT INTO container VALUES "
+                      "(?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+        c.executemany("INSERT INTO tree_hash_leaf VALUES (?,?,?)", leaves)
+        c.executemany("INSERT INTO block_match VALUES (?,?,?)", matches)
+        c.executemany("INSERT INTO similar_match VALUES (?,?,?)", similar)
         c.close()
 
         self.conn.commit()
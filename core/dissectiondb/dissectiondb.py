@@ -136,6 +136,27 @@ class DissectionDB(object):
         if not self.adapter.insert(container_dict):
             return False
 
+        return True
+    ##
+    ## @brief      Persists several containers at once
+    ##
+    ## @param      container_dicts  The container dictionaries as returned by
+    ##                              Container.to_dict()
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def persist_many(self, container_dicts):
+        if not self.valid:
+            return False
+
+        if len(container_dicts) == 0:
+            return True
+
+        LGR.debug("persisting {} containers...".format(len(container_dicts)))
+        if not self.adapter.insert_many(container_dicts):
+            return False
+
         return True
 ##
 ## @brief      Class for dissection db action group.
@@ -65,3 +65,18 @@ class DissectionDBAdapter(DBAdapter):
     ##
     def insert(self, container_dict):
         raise NotImplementedError
+    ##
+    ## @brief      Inserts several containers into the database. Subclasses
+    ##             should override this method to insert them at once.
+    ##
+    ## @param      container_dicts  The container dictionaries
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, container_dicts):
+        noerr = True
+        for container_dict in container_dicts:
+            if not self.insert(container_dict):
+                noerr = False
+        return noerr
@@ -0,0 +1,513 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: sorted.py
+#     date: 2018-02-11
+#   author: koromodako
+#  purpose:
+#       Read-only hash database stored as a sorted array of fixed-width
+#       records in a single file, looked up through a memory map.
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2018 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import os
+import mmap
+import heapq
+import struct
+from utils.wrapper import trace
+from utils.wrapper import trace_func
+from utils.logging import get_logger
+from utils.configobj import ConfigObj
+from utils.binary_file import BinaryFile
+from hashdb.hashdb_adapter import HashDBAdapter
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# file layout:
+#   header | count sorted records | paths
+# header: magic, version, digest size, count, paths offset
+HEADER = struct.Struct('<4sIIQQ')
+MAGIC = b'DSHF'
+VERSION = 1
+# record: digest (digest size bytes), path offset, path length
+RECORD_TAIL = struct.Struct('<QI')
+# run record: digest (digest size bytes), path length, path
+RUN_PATH_LEN = struct.Struct('<I')
+# default number of records sorted in memory before being spilled to disk
+RUN_SIZE = 1000000
+# below this number of records, binary search is used
+SEARCH_THRESHOLD = 16
+# size of blocks used to append paths
+COPY_BLK_SZ = 1 << 20
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Class for sorted hash file.
+##
+class SortedHashFile(HashDBAdapter):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      conf  The conf
+    ##
+    def __init__(self, conf):
+        super(SortedHashFile, self).__init__(conf)
+        self.mm = None
+        self.digest_size = 0
+        self.num_records = 0
+        self.paths_offset = 0
+        self.record_size = 0
+        self.buffer = []
+        self.runs = []
+        self.files = []
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _check_conf(self):
+        if self._conf is None:
+            return False
+
+        if not self._conf.has('path'):
+            LGR.error("missing path in SortedHashFile adapter configuration.")
+            return False
+
+        run_size = self._conf.get('run_size', RUN_SIZE)
+        if not isinstance(run_size, int) or run_size <= 0:
+            LGR.error("run_size must be a positive integer.")
+            return False
+
+        return True
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def expected_conf(self):
+        return ConfigObj({
+            "path": "path/to/hash/database/file.dshf",
+            "run_size": RUN_SIZE
+        })
+    ##
+    ## @brief      Returns digest of i-th record
+    ##
+    ## @param      idx   The index
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _digest(self, idx):
+        oft = HEADER.size + idx * self.record_size
+        return self.mm[oft:oft+self.digest_size]
+    ##
+    ## @brief      Returns path of i-th record
+    ##
+    ## @param      idx   The index
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _path(self, idx):
+        oft = HEADER.size + idx * self.record_size + self.digest_size
+        (path_oft, path_len) = RECORD_TAIL.unpack_from(self.mm, oft)
+        path_oft += self.paths_offset
+        return self.mm[path_oft:path_oft+path_len].decode('utf-8')
+    ##
+    ## @brief      Finds index of the first record having a digest greater
+    ##             than or equal to given digest. Digests being uniformly
+    ##             distributed, interpolation steps are alternated with
+    ##             bisection steps which bounds the worst case.
+    ##
+    ## @param      digest  The digest
+    ## @param      lo      Index of first record to consider
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _lower_bound(self, digest, lo=0):
+        hi = self.num_records
+        key = int.from_bytes(digest[:8], 'big')
+        interpolate = True
+        while lo < hi:
+            if interpolate and hi - lo > SEARCH_THRESHOLD:
+                lo_key = int.from_bytes(self._digest(lo)[:8], 'big')
+                hi_key = int.from_bytes(self._digest(hi - 1)[:8], 'big')
+                if hi_key <= lo_key:
+                    mid = (lo + hi) // 2
+                else:
+                    mid = lo + (key - lo_key) * (hi - 1 - lo) // \
+                        (hi_key - lo_key)
+                    mid = min(max(mid, lo), hi - 1)
+            else:
+                mid = (lo + hi) // 2
+            interpolate = not interpolate
+            if self._digest(mid) < digest:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+    ##
+    ## @brief      Sorts buffered records and writes them to a run file
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _spill(self):
+        self.buffer.sort()
+        path = '{}.run{}'.format(self.path(), len(self.runs))
+        LGR.debug("spilling {} records to <{}>...".format(len(self.buffer),
+                                                          path))
+        with BinaryFile(path, 'w') as bf:
+            for (digest, path_bytes) in self.buffer:
+                bf.write(digest)
+                bf.write(RUN_PATH_LEN.pack(len(path_bytes)))
+                bf.write(path_bytes)
+        self.runs.append(path)
+        self.buffer = []
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @param      hexdigest  The hexdigest
+    ## @param      path       The path
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert(self, hexdigest, path):
+        return self.insert_many([(hexdigest, path)])
+    ##
+    ## @brief      Buffers records, they are sorted and written when the
+    ##             database is closed.
+    ##
+    ## @param      records  Iterable of (hexdigest, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, records):
+        noerr = True
+        for (hexdigest, path) in records:
+            try:
+                digest = bytes.fromhex(hexdigest)
+            except (TypeError, ValueError):
+                LGR.error("invalid hexdigest: {}".format(hexdigest))
+                noerr = False
+                continue
+
+            if self.digest_size == 0:
+                self.digest_size = len(digest)
+            elif len(digest) != self.digest_size:
+                LGR.error("digest size mismatch ({} != {}) => record "
+                          "skipped.".format(len(digest), self.digest_size))
+                noerr = False
+                continue
+
+            self.buffer.append((digest, path.encode('utf-8')))
+
+        if len(self.buffer) >= self._conf.get('run_size', RUN_SIZE):
+            self._spill()
+
+        return noerr
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @param      hexdigest  The hexdigest
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def lookup(self, hexdigest):
+        try:
+            digest = bytes.fromhex(hexdigest)
+        except (TypeError, ValueError):
+            return None
+
+        if len(digest) != self.digest_size:
+            return None
+
+        idx = self._lower_bound(digest)
+        if idx == self.num_records or self._digest(idx) != digest:
+            return None
+
+        return (hexdigest, self._path(idx))
+    ##
+    ## @brief      Looks up several hexdigests
+    ##
+    ## @param      hexdigests  The hexdigests
+    ##
+    ## @return     dict mapping found hexdigests to a path
+    ##
+    @trace()
+    def lookup_many(self, hexdigests):
+        digests = []
+        for hexdigest in set(hexdigests):
+            try:
+                digest = bytes.fromhex(hexdigest)
+            except (TypeError, ValueError):
+                continue
+            if len(digest) == self.digest_size:
+                digests.append(digest)
+        # sorted digests are searched in a shrinking range of records
+        found = {}
+        idx = 0
+        for digest in sorted(digests):
+            idx = self._lower_bound(digest, idx)
+            if idx == self.num_records:
+                break
+            if self._digest(idx) == digest:
+                found[digest.hex()] = self._path(idx)
+        return found
+    ##
+    ## @brief      Returns the number of records in the database
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def count(self):
+        return self.num_records
+    ##
+    ## @brief      Iterates over raw digests stored in the database
+    ##
+    ## @return     generator of bytes
+    ##
+    @trace()
+    def digests(self):
+        for idx in range(self.num_records):
+            yield self._digest(idx)
+    ##
+    ## @brief      Iterates over records stored in the database
+    ##
+    ## @return     generator of (hexdigest, path) tuples
+    ##
+    @trace()
+    def records(self):
+        for idx in range(self.num_records):
+            yield (self._digest(idx).hex(), self._path(idx))
+    ##
+    ## @brief      Merges this database into the other. When other is a
+    ##             sorted hash file, this file is added as an already sorted
+    ##             run to the k-way merge performed when other is closed.
+    ##             Otherwise records are streamed.
+    ##
+    ## @param      other  The other
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def merge_into(self, other):
+        if not isinstance(other, SortedHashFile):
+            return super(SortedHashFile, self).merge_into(other)
+
+        return other.add_sorted_file(self.path(), self.digest_size)
+    ##
+    ## @brief      Adds a sorted hash file to be merged when this database is
+    ##             closed.
+    ##
+    ## @param      path         The path
+    ## @param      digest_size  The digest size
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def add_sorted_file(self, path, digest_size):
+        if digest_size == 0:
+            return True     # empty file
+
+        if self.digest_size == 0:
+            self.digest_size = digest_size
+        elif digest_size != self.digest_size:
+            LGR.error("digest size mismatch ({} != {}) => <{}> "
+                      "skipped.".format(digest_size, self.digest_size, path))
+            return False
+
+        self.files.append(path)
+        return True
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _init_r(self):
+        try:
+            with open(self.path(), 'rb') as f:
+                self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            LGR.error("failed to map <{}>: {}".format(self.path(), e))
+            return False
+
+        if len(self.mm) < HEADER.size:
+            LGR.error("truncated hash file <{}>.".format(self.path()))
+            self.mm.close()
+            self.mm = None
+            return False
+
+        (magic, version, self.digest_size, self.num_records, self.paths_offset) = \
+            HEADER.unpack_from(self.mm)
+        self.record_size = self.digest_size + RECORD_TAIL.size
+        if (magic != MAGIC or version != VERSION or
+           self.paths_offset != HEADER.size + self.num_records * self.record_size or
+           self.paths_offset > len(self.mm)):
+            LGR.error("invalid hash file <{}>.".format(self.path()))
+            self.mm.close()
+            self.mm = None
+            return False
+
+        return True
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _init_w(self):
+        self.digest_size = 0
+        self.buffer = []
+        self.runs = []
+        self.files = []
+        try:
+            with open(self.path(), 'ab'):
+                pass
+        except OSError as e:
+            LGR.error("cannot write <{}>: {}".format(self.path(), e))
+            return False
+
+        return True
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _term_r(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+    ##
+    ## @brief      Merges sorted runs into the final file, duplicate records
+    ##             are removed.
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _term_w(self):
+        self.buffer.sort()
+        sources = [self.buffer]
+        sources += [iter_run(run, self.digest_size) for run in self.runs]
+        sources += [iter_file(path) for path in self.files]
+        self._write(heapq.merge(*sources))
+        for run in self.runs:
+            os.remove(run)
+        self.buffer = []
+        self.runs = []
+        self.files = []
+    ##
+    ## @brief      Writes sorted (digest, path) records to the database file.
+    ##
+    ## @param      records  The records
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _write(self, records):
+        path = self.path()
+        tmp = '{}.tmp'.format(path)
+        paths_tmp = '{}.paths'.format(path)
+        count = 0
+        paths_size = 0
+        previous = None
+        with BinaryFile(tmp, 'w') as bf:
+            bf.write(HEADER.pack(MAGIC, VERSION, self.digest_size, 0, 0))
+            # records are written in place, paths are gathered in a separate
+            # file then appended
+            with BinaryFile(paths_tmp, 'w') as pbf:
+                for record in records:
+                    if record == previous:
+                        continue
+                    previous = record
+                    (digest, path_bytes) = record
+                    bf.write(digest)
+                    bf.write(RECORD_TAIL.pack(paths_size, len(path_bytes)))
+                    pbf.write(path_bytes)
+                    paths_size += len(path_bytes)
+                    count += 1
+            paths_offset = HEADER.size + count * \
+                (self.digest_size + RECORD_TAIL.size)
+            with BinaryFile(paths_tmp, 'r') as pbf:
+                while True:
+                    data = pbf.read(COPY_BLK_SZ)
+                    if len(data) == 0:
+                        break
+                    bf.write(data)
+            bf.seek(0)
+            bf.write(HEADER.pack(MAGIC, VERSION, self.digest_size, count,
+                                 paths_offset))
+        os.remove(paths_tmp)
+        os.replace(tmp, path)
+        LGR.info("{} records written to <{}>.".format(count, path))
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+##
+## @brief      Iterates over records of a sorted run file
+##
+## @param      path         The path
+## @param      digest_size  The digest size
+##
+## @return     generator of (digest, path) tuples
+##
+@trace_func(__name__)
+def iter_run(path, digest_size):
+    with BinaryFile(path, 'r') as bf:
+        while True:
+            digest = bf.read(digest_size)
+            if len(digest) < digest_size:
+                break
+            (sz,) = RUN_PATH_LEN.unpack(bf.read(RUN_PATH_LEN.size))
+            yield (digest, bf.read(sz))
+##
+## @brief      Iterates over records of a sorted hash file
+##
+## @param      path  The path
+##
+## @return     generator of (digest, path) tuples
+##
+@trace_func(__name__)
+def iter_file(path):
+    adapter = SortedHashFile(ConfigObj({'path': path}))
+    adapter.init('r')
+    if not adapter.is_valid():
+        return
+    try:
+        for idx in range(adapter.num_records):
+            yield (adapter._digest(idx), adapter._path(idx).encode('utf-8'))
+    finally:
+        adapter.term()
+##
+## @brief      { function_description }
+##
+## @param      conf  The conf
+##
+## @return     { description_of_the_return_value }
+##
+@trace_func(__name__)
+def instance(conf):
+    return SortedHashFile(conf)
@@ -25,7 +25,9 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
+import os
 import sqlite3
+from utils.fuzzy_hash import index_keys
 from utils.wrapper import trace
 from utils.wrapper import trace_func
 from utils.logging import get_logger
@@ -35,6 +37,15 @@ from hashdb.hashdb_adapter import HashDBAdapter
 #  GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# layouts, stored in database user_version
+LAYOUT_TEXT = 0     # hexdigest stored as text, indexed
+LAYOUT_BINARY = 1   # raw digest stored as blob, clustered primary key
+# default number of rows inserted per transaction
+COMMIT_SIZE = 100000
+# maximum number of digests per lookup query
+LOOKUP_CHUNK = 500
+# journal modes accepted in configuration
+JOURNAL_MODES = ['delete', 'truncate', 'persist', 'memory', 'wal', 'off']
 # =============================================================================
 #  CLASSES
 # =============================================================================
@@ -49,6 +60,14 @@ class SQLiteDB(HashDBAdapter):
     ##
     def __init__(self, conf):
         super(SQLiteDB, self).__init__(conf)
+        self.conn = None
+        self.binary = False
+        self.load_table = 'container_hash'
+        self.fuzzy_load_table = 'fuzzy_ngram'
+        self.fuzzy = False
+        self.journal_mode = 'wal'
+        self.commit_size = COMMIT_SIZE
+        self.uncommitted = 0
     ##
     ## @brief      { function_description }
     ##
@@ -63,6 +82,16 @@ class SQLiteDB(HashDBAdapter):
             LGR.error("missing path in SQLiteDB adapter configuration.")
             return False
 
+        journal_mode = self._conf.get('journal_mode', 'wal')
+        if journal_mode not in JOURNAL_MODES:
+            LGR.error("journal_mode must be one of {}.".format(JOURNAL_MODES))
+            return False
+
+        commit_size = self._conf.get('commit_size', COMMIT_SIZE)
+        if not isinstance(commit_size, int) or commit_size <= 0:
+            LGR.error("commit_size must be a positive integer.")
+            return False
+
         return True
     ##
     ## @brief      { function_description }
@@ -71,7 +100,34 @@ class SQLiteDB(HashDBAdapter):
     ##
     @trace()
     def expected_conf(self):
-        return ConfigObj({"path": "path/to/hash/database/file.db"})
+        return ConfigObj({
+            "path": "path/to/hash/database/file.db",
+            "binary": False,
+            "journal_mode": "wal",
+            "commit_size": COMMIT_SIZE
+        })
+    ##
+    ## @brief      Converts a hexdigest to the key stored in the database
+    ##
+    ## @param      hexdigest  The hexdigest
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _key(self, hexdigest):
+        if self.binary:
+            return bytes.fromhex(hexdigest)
+        return hexdigest
+    ##
+    ## @brief      Converts a key stored in the database to a hexdigest
+    ##
+    ## @param      key   The key
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _hexdigest(self, key):
+        if self.binary:
+            return key.hex()
+        return key
     ##
     ## @brief      { function_description }
     ##
@@ -82,16 +138,34 @@ class SQLiteDB(HashDBAdapter):
     ##
     @trace()
     def insert(self, hexdigest, path):
-        self._lock.acquire()
+        return self.insert_many([(hexdigest, path)])
+    ##
+    ## @brief      Inserts several hash tuples, a transaction is committed
+    ##             every commit_size rows.
+    ##
+    ## @param      records  Iterable of (hexdigest, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, records):
+        try:
+            rows = [(self._key(hexdigest), path)
+                    for (hexdigest, path) in records]
+        except (TypeError, ValueError) as e:
+            LGR.error("invalid hexdigest in records: {}".format(e))
+            return False
 
         c = self.conn.cursor()
-        c.execute("INSERT INTO container_hash VALUES (?, ?)",
-                  (hexdigest, path))
+        c.executemany("INSERT INTO {} VALUES (?, ?)".format(self.load_table),
+                      rows)
         c.close()
 
-        self.conn.commit()
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.commit_size:
+            self.conn.commit()
+            self.uncommitted = 0
 
-        self._lock.release()
         return True
     ##
     ## @brief      { function_description }
@@ -102,37 +176,311 @@ class SQLiteDB(HashDBAdapter):
     ##
     @trace()
     def lookup(self, hexdigest):
-        self._lock()
+        try:
+            key = self._key(hexdigest)
+        except (TypeError, ValueError):
+            return None
 
         c = self.conn.cursor()
-        c.execute("SELECT * FROM container_hash WHERE hash=?", (hexdigest))
+        c.execute("SELECT hash, abspath FROM container_hash WHERE hash=? "
+                  "LIMIT 1", (key,))
         record = c.fetchone()
         c.close()
 
-        self._lock.release()
-        return record
+        if record is None:
+            return None
+
+        return (self._hexdigest(record[0]), record[1])
     ##
-    ## @brief      { function_description }
+    ## @brief      Looks up several hexdigests using as few queries as
+    ##             possible.
     ##
-    ## @param      other  The other
+    ## @param      hexdigests  The hexdigests
+    ##
+    ## @return     dict mapping found hexdigests to a path
+    ##
+    @trace()
+    def lookup_many(self, hexdigests):
+        keys = []
+        for hexdigest in set(hexdigests):
+            try:
+                keys.append(self._key(hexdigest))
+            except (TypeError, ValueError):
+                continue
+
+        found = {}
+        c = self.conn.cursor()
+        for i in range(0, len(keys), LOOKUP_CHUNK):
+            chunk = keys[i:i+LOOKUP_CHUNK]
+            c.execute("SELECT hash, abspath FROM container_hash "
+                      "WHERE hash IN ({})".format(','.join('?' * len(chunk))),
+                      chunk)
+            for (key, abspath) in c:
+                found.setdefault(self._hexdigest(key), abspath)
+        c.close()
+
+        return found
+    ##
+    ## @brief      Returns the number of records in the database
     ##
     ## @return     { description_of_the_return_value }
     ##
     @trace()
-    def merge_into(self, other):
-        self._lock.acquire()
+    def count(self):
+        c = self.conn.cursor()
+        c.execute("SELECT COUNT(*) FROM container_hash")
+        count = c.fetchone()[0]
+        c.close()
+        return count
+    ##
+    ## @brief      Iterates over raw digests stored in the database
+    ##
+    ## @return     generator of bytes
+    ##
+    @trace()
+    def digests(self):
+        c = self.conn.cursor()
+        c.execute("SELECT hash FROM container_hash")
+        for (key,) in c:
+            if self.binary:
+                yield key
+                continue
+            try:
+                yield bytes.fromhex(key)
+            except (TypeError, ValueError):
+                continue
+        c.close()
+    ##
+    ## @brief      Iterates over records stored in the database
+    ##
+    ## @return     generator of (hexdigest, path) tuples
+    ##
+    @trace()
+    def records(self):
+        c = self.conn.cursor()
+        c.execute("SELECT hash, abspath FROM container_hash")
+        for (key, abspath) in c:
+            yield (self._hexdigest(key), abspath)
+        c.close()
+    ##
+    ## @brief      Inserts fuzzy hash signatures, each one is indexed under
+    ##             its (block size, n-gram) keys.
+    ##
+    ## @param      records  Iterable of (signature, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_fuzzy_many(self, records):
+        ngrams = []
+        c = self.conn.cursor()
+        for (signature, path) in records:
+            try:
+                keys = index_keys(signature)
+            except ValueError:
+                LGR.warn("invalid fuzzy hash signature of <{}> => "
+                         "skipped.".format(path))
+                continue
+            c.execute("INSERT INTO fuzzy_hash(signature, abspath) "
+                      "VALUES (?, ?)", (signature, path))
+            ngrams += [key + (c.lastrowid,) for key in keys]
+        c.executemany("INSERT INTO {} VALUES (?, ?, ?)".format(
+            self.fuzzy_load_table), ngrams)
+        c.close()
+
+        self.uncommitted += len(ngrams)
+        if self.uncommitted >= self.commit_size:
+            self.conn.commit()
+            self.uncommitted = 0
+
+        return True
+    ##
+    ## @brief      Returns signatures sharing at least one (block size,
+    ##             n-gram) key with given signature, only the index is
+    ##             searched.
+    ##
+    ## @param      signature  The signature
+    ##
+    ## @return     list of (signature, path) tuples
+    ##
+    @trace()
+    def lookup_fuzzy(self, signature):
+        if not self.fuzzy:
+            return []
+
+        try:
+            keys = index_keys(signature)
+        except ValueError:
+            return []
+
+        grams = {}
+        for (block_size, ngram) in keys:
+            grams.setdefault(block_size, []).append(ngram)
+
+        ids = set()
+        c = self.conn.cursor()
+        for (block_size, values) in grams.items():
+            for i in range(0, len(values), LOOKUP_CHUNK):
+                chunk = values[i:i+LOOKUP_CHUNK]
+                c.execute("SELECT id FROM fuzzy_ngram WHERE block_size=? "
+                          "AND ngram IN ({})".format(
+                              ','.join('?' * len(chunk))),
+                          [block_size] + chunk)
+                ids.update(row[0] for row in c)
+
+        ids = list(ids)
+        candidates = []
+        for i in range(0, len(ids), LOOKUP_CHUNK):
+            chunk = ids[i:i+LOOKUP_CHUNK]
+            c.execute("SELECT signature, abspath FROM fuzzy_hash "
+                      "WHERE id IN ({})".format(','.join('?' * len(chunk))),
+                      chunk)
+            candidates += c.fetchall()
+        c.close()
+
+        return candidates
+    ##
+    ## @brief      Iterates over fuzzy hash signatures stored in the database
+    ##
+    ## @return     generator of (signature, path) tuples
+    ##
+    @trace()
+    def fuzzy_records(self):
+        if not self.fuzzy:
+            return
+        c = self.conn.cursor()
+        c.execute("SELECT signature, abspath FROM fuzzy_hash")
+        for record in c:
+            yield record
+        c.close()
+    ##
+    ## @brief      Returns stat of files recorded in the database
+    ##
+    ## @return     dict mapping path to (size, mtime_ns, inode) tuple
+    ##
+    @trace()
+    def stats(self):
+        c = self.conn.cursor()
+        c.execute("SELECT abspath, size, mtime_ns, inode FROM file_stat")
+        stats = {row[0]: tuple(row[1:]) for row in c}
+        c.close()
+        return stats
+    ##
+    ## @brief      Records stat of hashed files
+    ##
+    ## @param      rows  Iterable of (path, size, mtime_ns, inode, hexdigest)
+    ##                   tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def update_stats(self, rows):
+        try:
+            rows = [row[:4] + (self._key(row[4]),) for row in rows]
+        except (TypeError, ValueError) as e:
+            LGR.error("invalid hexdigest in rows: {}".format(e))
+            return False
 
         c = self.conn.cursor()
-        c.execute("SELECT * FROM container_hash")
+        c.executemany("INSERT OR REPLACE INTO file_stat VALUES (?,?,?,?,?)",
+                      rows)
+        c.close()
 
-        v = c.fetchone()
-        while v is not None:
-            other.insert(v[0], v[1])
-            v = c.fetchone()
+        self.uncommitted += len(rows)
+        if self.uncommitted >= self.commit_size:
+            self.conn.commit()
+            self.uncommitted = 0
 
+        return True
+    ##
+    ## @brief      Removes records and stat of given paths
+    ##
+    ## @param      paths  The paths
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def remove(self, paths):
+        paths = list(paths)
+        c = self.conn.cursor()
+        for i in range(0, len(paths), LOOKUP_CHUNK):
+            chunk = paths[i:i+LOOKUP_CHUNK]
+            params = ','.join('?' * len(chunk))
+            # records are found through their hash which is indexed
+            c.execute("SELECT hash, abspath FROM file_stat "
+                      "WHERE abspath IN ({})".format(params), chunk)
+            records = c.fetchall()
+            c.executemany("DELETE FROM container_hash "
+                          "WHERE hash=? AND abspath=?", records)
+            c.execute("DELETE FROM file_stat "
+                      "WHERE abspath IN ({})".format(params), chunk)
+            # n-grams are found through their keys which are indexed
+            c.execute("SELECT id, signature FROM fuzzy_hash "
+                      "WHERE abspath IN ({})".format(params), chunk)
+            signatures = c.fetchall()
+            c.executemany("DELETE FROM fuzzy_ngram WHERE block_size=? AND "
+                          "ngram=? AND id=?",
+                          [key + (rowid,)
+                           for (rowid, signature) in signatures
+                           for key in index_keys(signature)])
+            c.executemany("DELETE FROM fuzzy_hash WHERE id=?",
+                          [(rowid,) for (rowid, signature) in signatures])
         c.close()
+        self.conn.commit()
+        return True
+    ##
+    ## @brief      Merges this database into the other. When other is a
+    ##             sqlite database, rows are copied by sqlite itself using a
+    ##             single INSERT ... SELECT statement, duplicates are removed
+    ##             when other is closed. Otherwise records are streamed.
+    ##
+    ## @param      other  The other
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def merge_into(self, other):
+        if not isinstance(other, SQLiteDB):
+            return super(SQLiteDB, self).merge_into(other)
+
+        if self.binary == other.binary:
+            select = "SELECT hash, abspath FROM src.container_hash"
+        elif self.binary:
+            select = "SELECT lower(hex(hash)), abspath FROM src.container_hash"
+        else:
+            # text to blob conversion is not available in every sqlite
+            return super(SQLiteDB, self).merge_into(other)
+
+        if not other.attach_and_copy(self.path(), select):
+            return False
+
+        return self.merge_fuzzy_into(other)
+    ##
+    ## @brief      Attaches another database and copies rows returned by
+    ##             select statement.
+    ##
+    ## @param      path    The path of the database to attach as 'src'
+    ## @param      select  The select statement
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def attach_and_copy(self, path, select):
+        self.conn.commit()
+        try:
+            c = self.conn.cursor()
+            c.execute("ATTACH DATABASE ? AS src",
+                      ('file:{}?mode=ro'.format(path),))
+            c.execute("INSERT INTO {} {}".format(self.load_table, select))
+            LGR.info("{} rows copied from <{}>.".format(c.rowcount, path))
+            self.conn.commit()
+            c.execute("DETACH DATABASE src")
+            c.close()
+        except sqlite3.Error as e:
+            LGR.error("failed to copy rows from <{}>: {}".format(path, e))
+            self.conn.rollback()
+            return False
 
-        self._lock.release()
         return True
     ##
     ## @brief      { function_description }
@@ -142,8 +490,21 @@ class SQLiteDB(HashDBAdapter):
     @trace()
     def _init_r(self):
         try:
-            uri = 'file:{}?mode=ro'.format(self._conf.path)
+            uri = 'file:{}?mode=ro'.format(self.path())
             self.conn = sqlite3.connect(uri, uri=True)
+            c = self.conn.cursor()
+            c.execute("PRAGMA user_version")
+            self.binary = (c.fetchone()[0] == LAYOUT_BINARY)
+            c.execute("SELECT COUNT(*) FROM sqlite_master "
+                      "WHERE type='table' AND name='container_hash'")
+            if c.fetchone()[0] == 0:
+                LGR.error("<{}> is not a hash database.".format(self.path()))
+                return False
+            # databases created before fuzzy hashes were supported
+            c.execute("SELECT COUNT(*) FROM sqlite_master "
+                      "WHERE type='table' AND name='fuzzy_hash'")
+            self.fuzzy = (c.fetchone()[0] > 0)
+            c.close()
         except Exception as e:
             LGR.exception("failed to init sqlite3 database.")
             return False
@@ -156,23 +517,117 @@ class SQLiteDB(HashDBAdapter):
     ##
     @trace()
     def _init_w(self):
+        self.binary = self._conf.get('binary', False)
+        self.journal_mode = self._conf.get('journal_mode', 'wal')
+        self.commit_size = self._conf.get('commit_size', COMMIT_SIZE)
+        self.uncommitted = 0
+
         try:
-            uri = 'file:{}?mode=rwc'.format(self._conf.path)
+            uri = 'file:{}?mode=rwc'.format(self.path())
             self.conn = sqlite3.connect(uri, uri=True)
         except Exception as e:
             LGR.exception("failed to init sqlite3 database.")
             return False
 
         c = self.conn.cursor()
+        c.execute("PRAGMA journal_mode={}".format(self.journal_mode))
         c.execute("DROP INDEX IF EXISTS container_hash_idx")
         c.execute("DROP TABLE IF EXISTS container_hash")
-        c.execute("CREATE TABLE container_hash(hash, abspath)")
-        c.execute("CREATE INDEX container_hash_idx ON container_hash(hash)")
+        c.execute("DROP TABLE IF EXISTS file_stat")
+        c.execute("DROP TABLE IF EXISTS fuzzy_hash")
+        c.execute("DROP TABLE IF EXISTS fuzzy_ngram")
+        # rows are appended to a table without index (a temporary one for the
+        # binary layout), primary key or index is built once bulk load is
+        # over, see _term_w
+        if self.binary:
+            c.execute("CREATE TABLE container_hash("
+                      "hash BLOB NOT NULL, "
+                      "abspath TEXT NOT NULL, "
+                      "PRIMARY KEY(hash, abspath)) WITHOUT ROWID")
+            c.execute("PRAGMA user_version={}".format(LAYOUT_BINARY))
+        else:
+            c.execute("CREATE TABLE container_hash(hash, abspath)")
+            c.execute("PRAGMA user_version={}".format(LAYOUT_TEXT))
+        self._prepare(c)
+        c.close()
+        self.conn.commit()
+
+        return True
+    ##
+    ## @brief      Opens an existing database to add, replace or remove
+    ##             records.
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def _init_u(self):
+        self.journal_mode = self._conf.get('journal_mode', 'wal')
+        self.commit_size = self._conf.get('commit_size', COMMIT_SIZE)
+        self.uncommitted = 0
+
+        if not os.path.isfile(self.path()):
+            LGR.error("cannot update <{}>, database must be created "
+                      "first.".format(self.path()))
+            return False
+
+        try:
+            uri = 'file:{}?mode=rw'.format(self.path())
+            self.conn = sqlite3.connect(uri, uri=True)
+            c = self.conn.cursor()
+            c.execute("PRAGMA user_version")
+            self.binary = (c.fetchone()[0] == LAYOUT_BINARY)
+            c.execute("SELECT COUNT(*) FROM sqlite_master "
+                      "WHERE type='table' AND name='container_hash'")
+            if c.fetchone()[0] == 0:
+                LGR.error("<{}> is not a hash database.".format(self.path()))
+                return False
+        except Exception as e:
+            LGR.exception("failed to init sqlite3 database.")
+            return False
+
+        c.execute("PRAGMA journal_mode={}".format(self.journal_mode))
+        self._prepare(c)
         c.close()
         self.conn.commit()
 
         return True
     ##
+    ## @brief      Creates tables used while loading records
+    ##
+    ## @param      c     Cursor
+    ##
+    @trace()
+    def _prepare(self, c):
+        # stat of hashed files used by update mode
+        c.execute("CREATE TABLE IF NOT EXISTS file_stat("
+                  "abspath TEXT PRIMARY KEY, "
+                  "size INTEGER, "
+                  "mtime_ns INTEGER, "
+                  "inode INTEGER, "
+                  "hash)")
+        # fuzzy hash signatures and their n-gram index, n-grams are
+        # appended to a temporary table and sorted into the index once bulk
+        # load is over, see _term_w
+        c.execute("CREATE TABLE IF NOT EXISTS fuzzy_hash("
+                  "id INTEGER PRIMARY KEY, "
+                  "signature TEXT NOT NULL, "
+                  "abspath TEXT NOT NULL)")
+        c.execute("CREATE INDEX IF NOT EXISTS fuzzy_hash_abspath_idx "
+                  "ON fuzzy_hash(abspath)")
+        c.execute("CREATE TABLE IF NOT EXISTS fuzzy_ngram("
+                  "block_size INTEGER NOT NULL, "
+                  "ngram INTEGER NOT NULL, "
+                  "id INTEGER NOT NULL, "
+                  "PRIMARY KEY(block_size, ngram, id)) WITHOUT ROWID")
+        c.execute("CREATE TEMP TABLE fuzzy_ngram_load(block_size, ngram, id)")
+        self.fuzzy_load_table = 'fuzzy_ngram_load'
+        self.fuzzy = True
+        if self.binary:
+            c.execute("CREATE TEMP TABLE container_hash_load(hash, abspath)")
+            self.load_table = 'container_hash_load'
+        else:
+            self.load_table = 'container_hash'
+    ##
     ## @brief      { function_description }
     ##
     ## @return     { description_of_the_return_value }
@@ -187,6 +642,36 @@ class SQLiteDB(HashDBAdapter):
     ##
     @trace()
     def _term_w(self):
+        self.conn.commit()
+        c = self.conn.cursor()
+        LGR.info("building hash index...")
+        if self.binary:
+            # sorted rows are appended to the b-tree, duplicates are ignored
+            c.execute("INSERT OR IGNORE INTO container_hash "
+                      "SELECT hash, abspath FROM container_hash_load "
+                      "ORDER BY hash, abspath")
+            c.execute("DROP TABLE container_hash_load")
+        else:
+            # same guarantee as the primary key of the binary layout, update
+            # mode removes records of a path before inserting new ones
+            if self.mode() == 'w':
+                LGR.info("removing duplicates...")
+                c.execute("DELETE FROM container_hash WHERE rowid NOT IN ("
+                          "SELECT MIN(rowid) FROM container_hash "
+                          "GROUP BY hash, abspath)")
+            c.execute("CREATE INDEX IF NOT EXISTS container_hash_idx "
+                      "ON container_hash(hash)")
+        LGR.info("building fuzzy hash index...")
+        c.execute("INSERT OR IGNORE INTO fuzzy_ngram "
+                  "SELECT block_size, ngram, id FROM fuzzy_ngram_load "
+                  "ORDER BY block_size, ngram, id")
+        c.execute("DROP TABLE fuzzy_ngram_load")
+        self.conn.commit()
+        if self.journal_mode == 'wal':
+            # leave a self-contained file which can be opened read-only
+            c.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            c.execute("PRAGMA journal_mode=DELETE")
+        c.close()
         self.conn.close()
 # =============================================================================
 #  FUNCTIONS
@@ -31,39 +31,225 @@ from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.wrapper import trace_func
 from utils.wrapper import trace_static
+from utils.crypto import hashbuf
+from utils.crypto import hashblocks
+from utils.crypto import hashbf_blocks
+from utils.crypto import hexdigest
+from utils.crypto import FUZZY_HASH_FUNC
+from utils.fuzzy_hash import compare
+from utils.fuzzy_hash import available as fuzzy_available
+from utils.hash_cache import hashfiles
 from utils.workerpool import WorkerPool
 from utils.binary_file import BinaryFile
+from utils.bloom_filter import BloomFilter
 from utils.action_group import ActionGroup
-from container.container import Container
+from utils.formatting import format_size
 from utils.plugin_importer import PluginImporter
 # =============================================================================
 # GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+BLOOM_FP_RATE = 0.001
+# number of distinct block digests looked up at once by HashDB.scan_blocks()
+BLOCK_LOOKUP_BATCH = 4096
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 ##
-## @brief      { function_description }
+## @brief      Hashes a chunk of files, no container is built as only the
+##             digest is required: MIME detection is skipped entirely.
+##             Digests found in the hash cache are not computed again.
 ##
-## @param      fpath   The fpath
-## @param      hashdb  The hashdb
+## @param      task         HashingTask instance
+## @param      hash_func    The hash function
+## @param      hash_threads Number of threads hashing files of the chunk
+##                          concurrently
+## @param      fuzzy        Whether fuzzy hashes are computed too, in the
+##                          same pass
 ##
-## @return     { description_of_the_return_value }
+## @return     ([], [list of (record, stat, fuzzy record) tuples]) tuple
 ##
 @trace_func(__name__)
-def hashing_routine(fpath, hashdb):
-    LGR.info("hashing <{}>...".format(fpath))
-    container = Container(fpath, os.path.basename(fpath))
+def hashing_routine(task, hash_func, hash_threads=1, fuzzy=False):
+    stats = {}
+    for fpath in task.fpaths:
+        try:
+            stats[fpath] = os.stat(fpath)
+        except OSError as e:
+            LGR.warn("cannot stat <{}>: {} => skipped.".format(fpath, e))
 
-    hashdb.persist(container)
-    hashdb.term()
+    hash_funcs = [hash_func]
+    if fuzzy:
+        hash_funcs.append(FUZZY_HASH_FUNC)
 
-    return ([], [])
+    results = []
+    for (fpath, digests) in hashfiles(hash_funcs, stats, hash_threads):
+        if digests is None:
+            continue
+
+        st = stats[fpath]
+        hashed = digests[hash_func].hex()
+        record = (hashed, fpath)
+        stat = (fpath, st.st_size, st.st_mtime_ns, st.st_ino, hashed)
+        fuzzy_record = None
+        if fuzzy:
+            fuzzy_record = (hexdigest(FUZZY_HASH_FUNC,
+                                      digests[FUZZY_HASH_FUNC]), fpath)
+        results.append((record, stat, fuzzy_record))
+    # a single message per chunk limits IPC overhead
+    return ([], [results])
+##
+## @brief      Hashes every aligned block of a chunk of files, blocks filled
+##             with zeros are skipped as they would match anything.
+##
+## @param      task        HashingTask instance
+## @param      hash_func   The hash function
+## @param      block_size  The block size
+##
+## @return     ([], [list of (record, None, None) tuples]) tuple
+##
+@trace_func(__name__)
+def block_hashing_routine(task, hash_func, block_size):
+    zero = hashbuf(hash_func, bytes(block_size))
+    results = []
+    for fpath in task.fpaths:
+        try:
+            for (offset, digest) in hashblocks(hash_func, fpath, block_size):
+                if digest != zero:
+                    record = (digest.hex(), block_path(fpath, offset))
+                    results.append((record, None, None))
+        except OSError as e:
+            LGR.warn("failed to hash blocks of <{}>: {} => "
+                     "skipped.".format(fpath, e))
+    # a single message per chunk limits IPC overhead
+    return ([], [results])
+##
+## @brief      Returns the path recorded for a block of a file
+##
+## @param      path    The path
+## @param      offset  The offset
+##
+## @return     'path@offset' string
+##
+@trace_func(__name__)
+def block_path(path, offset):
+    return '{}@{}'.format(path, offset)
+##
+## @brief      Splits a path recorded for a block of a file
+##
+## @param      path  'path@offset' string
+##
+## @return     (path, offset) tuple
+##
+@trace_func(__name__)
+def split_block_path(path):
+    (path, _, offset) = path.rpartition('@')
+    return (path, int(offset))
+##
+## @brief      Groups files into chunks, a chunk is closed when it reaches
+##             max_files files or max_size bytes.
+##
+## @param      fpaths     The fpaths
+## @param      max_files  The maximum number of files per chunk
+## @param      max_size   The maximum cumulated size of files per chunk
+##
+## @return     generator of HashingTask instances
+##
+@trace_func(__name__)
+def chunk_files(fpaths, max_files, max_size):
+    task = HashingTask()
+    for fpath in fpaths:
+        try:
+            size = os.stat(fpath).st_size
+        except OSError as e:
+            LGR.warn("cannot stat <{}>: {} => skipped.".format(fpath, e))
+            continue
+
+        task.append(fpath, size)
+        if len(task.fpaths) >= max_files or task.size >= max_size:
+            yield task
+            task = HashingTask()
+
+    if len(task.fpaths) > 0:
+        yield task
+##
+## @brief      Compares enumerated files with stats recorded in a database.
+##
+## @param      known      Recorded stats, see HashDB.stats()
+## @param      fpaths     Enumerated files
+## @param      dirs       Enumerated directories
+## @param      recursive  Whether directories were enumerated recursively
+##
+## @return     (files to hash, paths to remove from database) tuple
+##
+@trace_func(__name__)
+def changed_files(known, fpaths, dirs, recursive):
+    roots = [os.path.join(os.path.abspath(dpath), '') for dpath in dirs]
+    changed = []
+    removed = []
+    seen = set()
+
+    for fpath in fpaths:
+        seen.add(fpath)
+        previous = known.get(fpath)
+        if previous is None:
+            changed.append(fpath)
+            continue
+        try:
+            st = os.stat(fpath)
+        except OSError:
+            continue
+        if previous != (st.st_size, st.st_mtime_ns, st.st_ino):
+            changed.append(fpath)
+            removed.append(fpath)
+
+    # recorded paths which were not enumerated have vanished
+    for path in known.keys():
+        if path in seen:
+            continue
+        for root in roots:
+            if recursive:
+                enumerated = path.startswith(root)
+            else:
+                enumerated = (os.path.join(os.path.dirname(path), '') == root)
+            if enumerated:
+                removed.append(path)
+                break
+
+    return (changed, removed)
 # =============================================================================
 # CLASSES
 # =============================================================================
 ##
+## @brief      Chunk of files hashed by a single worker task.
+##
+class HashingTask(object):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    def __init__(self):
+        super(HashingTask, self).__init__()
+        self.fpaths = []
+        self.size = 0
+    ##
+    ## @brief      Adds a file to the chunk
+    ##
+    ## @param      fpath  The fpath
+    ## @param      size   The size
+    ##
+    def append(self, fpath, size):
+        self.fpaths.append(fpath)
+        self.size += size
+    ##
+    ## @brief      Returns a string representation of the object.
+    ##
+    ## @return     String representation of the object.
+    ##
+    def __str__(self):
+        return "{} file(s), {} from {}".format(len(self.fpaths),
+                                               format_size(self.size),
+                                               self.fpaths[0])
+##
 ## @brief      Class for hash db.
 ##
 class HashDB(object):
@@ -81,11 +267,15 @@ class HashDB(object):
         self.conf = conf
         LGR.debug("hashdb configuration:\n{}".format(conf))
         self.name = None
-        if self.conf is not None:
-            self.name = self.conf.get('name')
+        if self.conf is not None and self.conf.has('adapter'):
+            # name sits in adapter's configuration
+            adapter_conf = self.conf.get(self.conf.adapter)
+            if adapter_conf is not None:
+                self.name = adapter_conf.get('name')
 
         self.valid = False
         self.adapter = None
+        self.bloom = None
 
         if HashDB.ADAPTERS is None:
             pi = PluginImporter('hashdb.adapters',
@@ -131,12 +321,106 @@ class HashDB(object):
             return False
 
         self.valid = True
+
+        if (mode == 'r' and self.bloom is None and
+           self.conf.get('bloom_filter', False)):
+            self.bloom = self.__load_bloom()
+
         return True
     ##
+    ## @brief      Loads bloom filter persisted alongside the database, it is
+    ##             (re)built when missing or older than the database.
+    ##
+    ## @return     BloomFilter instance or None
+    ##
+    @trace()
+    def __load_bloom(self):
+        db_path = self.adapter.path()
+        bloom_path = self.conf.get('bloom_path')
+        if bloom_path is None:
+            if db_path is None:
+                LGR.warn("bloom_path is required by this adapter => bloom "
+                         "filter disabled.")
+                return None
+            bloom_path = '{}.bloom'.format(db_path)
+        bloom_path = os.path.expanduser(bloom_path)
+
+        if os.path.isfile(bloom_path) and (
+           db_path is None or
+           os.path.getmtime(bloom_path) >= os.path.getmtime(db_path)):
+            bloom = BloomFilter.load(bloom_path)
+            if bloom is not None:
+                LGR.info("bloom filter loaded: {}".format(bloom))
+                return bloom
+
+        LGR.info("building bloom filter of <{}>...".format(self.name))
+        fp_rate = self.conf.get('bloom_fp_rate', BLOOM_FP_RATE)
+        try:
+            bloom = BloomFilter.create(self.adapter.count(), fp_rate)
+            for digest in self.adapter.digests():
+                bloom.add(digest)
+        except NotImplementedError:
+            LGR.warn("adapter cannot enumerate digests => bloom filter "
+                     "disabled.")
+            return None
+        LGR.info("bloom filter built: {}".format(bloom))
+        # mapping saved file lets every process share the same pages
+        if bloom.save(bloom_path):
+            saved = BloomFilter.load(bloom_path)
+            if saved is not None:
+                return saved
+
+        return bloom
+    ##
+    ## @brief      Returns size of blocks recorded in the database
+    ##
+    ## @return     block size, 0 if database records whole files
+    ##
+    @trace()
+    def block_size(self):
+        if self.conf is None:
+            return 0
+
+        return self.conf.get('block_size', 0)
+    ##
+    ## @brief      Determines if fuzzy hashes of files are recorded along with
+    ##             their digest.
+    ##
+    ## @return     True if fuzzy hashes are recorded, False otherwise.
+    ##
+    @trace()
+    def fuzzy_hash(self):
+        if self.conf is None:
+            return False
+
+        return self.conf.get('fuzzy_hash', False)
+    ##
+    ## @brief      Determines if hexdigest may be in the database according
+    ##             to bloom filter.
+    ##
+    ## @param      hexdigest  The hexdigest
+    ##
+    ## @return     False if hexdigest is definitely not in the database
+    ##
+    @trace()
+    def __may_contain(self, hexdigest):
+        if self.bloom is None:
+            return True
+
+        try:
+            digest = bytes.fromhex(hexdigest)
+        except (TypeError, ValueError):
+            return True
+
+        return digest in self.bloom
+    ##
     ## @brief      { function_description }
     ##
     ## @return     { description_of_the_return_value }
     ##
+    ## @note       Bloom filter is kept so that processes forked after term()
+    ##             reuse it when they init() again.
+    ##
     @trace()
     def term(self):
         if self.valid:
@@ -155,8 +439,101 @@ class HashDB(object):
         if not self.valid:
             return None
 
+        if not self.__may_contain(container.hashed):
+            return False
+
         return (self.adapter.lookup(container.hashed) is not None)
     ##
+    ## @brief      Looks up several hexdigests at once
+    ##
+    ## @param      hexdigests  The hexdigests
+    ##
+    ## @return     dict mapping found hexdigests to a path, None if database
+    ##             is not valid
+    ##
+    @trace()
+    def lookup_many(self, hexdigests):
+        if not self.valid:
+            return None
+
+        hexdigests = [hexdigest for hexdigest in hexdigests
+                      if self.__may_contain(hexdigest)]
+        if len(hexdigests) == 0:
+            return {}
+
+        return self.adapter.lookup_many(hexdigests)
+    ##
+    ## @brief      Looks up every aligned block of a file in a block hash
+    ##             database, blocks are looked up in batches.
+    ##
+    ## @param      bf    The opened binary file or virtual file
+    ##
+    ## @return     dict mapping reference files to number of matching blocks,
+    ##             None if database is not a valid block hash database
+    ##
+    @trace()
+    def scan_blocks(self, bf):
+        block_size = self.block_size()
+        if not self.valid or block_size <= 0:
+            return None
+
+        hash_func = config.value('hash_func', 'sha256')
+        zero = hashbuf(hash_func, bytes(block_size))
+        matches = {}
+        pending = {}
+        for (offset, digest) in hashbf_blocks(hash_func, bf, block_size):
+            if digest == zero:
+                continue
+            hexdigest = digest.hex()
+            pending[hexdigest] = pending.get(hexdigest, 0) + 1
+            if len(pending) >= BLOCK_LOOKUP_BATCH:
+                self.__match_blocks(pending, matches)
+                pending = {}
+        self.__match_blocks(pending, matches)
+
+        return matches
+    ##
+    ## @brief      Looks up a batch of block digests
+    ##
+    ## @param      pending  dict mapping hexdigest to number of occurrences
+    ## @param      matches  dict mapping reference files to number of
+    ##                      matching blocks, updated in place
+    ##
+    @trace()
+    def __match_blocks(self, pending, matches):
+        found = self.lookup_many(list(pending.keys()))
+        for (hexdigest, path) in (found or {}).items():
+            (reference, offset) = split_block_path(path)
+            matches[reference] = matches.get(reference, 0) + pending[hexdigest]
+    ##
+    ## @brief      Looks up files similar to given fuzzy hash signature,
+    ##             candidates are retrieved through the n-gram index of the
+    ##             database then scored.
+    ##
+    ## @param      signature  The signature
+    ## @param      threshold  The minimum score of a match
+    ##
+    ## @return     dict mapping similar files to their score, None if
+    ##             database can't be searched
+    ##
+    @trace()
+    def similar(self, signature, threshold):
+        if not self.valid:
+            return None
+
+        try:
+            candidates = self.adapter.lookup_fuzzy(signature)
+        except NotImplementedError:
+            return None
+
+        matches = {}
+        for (candidate, path) in candidates:
+            score = compare(signature, candidate)
+            if score >= threshold and score > matches.get(path, 0):
+                matches[path] = score
+
+        return matches
+    ##
     ## @brief      { function_description }
     ##
     ## @param      container  The container
@@ -173,6 +550,98 @@ class HashDB(object):
 
         return True
     ##
+    ## @brief      Persists several hash tuples at once
+    ##
+    ## @param      records  List of (hexdigest, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def persist_many(self, records):
+        if not self.valid:
+            return False
+
+        if len(records) == 0:
+            return True
+
+        LGR.debug("persisting {} records...".format(len(records)))
+        if not self.adapter.insert_many(records):
+            return False
+
+        return True
+    ##
+    ## @brief      Persists several fuzzy hash signatures at once
+    ##
+    ## @param      records  List of (signature, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def persist_fuzzy_many(self, records):
+        if not self.valid:
+            return False
+
+        if len(records) == 0:
+            return True
+
+        try:
+            return self.adapter.insert_fuzzy_many(records)
+        except NotImplementedError:
+            LGR.error("adapter does not support fuzzy hashes.")
+            return False
+    ##
+    ## @brief      Returns stat of files recorded in the database
+    ##
+    ## @return     dict mapping path to (size, mtime_ns, inode) tuple or None
+    ##
+    @trace()
+    def stats(self):
+        if not self.valid:
+            return None
+
+        try:
+            return self.adapter.stats()
+        except NotImplementedError:
+            LGR.error("adapter does not record file stats.")
+            return None
+    ##
+    ## @brief      Records stat of hashed files
+    ##
+    ## @param      rows  List of (path, size, mtime_ns, inode, hexdigest)
+    ##                   tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def update_stats(self, rows):
+        if not self.valid:
+            return False
+
+        if len(rows) == 0:
+            return True
+
+        return self.adapter.update_stats(rows)
+    ##
+    ## @brief      Removes records of given paths
+    ##
+    ## @param      paths  The paths
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def remove(self, paths):
+        if not self.valid:
+            return False
+
+        if len(paths) == 0:
+            return True
+
+        try:
+            return self.adapter.remove(paths)
+        except NotImplementedError:
+            LGR.error("adapter does not support record removal.")
+            return False
+    ##
     ## @brief      { function_description }
     ##
     ## @param      other  The other
@@ -238,6 +707,10 @@ class HashDBActionGroup(ActionGroup):
         if hashdb_conf is None:
             LGR.error("failed to load hash database configuration.")
             return False
+
+        if (hashdb_conf.get('fuzzy_hash', False) and
+           not fuzzy_available(config.value('fuzzy_python', False))):
+            return False
         # check if remaining arguments are directories
         dirs = args.files[1:]
         for dpath in dirs:
@@ -251,17 +724,74 @@ class HashDBActionGroup(ActionGroup):
 
         LGR.info("connecting to database...")
         hashdb = HashDB(hashdb_conf)
-        if not hashdb.init('w'):
+        if not hashdb.init('u' if args.update else 'w'):
             LGR.error("failed to init database.")
             return False
 
+        block_size = hashdb.block_size()
+        if args.update and block_size > 0:
+            LGR.error("block hash databases can't be updated.")
+            hashdb.term()
+            return False
+
+        if args.update:
+            LGR.info("comparing files with database...")
+            known = hashdb.stats()
+            if known is None:
+                hashdb.term()
+                return False
+            (fpaths, removed) = changed_files(known, fpaths, dirs,
+                                              args.recursive)
+            LGR.info("{} new or changed file(s), {} record(s) to "
+                     "remove.".format(len(fpaths), len(removed)))
+            hashdb.remove(removed)
+
         LGR.info("start hashing processes...")
-        pool = WorkerPool(config.value('num_workers', 1))
+        batch_size = config.value('db_batch_size', 1000)
+        tasks = chunk_files(fpaths,
+                            config.value('hash_chunk_files', 256),
+                            config.value('hash_chunk_size', 16 * 1024 * 1024))
+        routine = hashing_routine
         kwargs = {
-            'hashdb': hashdb
+            'hash_func': config.value('hash_func', 'sha256'),
+            'hash_threads': config.value('hash_threads', 1),
+            'fuzzy': hashdb.fuzzy_hash()
         }
-        pool.map(hashing_routine, kwargs, tasks=fpaths)
+        if block_size > 0:
+            LGR.info("recording {} bytes blocks.".format(block_size))
+            routine = block_hashing_routine
+            kwargs = {
+                'hash_func': config.value('hash_func', 'sha256'),
+                'block_size': block_size
+            }
+        pool = WorkerPool(config.value('num_workers', 1))
+        if pool.start(routine, kwargs):
+            try:
+                # workers send records, this process is the only writer
+                records = []
+                stats = []
+                fuzzy_records = []
+                for results in pool.process(tasks):
+                    for (record, stat, fuzzy_record) in results:
+                        records.append(record)
+                        if stat is not None:
+                            stats.append(stat)
+                        if fuzzy_record is not None:
+                            fuzzy_records.append(fuzzy_record)
+                    if len(records) >= batch_size:
+                        hashdb.persist_many(records)
+                        hashdb.update_stats(stats)
+                        hashdb.persist_fuzzy_many(fuzzy_records)
+                        records = []
+                        stats = []
+                        fuzzy_records = []
+                hashdb.persist_many(records)
+                hashdb.update_stats(stats)
+                hashdb.persist_fuzzy_many(fuzzy_records)
+            finally:
+                pool.stop()
 
+        hashdb.term()
         LGR.info("done.")
         return True
     ##
@@ -25,6 +25,7 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
+import os
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.db_adapter import DBAdapter
@@ -32,6 +33,8 @@ from utils.db_adapter import DBAdapter
 #  GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# number of records inserted at once when merging
+MERGE_BATCH = 10000
 # =============================================================================
 #  CLASSES
 # =============================================================================
@@ -47,14 +50,110 @@ class HashDBAdapter(DBAdapter):
     def __init__(self, conf):
         super(HashDBAdapter, self).__init__(conf)
     ##
-    ## @brief      Merges this database into the other
+    ## @brief      Returns path of the database file, if any
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def path(self):
+        if self._conf is None or not self._conf.has('path'):
+            return None
+        return os.path.expanduser(self._conf.path)
+    ##
+    ## @brief      Returns the number of records in the database
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def count(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Iterates over raw digests stored in the database
+    ##
+    ## @return     generator of bytes
+    ##
+    def digests(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Iterates over records stored in the database
+    ##
+    ## @return     generator of (hexdigest, path) tuples
+    ##
+    def records(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Returns stat of files recorded in the database
+    ##
+    ## @return     dict mapping path to (size, mtime_ns, inode) tuple
+    ##
+    def stats(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Records stat of hashed files. Adapters which do not
+    ##             support update mode ignore them.
+    ##
+    ## @param      rows  Iterable of (path, size, mtime_ns, inode, hexdigest)
+    ##                   tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def update_stats(self, rows):
+        return True
+    ##
+    ## @brief      Removes records and stat of given paths
+    ##
+    ## @param      paths  The paths
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def remove(self, paths):
+        raise NotImplementedError
+    ##
+    ## @brief      Merges this database into the other by streaming batches
+    ##             of records. Subclasses should override this method when
+    ##             a faster way exists for a given kind of other database.
     ##
     ## @param      other  The other
     ##
     ## @return     { description_of_the_return_value }
     ##
+    @trace()
     def merge_into(self, other):
-        raise NotImplementedError
+        batch = []
+        for record in self.records():
+            batch.append(record)
+            if len(batch) >= MERGE_BATCH:
+                if not other.insert_many(batch):
+                    return False
+                batch = []
+
+        if not other.insert_many(batch):
+            return False
+
+        return self.merge_fuzzy_into(other)
+    ##
+    ## @brief      Merges fuzzy hash signatures of this database into the
+    ##             other, nothing is merged when one of them does not support
+    ##             them.
+    ##
+    ## @param      other  The other
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def merge_fuzzy_into(self, other):
+        batch = []
+        try:
+            for record in self.fuzzy_records():
+                batch.append(record)
+                if len(batch) >= MERGE_BATCH:
+                    if not other.insert_fuzzy_many(batch):
+                        return False
+                    batch = []
+
+            return other.insert_fuzzy_many(batch)
+        except NotImplementedError:
+            return True
     ##
     ## @brief      Tries to retrieve an existing record having given hexdigest
     ##
@@ -65,6 +164,22 @@ class HashDBAdapter(DBAdapter):
     def lookup(self, hexdigest):
         raise NotImplementedError
     ##
+    ## @brief      Looks up several hexdigests. Subclasses should override
+    ##             this method to look them up at once.
+    ##
+    ## @param      hexdigests  The hexdigests
+    ##
+    ## @return     dict mapping found hexdigests to a path
+    ##
+    @trace()
+    def lookup_many(self, hexdigests):
+        found = {}
+        for hexdigest in set(hexdigests):
+            record = self.lookup(hexdigest)
+            if record is not None:
+                found[hexdigest] = record[1]
+        return found
+    ##
     ## @brief      Inserts a new hash tuple into the database
     ##
     ## @param      hexdigest  The hexdigest
@@ -74,3 +189,45 @@ class HashDBAdapter(DBAdapter):
     ##
     def insert(self, hexdigest, path):
         raise NotImplementedError
+    ##
+    ## @brief      Inserts several hash tuples into the database. Subclasses
+    ##             should override this method to insert them at once.
+    ##
+    ## @param      records  Iterable of (hexdigest, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def insert_many(self, records):
+        noerr = True
+        for (hexdigest, path) in records:
+            if not self.insert(hexdigest, path):
+                noerr = False
+        return noerr
+    ##
+    ## @brief      Inserts fuzzy hash signatures of files
+    ##
+    ## @param      records  Iterable of (signature, path) tuples
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def insert_fuzzy_many(self, records):
+        raise NotImplementedError
+    ##
+    ## @brief      Returns signatures that may be similar to given one, they
+    ##             are retrieved through an index and still need to be
+    ##             scored.
+    ##
+    ## @param      signature  The signature
+    ##
+    ## @return     list of (signature, path) tuples
+    ##
+    def lookup_fuzzy(self, signature):
+        raise NotImplementedError
+    ##
+    ## @brief      Iterates over fuzzy hash signatures stored in the database
+    ##
+    ## @return     generator of (signature, path) tuples
+    ##
+    def fuzzy_records(self):
+        raise NotImplementedError
@@ -0,0 +1,89 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: vdi_device.py
+#     date: 2018-03-03
+#   author: koromodako
+#  purpose:
+#       Reads a VDI disk image as a raw disk without extracting it.
+#
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2017 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+from utils.logging import get_logger
+from utils.virtual_file import BlockDevice
+from utils.virtual_file import open_source
+from helpers.vdi.vdi_disk import VdiDisk
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Raw disk stored in a VDI image, blocks are read through the
+##             block map on demand.
+##
+class VdiDevice(BlockDevice):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      source  The VDI image path or virtual file
+    ## @param      vpath   Virtual path of the raw disk
+    ##
+    def __init__(self, source, vpath):
+        super(VdiDevice, self).__init__(vpath)
+        self.source = source
+        self._bf = None
+        self._vdi = None
+    ##
+    ## @brief      Opens VDI image and parses its block map
+    ##
+    def _open(self):
+        self._bf = open_source(self.source)
+        if self._bf is None:
+            return False
+
+        self._vdi = VdiDisk(self._bf)
+        if self._vdi.block_entries() is None:
+            LGR.error("cannot read VDI block map.")
+            self._close()
+            return False
+
+        self.block_size = self._vdi.header().blkSz
+        self.block_count = self._vdi.header().numBlkInHdd
+        return True
+    ##
+    ## @brief      Closes VDI image
+    ##
+    def _close(self):
+        super(VdiDevice, self)._close()
+        self._bf.close()
+        self._vdi = None
+    ##
+    ## @brief      Reads a block
+    ##
+    def _read_block(self, n):
+        return self._vdi.read_block(n)
+    ##
+    ## @brief      Determines if a block is allocated
+    ##
+    def _is_allocated(self, n):
+        return self._vdi.is_allocated(n)
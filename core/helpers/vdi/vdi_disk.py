@@ -25,11 +25,11 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
-from struct import calcsize
+import sys
+from array import array
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.wrapper import lazy_getter
-from utils.converting import unpack_one
 from utils.struct.factory import StructFactory
 from utils.struct.simple_member import SimpleMember
 from utils.struct.byte_array_member import ByteArrayMember
@@ -115,6 +115,118 @@ class VdiDisk(object):
         return self.bf.read(4 * self._hdr.numBlkInHdd,
                             self._hdr.oftBlk)
     ##
+    ## @brief      Decodes block map once, each entry being the index of the
+    ##             block in data area or a negative value when unallocated.
+    ##
+    ## @return     array of signed integers
+    ##
+    @lazy_getter('_blk_ents')
+    @trace()
+    def block_entries(self):
+        if self.block_map() is None:
+            LGR.error("cannot retrieve block map => cannot decode entries.")
+            return None
+
+        ents = array('i', self._blk_map)
+        if sys.byteorder != 'little':
+            ents.byteswap()
+        return ents
+    ##
+    ## @brief      Computes file offset of a block data.
+    ##
+    ## @param      idx   Index of the block in data area.
+    ##
+    ## @return     offset
+    ##
+    def __block_offset(self, idx):
+        # block map holds indexes of blocks in data area, each block being
+        # preceded by its extra data
+        return (self._hdr.oftDat + idx * self.__block_stride() +
+                self._hdr.blkExtraDat)
+    ##
+    ## @brief      Distance between two physically contiguous blocks.
+    ##
+    def __block_stride(self):
+        return self._hdr.blkExtraDat + self._hdr.blkSz
+    ##
+    ## @brief      Determines if a block is allocated, unallocated blocks read
+    ##             as zeros.
+    ##
+    ## @param      n     Index of the block starting from 0.
+    ##
+    ## @return     True if allocated, False otherwise.
+    ##
+    @trace()
+    def is_allocated(self, n):
+        if self.block_entries() is None:
+            return True
+
+        return self._blk_ents[n] >= 0
+    ##
+    ## @brief      Splits disk into runs of blocks which are either all
+    ##             unallocated or physically contiguous in data area.
+    ##
+    ## @param      max_cnt  Maximum number of blocks of an allocated run
+    ##
+    ## @return     generator of (first block, block count, allocated) tuples
+    ##
+    @trace()
+    def block_runs(self, max_cnt):
+        ents = self.block_entries()
+        if ents is None:
+            LGR.error("cannot decode block map => cannot compute runs.")
+            return
+
+        n = 0
+        while n < len(ents):
+            first = ents[n]
+            end = n + 1
+            if first < 0:
+                while end < len(ents) and ents[end] < 0:
+                    end += 1
+            else:
+                lim = min(len(ents), n + max_cnt)
+                while end < lim and ents[end] == first + end - n:
+                    end += 1
+            yield (n, end - n, first >= 0)
+            n = end
+    ##
+    ## @brief      Size of the buffer needed to read a run.
+    ##
+    ## @param      cnt   Number of blocks of the run
+    ##
+    ## @return     size in bytes
+    ##
+    def run_size(self, cnt):
+        return cnt * self.__block_stride()
+    ##
+    ## @brief      Reads an allocated run of blocks in a single read.
+    ##
+    ## @param      n     Index of the first block of the run
+    ## @param      cnt   Number of blocks of the run
+    ## @param      buf   Buffer of at least run_size(cnt) bytes reused
+    ##                   between calls
+    ##
+    ## @return     list of memoryviews over blocks data, valid until next
+    ##             call, or None on error.
+    ##
+    @trace()
+    def read_run(self, n, cnt, buf):
+        blk_sz = self._hdr.blkSz
+        stride = self.__block_stride()
+        size = (cnt - 1) * stride + blk_sz
+        view = memoryview(buf)[:size]
+
+        oft = self.__block_offset(self._blk_ents[n])
+        if self.bf.readinto(view, oft) != size:
+            LGR.error("failed to read blocks {}-{}.".format(n, n + cnt - 1))
+            return None
+
+        if stride == blk_sz:
+            return [view]
+        # skips extra data found between blocks
+        return [view[k*stride:k*stride + blk_sz] for k in range(cnt)]
+    ##
     ## @brief      Reads a blocks.
     ##
     ## @param      n     Index of the block to be read starting from 0.
@@ -123,16 +235,12 @@ class VdiDisk(object):
     ##
     @trace()
     def read_block(self, n):
-        if self.block_map() is None:
+        if self.block_entries() is None:
             LGR.error("cannot retrieve block map => cannot retrieve a block.")
             return None
 
-        fmt = '<i'
-        sz = calcsize(fmt)
-        blk_oft = unpack_one(fmt, self._blk_map[n*sz:(n+1)*sz])
-
-        if blk_oft < 0:
+        idx = self._blk_ents[n]
+        if idx < 0:
             return b'\x00' * self._hdr.blkSz
 
-        return self.bf.read(self._hdr.blkSz,
-                            self._hdr.oftDat + blk_oft)
+        return self.bf.read(self._hdr.blkSz, self.__block_offset(idx))
@@ -27,10 +27,13 @@
 # =============================================================================
 from utils.wrapper import trace
 from utils.logging import get_logger
+from utils.binary_file import is_zero
 # =============================================================================
 #  GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# maximum amount of data read at once
+RUN_MAX_SZ = 32 * 1024 * 1024
 # =============================================================================
 #  CLASSES
 # =============================================================================
@@ -41,35 +44,69 @@ class VdiExtractor(object):
     ##
     ## @brief      Constructs the object.
     ##
-    ## @param      wdir  The wdir
-    ## @param      vdi   The vdi
-    ## @param      obf   The obf
+    ## @param      wdir          The wdir
+    ## @param      vdi           The vdi
+    ## @param      obf           The obf
+    ## @param      detect_zeros  Allocated blocks holding only zeros are
+    ##                           skipped as well
     ##
-    def __init__(self, wdir, vdi, obf):
+    def __init__(self, wdir, vdi, obf, detect_zeros=False):
         self.wdir = wdir
         self.vdi = vdi
         self.obf = obf
+        self.detect_zeros = detect_zeros
     ##
-    ## @brief      { function_description }
+    ## @brief      Writes blocks data, zero blocks are skipped when detecting
+    ##             zeros.
+    ##
+    ## @param      data    The data
+    ## @param      blk_sz  The block size
+    ##
+    def __write(self, data, blk_sz):
+        if not self.detect_zeros:
+            self.obf.write(data)
+            return
+
+        for k in range(0, len(data), blk_sz):
+            blk = data[k:k + blk_sz]
+            if is_zero(blk):
+                self.obf.skip(len(blk))
+            else:
+                self.obf.write(blk)
+    ##
+    ## @brief      Extracts raw disk, physically contiguous blocks are read at
+    ##             once and unallocated blocks are skipped so that output is a
+    ##             sparse file.
     ##
     ## @return     { description_of_the_return_value }
     ##
     @trace()
     def extract(self):
         vdi_blk_cnt = self.vdi.header().numBlkInHdd
+        blk_sz = self.vdi.header().blkSz
+        max_cnt = max(1, RUN_MAX_SZ // blk_sz)
+        buf = bytearray(self.vdi.run_size(max_cnt))
+        done = 0
 
         LGR.info("extracting {} 1MB blocks...".format(vdi_blk_cnt))
-        for n in range(vdi_blk_cnt):
+        for (n, cnt, allocated) in self.vdi.block_runs(max_cnt):
 
-            data = self.vdi.read_block(n)
-            if data is None:
-                LGR.error("failed to read block.")
-                return False
+            if allocated:
+                views = self.vdi.read_run(n, cnt, buf)
+                if views is None:
+                    LGR.error("failed to read block.")
+                    return False
 
-            self.obf.write(data)
+                for data in views:
+                    self.__write(data, blk_sz)
+            else:
+                # unallocated blocks are left as holes in output
+                self.obf.skip(cnt * blk_sz)
 
-            if (n+1) % 100 == 0:
-                LGR.info("{}/{} blocks extracted.".format(n+1, vdi_blk_cnt))
+            if (n + cnt) // 100 > done // 100:
+                LGR.info("{}/{} blocks extracted.".format(n + cnt,
+                                                          vdi_blk_cnt))
+            done = n + cnt
 
         LGR.info("extraction completed.")
         return True
@@ -0,0 +1,90 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: vhd_device.py
+#     date: 2018-03-03
+#   author: koromodako
+#  purpose:
+#       Reads a VHD disk image as a raw disk without extracting it.
+#
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2017 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+from utils.logging import get_logger
+from utils.virtual_file import BlockDevice
+from utils.virtual_file import open_source
+from helpers.vhd.vhd_disk import VhdDisk
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Raw disk stored in a dynamic VHD image, blocks are read through
+##             the block allocation table on demand.
+##
+class VhdDevice(BlockDevice):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      source  The VHD image path or virtual file
+    ## @param      vpath   Virtual path of the raw disk
+    ##
+    def __init__(self, source, vpath):
+        super(VhdDevice, self).__init__(vpath)
+        self.source = source
+        self._bf = None
+        self._vhd = None
+    ##
+    ## @brief      Opens VHD image and parses its block allocation table
+    ##
+    def _open(self):
+        self._bf = open_source(self.source)
+        if self._bf is None:
+            return False
+
+        self._vhd = VhdDisk(self._bf)
+        blk_cnt = self._vhd.block_count()
+        if blk_cnt is None or self._vhd.block_entries() is None:
+            LGR.error("cannot read VHD block allocation table.")
+            self._close()
+            return False
+
+        self.block_size = self._vhd.header().blkSz
+        self.block_count = blk_cnt
+        return True
+    ##
+    ## @brief      Closes VHD image
+    ##
+    def _close(self):
+        super(VhdDevice, self)._close()
+        self._bf.close()
+        self._vhd = None
+    ##
+    ## @brief      Reads a block
+    ##
+    def _read_block(self, n):
+        return self._vhd.read_block(n)
+    ##
+    ## @brief      Determines if a block is allocated
+    ##
+    def _is_allocated(self, n):
+        return self._vhd.is_allocated(n)
@@ -25,14 +25,14 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
+import sys
 from enum import Enum
-from struct import calcsize
+from array import array
 from utils.logging import todo
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.wrapper import lazy_getter
 from utils.constants import SECTOR_SZ
-from utils.converting import unpack_one
 from utils.struct.factory import StructFactory
 from utils.struct.array_member import ArrayMember
 from utils.struct.struct_member import StructMember
@@ -132,6 +132,8 @@ class VhdDisk(object):
     FEATURE_TEMPORARY = 0x1     # is it a temporary disk ?
     FEATURE_RESERVED = 0x2      # must always be set
     # all other should be 0
+    # BAT entry of an unallocated block
+    UNALLOCATED = 0xffffffff
     ##
     ## @brief      Constructs the object.
     ##
@@ -220,6 +222,114 @@ class VhdDisk(object):
         LGR.error("unsupported vhd type.")
         return None
     ##
+    ## @brief      Decodes block allocation table once, each entry being the
+    ##             sector offset of the block or 0xffffffff when unallocated.
+    ##
+    ## @return     array of unsigned integers
+    ##
+    @lazy_getter('_bat_ents')
+    @trace()
+    def block_entries(self):
+        if self.block_allocation_table() is None:
+            LGR.error("cannot retrieve BAT => cannot decode entries.")
+            return None
+
+        ents = array('I', self._bat)
+        if sys.byteorder != 'big':
+            ents.byteswap()
+        return ents
+    ##
+    ## @brief      Size of the sector bitmap preceding each block, padded to a
+    ##             sector boundary.
+    ##
+    def __bitmap_size(self):
+        bitmap_sz = (self._hdr.blkSz // SECTOR_SZ) // 8
+        return -(-bitmap_sz // SECTOR_SZ) * SECTOR_SZ
+    ##
+    ## @brief      Distance between two physically contiguous blocks.
+    ##
+    def __block_stride(self):
+        return self.__bitmap_size() + self._hdr.blkSz
+    ##
+    ## @brief      Determines if a block is allocated, unallocated blocks read
+    ##             as zeros.
+    ##
+    ## @param      n     { parameter_description }
+    ##
+    ## @return     True if allocated, False otherwise.
+    ##
+    @trace()
+    def is_allocated(self, n):
+        if self.type() != VhdDiskType.DYNAMIC:
+            return True
+
+        if self.block_entries() is None:
+            return True
+
+        return self._bat_ents[n] != self.UNALLOCATED
+    ##
+    ## @brief      Splits dynamic disk into runs of blocks which are either
+    ##             all unallocated or physically contiguous.
+    ##
+    ## @param      max_cnt  Maximum number of blocks of an allocated run
+    ##
+    ## @return     generator of (first block, block count, allocated) tuples
+    ##
+    @trace()
+    def block_runs(self, max_cnt):
+        ents = self.block_entries()
+        if ents is None:
+            LGR.error("cannot decode BAT => cannot compute runs.")
+            return
+
+        step = self.__block_stride() // SECTOR_SZ
+        n = 0
+        while n < len(ents):
+            first = ents[n]
+            end = n + 1
+            if first == self.UNALLOCATED:
+                while end < len(ents) and ents[end] == self.UNALLOCATED:
+                    end += 1
+            else:
+                lim = min(len(ents), n + max_cnt)
+                while end < lim and ents[end] == first + (end - n) * step:
+                    end += 1
+            yield (n, end - n, first != self.UNALLOCATED)
+            n = end
+    ##
+    ## @brief      Size of the buffer needed to read a run.
+    ##
+    ## @param      cnt   Number of blocks of the run
+    ##
+    ## @return     size in bytes
+    ##
+    def run_size(self, cnt):
+        return cnt * self.__block_stride()
+    ##
+    ## @brief      Reads an allocated run of blocks in a single read.
+    ##
+    ## @param      n     Index of the first block of the run
+    ## @param      cnt   Number of blocks of the run
+    ## @param      buf   Buffer of at least run_size(cnt) bytes reused
+    ##                   between calls
+    ##
+    ## @return     list of memoryviews over blocks data, valid until next
+    ##             call, or None on error.
+    ##
+    @trace()
+    def read_run(self, n, cnt, buf):
+        blk_sz = self._hdr.blkSz
+        stride = self.__block_stride()
+        size = (cnt - 1) * stride + blk_sz
+        view = memoryview(buf)[:size]
+
+        oft = self._bat_ents[n] * SECTOR_SZ + self.__bitmap_size()
+        if self.bf.readinto(view, oft) != size:
+            LGR.error("failed to read blocks {}-{}.".format(n, n + cnt - 1))
+            return None
+        # skips sector bitmaps found between blocks
+        return [view[k*stride:k*stride + blk_sz] for k in range(cnt)]
+    ##
     ## @brief      Reads a dynamic vhd block.
     ##
     ## @param      n     { parameter_description }
@@ -228,22 +338,18 @@ class VhdDisk(object):
     ##
     @trace()
     def __read_dynamic_vhd_block(self, n):
-        if self.block_allocation_table() is None:
+        if self.block_entries() is None:
             LGR.error("")
             return None
 
         blk_sz = self._hdr.blkSz
-        bitmap_sz = (blk_sz // SECTOR_SZ) // 8
-
-        fmt = '>I'
-        sz = calcsize(fmt)
-        blk_oft = unpack_one(fmt, self._bat[n*sz:(n+1)*sz])
+        blk_oft = self._bat_ents[n]
 
-        if blk_oft == 0xffffffff:
+        if blk_oft == self.UNALLOCATED:
             data = b'\x00' * blk_sz
         else:
             data = self.bf.read(blk_sz,
-                                blk_oft * SECTOR_SZ + bitmap_sz)
+                                blk_oft * SECTOR_SZ + self.__bitmap_size())
 
         return data
     ##
@@ -27,11 +27,14 @@
 # =============================================================================
 from utils.wrapper import trace
 from utils.logging import get_logger
+from utils.binary_file import is_zero
 from helpers.vhd.vhd_disk import VhdDiskType
 # =============================================================================
 #  GLOBALS / CONFIG
 # =============================================================================
 LGR = get_logger(__name__)
+# maximum amount of data read at once
+RUN_MAX_SZ = 32 * 1024 * 1024
 # =============================================================================
 #  CLASSES
 # =============================================================================
@@ -42,37 +45,74 @@ class VhdExtractor(object):
     ##
     ## @brief      Constructs the object.
     ##
-    ## @param      wdir  The wdir
-    ## @param      vhd   The vhd
-    ## @param      obf   The obf
+    ## @param      wdir          The wdir
+    ## @param      vhd           The vhd
+    ## @param      obf           The obf
+    ## @param      detect_zeros  Allocated blocks holding only zeros are
+    ##                           skipped as well
     ##
-    def __init__(self, wdir, vhd, obf):
+    def __init__(self, wdir, vhd, obf, detect_zeros=False):
         super(VhdExtractor, self).__init__()
         self.wdir = wdir
         self.vhd = vhd
         self.obf = obf
+        self.detect_zeros = detect_zeros
     ##
-    ## @brief      { function_description }
+    ## @brief      Writes blocks data, zero blocks are skipped when detecting
+    ##             zeros.
+    ##
+    ## @param      data    The data
+    ## @param      blk_sz  The block size
+    ##
+    def __write(self, data, blk_sz):
+        if not self.detect_zeros:
+            self.obf.write(data)
+            return
+
+        for k in range(0, len(data), blk_sz):
+            blk = data[k:k + blk_sz]
+            if is_zero(blk):
+                self.obf.skip(len(blk))
+            else:
+                self.obf.write(blk)
+    ##
+    ## @brief      Extracts raw disk, physically contiguous blocks are read at
+    ##             once and unallocated blocks are skipped so that output is a
+    ##             sparse file.
     ##
     ## @return     { description_of_the_return_value }
     ##
     @trace()
     def extract(self):
         blk_cnt = self.vhd.block_count()
+        if blk_cnt is None:
+            LGR.error("cannot extract blocks of this vhd.")
+            return False
+
+        blk_sz = self.vhd.header().blkSz
+        max_cnt = max(1, RUN_MAX_SZ // blk_sz)
+        buf = bytearray(self.vhd.run_size(max_cnt))
+        done = 0
 
         LGR.info("extracting {} blocks...".format(blk_cnt))
 
-        for n in range(blk_cnt):
-            data = self.vhd.read_block(n)
+        for (n, cnt, allocated) in self.vhd.block_runs(max_cnt):
+            if allocated:
+                views = self.vhd.read_run(n, cnt, buf)
 
-            if data is None:
-                LGR.error("an error occured while extracting data.")
-                return False
+                if views is None:
+                    LGR.error("an error occured while extracting data.")
+                    return False
 
-            self.obf.write(data)
+                for data in views:
+                    self.__write(data, blk_sz)
+            else:
+                # unallocated blocks are left as holes in output
+                self.obf.skip(cnt * blk_sz)
 
-            if (n+1) % 50 == 0:
-                LGR.info("{}/{} blocks extracted.".format(n+1, blk_cnt))
+            if (n + cnt) // 50 > done // 50:
+                LGR.info("{}/{} blocks extracted.".format(n + cnt, blk_cnt))
+            done = n + cnt
 
         LGR.info("extraction completed.")
         return True
@@ -26,10 +26,10 @@
 # =============================================================================
 import math
 from struct import calcsize
+from struct import unpack_from
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.constants import SECTOR_SZ
-from utils.converting import unpack_one
 from helpers.vmdk.vmdk_disk import VmdkDisk
 # =============================================================================
 # GLOBALS
@@ -73,17 +73,16 @@ class GrainDirectory(object):
         fmt = '<I'
         sz = calcsize(fmt)
         start = skip+offset*sz
-        data = self.metadata[start:start+sz]
-        return unpack_one(fmt, data)
+        return unpack_from(fmt, self.metadata, start)[0]
     ##
-    ## @brief      Reads a grain.
+    ## @brief      Returns grain table entry of the grain holding a sector
     ##
     ## @param      sector  The sector
     ##
-    ## @return     { description_of_the_return_value }
+    ## @return     offset of the grain in sectors, 0 if unallocated
     ##
     @trace()
-    def read_grain(self, sector):
+    def __grain_table_entry(self, sector):
         gde_idx = math.floor(sector / self.gt_coverage)
 
         gt_offset = self.__read_metadata(gde_idx)
@@ -91,7 +90,35 @@ class GrainDirectory(object):
 
         gte_idx = math.floor((sector % self.gt_coverage) / self.hdr.grainSize)
 
-        gte = self.__read_metadata(gte_idx, skip=gt_offset*SECTOR_SZ)
+        return self.__read_metadata(gte_idx, skip=gt_offset*SECTOR_SZ)
+    ##
+    ## @brief      Determines if the grain holding a sector is allocated in
+    ##             this disk or one of its parents, unallocated grains read as
+    ##             zeros.
+    ##
+    ## @param      sector  The sector
+    ##
+    ## @return     True if allocated, False otherwise.
+    ##
+    @trace()
+    def is_allocated(self, sector):
+        if self.__grain_table_entry(sector) != 0:
+            return True
+
+        if self.parent_gd is None:
+            return False
+
+        return self.parent_gd.is_allocated(sector)
+    ##
+    ## @brief      Reads a grain.
+    ##
+    ## @param      sector  The sector
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    @trace()
+    def read_grain(self, sector):
+        gte = self.__grain_table_entry(sector)
 
         if gte == 0:
             if self.parent_gd is None:
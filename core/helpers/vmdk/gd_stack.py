@@ -65,11 +65,13 @@ class GrainDirectoryStack(object):
 
         parent_filename = df.parent_filename()
 
+        parent_gd = None
         if parent_filename is not None:
             parent_path = os.path.join(self.wdir, parent_filename)
 
             if BinaryFile.exists(parent_path):
-                parent_bf = BinaryFile(parent_path)
+                parent_bf = BinaryFile(parent_path, 'r', positional=True,
+                                       mapped=True)
                 parent_bf.open()
                 parent_vmdk = VmdkDisk(parent_bf)
                 parent_gd = self.__build_gd(parent_vmdk)
@@ -77,8 +79,6 @@ class GrainDirectoryStack(object):
             else:
                 LGR.warn("could not find parent disk. Disk image will be "
                             "incomplete.")
-        else:
-            parent_gd = None
 
         return GrainDirectory(vmdk, parent_gd)
     ##
@@ -31,6 +31,7 @@ from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.constants import SECTOR_SZ
 from utils.binary_file import BinaryFile
+from utils.binary_file import is_zero
 from helpers.vmdk.gd_stack import GrainDirectoryStack
 from helpers.vmdk.vmdk_disk import VmdkDisk
 from helpers.vmdk.vmdk_disk import S_SPARSE_EXTENT_HDR
@@ -48,15 +49,18 @@ class SparseExtentExtractor(object):
     ##
     ## @brief      Constructs the object.
     ##
-    ## @param      wdir  The wdir
-    ## @param      vmdk  The vmdk
-    ## @param      obf   The obf
+    ## @param      wdir          The wdir
+    ## @param      vmdk          The vmdk
+    ## @param      obf           The obf
+    ## @param      detect_zeros  Allocated grains holding only zeros are
+    ##                           skipped as well
     ##
-    def __init__(self, wdir, vmdk, obf):
+    def __init__(self, wdir, vmdk, obf, detect_zeros=False):
         super(SparseExtentExtractor, self).__init__()
         self.wdir = wdir
         self.vmdk = vmdk
         self.obf = obf
+        self.detect_zeros = detect_zeros
         self.df = vmdk.descriptor_file()
     ##
     ## @brief      { function_description }
@@ -73,7 +77,7 @@ class SparseExtentExtractor(object):
             return False
 
         LGR.info("processing extent: {}".format(extent_path))
-        with BinaryFile(extent_path, 'r') as ebf:
+        with BinaryFile(extent_path, 'r', mapped=True) as ebf:
             evmdk = VmdkDisk(ebf)
 
             hdr = evmdk.header()
@@ -85,10 +89,18 @@ class SparseExtentExtractor(object):
             num_grains = hdr.capacity // hdr.grainSize
 
             LGR.info("extracting {} grains from extent...".format(num_grains))
+            grain_sz = hdr.grainSize * SECTOR_SZ
             for gidx in range(num_grains):
 
-                grain = gds.base().read_grain(gidx*hdr.grainSize)
-                self.obf.write(grain) # output grain
+                if gds.base().is_allocated(gidx*hdr.grainSize):
+                    grain = gds.base().read_grain(gidx*hdr.grainSize)
+                    if self.detect_zeros and is_zero(grain):
+                        self.obf.skip(grain_sz)
+                    else:
+                        self.obf.write(grain) # output grain
+                else:
+                    # unallocated grains are left as holes in output
+                    self.obf.skip(grain_sz)
 
 
                 if (gidx+1) % 100 == 0:
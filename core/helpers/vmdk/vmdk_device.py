@@ -0,0 +1,151 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: vmdk_device.py
+#     date: 2018-03-03
+#   author: koromodako
+#  purpose:
+#       Reads a VMDK sparse disk image as a raw disk without extracting it.
+#
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2017 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import os.path
+from bisect import bisect_right
+from utils.logging import get_logger
+from utils.constants import SECTOR_SZ
+from utils.binary_file import BinaryFile
+from utils.virtual_file import BlockDevice
+from helpers.vmdk.gd_stack import GrainDirectoryStack
+from helpers.vmdk.vmdk_disk import VmdkDisk
+from helpers.vmdk.vmdk_disk import S_SPARSE_EXTENT_HDR
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Raw disk stored in a monolithic sparse VMDK image, grains are
+##             read through grain directories of its extents, and of parent
+##             disks, on demand.
+##
+class VmdkDevice(BlockDevice):
+    ##
+    ## @brief      Determines if a VMDK disk can be read as a device.
+    ##
+    ## @param      vmdk  The vmdk
+    ##
+    ## @return     True if supported, False otherwise.
+    ##
+    @staticmethod
+    def supports(vmdk):
+        df = vmdk.descriptor_file()
+        return (df is not None and df.is_valid() and df.is_sparse() and
+                df.is_monolithic())
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      path   The VMDK image path
+    ## @param      vpath  Virtual path of the raw disk
+    ##
+    def __init__(self, path, vpath):
+        super(VmdkDevice, self).__init__(vpath)
+        self.image = path
+        self._bf = None
+        # (first grain, grain directory stack) of each extent
+        self._extents = []
+        self._firsts = []
+        self._grain_sectors = 0
+    ##
+    ## @brief      Opens VMDK image and grain directories of its extents
+    ##
+    def _open(self):
+        self._bf = BinaryFile(self.image, 'r', positional=True)
+        if not self._bf.open():
+            return False
+
+        vmdk = VmdkDisk(self._bf)
+        if vmdk.header() is None or not VmdkDevice.supports(vmdk):
+            LGR.error("only monolithic sparse VMDK can be read as a device.")
+            self._close()
+            return False
+
+        # fresh lists, opened instances are copies of a closed one
+        (self._extents, self._firsts) = ([], [])
+        wdir = os.path.dirname(self.image)
+        for extent in vmdk.descriptor_file().extents:
+            extent_path = os.path.join(wdir, extent.filename)
+            if not BinaryFile.exists(extent_path):
+                LGR.error("cannot find extent: {}".format(extent_path))
+                self._close()
+                return False
+
+            # grain tables are walked in place
+            ebf = BinaryFile(extent_path, 'r', positional=True, mapped=True)
+            ebf.open()
+            evmdk = VmdkDisk(ebf)
+            hdr = evmdk.header()
+            if (hdr is None or hdr.st_type != S_SPARSE_EXTENT_HDR or
+               self._grain_sectors not in (0, hdr.grainSize)):
+                LGR.error("unsupported extent: {}".format(extent_path))
+                ebf.close()
+                self._close()
+                return False
+
+            self._grain_sectors = hdr.grainSize
+            self._firsts.append(self.block_count)
+            self._extents.append(GrainDirectoryStack(wdir, evmdk))
+            self.block_count += hdr.capacity // hdr.grainSize
+
+        self.block_size = self._grain_sectors * SECTOR_SZ
+        return True
+    ##
+    ## @brief      Closes VMDK image and its extents
+    ##
+    def _close(self):
+        super(VmdkDevice, self)._close()
+        for gds in self._extents:
+            # closes extents and parent disks binary files
+            gds.term()
+        self._bf.close()
+        self._extents = []
+        self._firsts = []
+        self.block_count = 0
+        self._grain_sectors = 0
+    ##
+    ## @brief      Returns grain directory and first sector of a grain
+    ##
+    def __locate(self, n):
+        k = bisect_right(self._firsts, n) - 1
+        sector = (n - self._firsts[k]) * self._grain_sectors
+        return (self._extents[k].base(), sector)
+    ##
+    ## @brief      Reads a grain
+    ##
+    def _read_block(self, n):
+        (gd, sector) = self.__locate(n)
+        return gd.read_grain(sector)
+    ##
+    ## @brief      Determines if a grain is allocated
+    ##
+    def _is_allocated(self, n):
+        (gd, sector) = self.__locate(n)
+        return gd.is_allocated(sector)
@@ -238,8 +238,8 @@ class VmdkDisk(object):
         if self._hdr.descriptorOffset == 0:
             return None
 
-        df_buf = self.bf.read(SECTOR_SZ * self._hdr.descriptorSize,
-                              SECTOR_SZ * self._hdr.descriptorOffset)
+        df_buf = bytes(self.bf.read(SECTOR_SZ * self._hdr.descriptorSize,
+                                    SECTOR_SZ * self._hdr.descriptorOffset))
 
         df_eos = df_buf.index(b'\x00')
 
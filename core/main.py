@@ -100,10 +100,19 @@ def parse_args():
                         help="Affects only <hashdb.create> action."
                         "Tells it to recurse inside given directories.")
 
+    parser.add_argument('-u', '--update', action='store_true',
+                        help="Affects only <hashdb.create> action. "
+                        "Updates an existing database: only new or changed "
+                        "files are hashed and vanished files are removed.")
+
     parser.add_argument('-n', '--num-workers', type=int,
                         help="Number of workers to be used to dissect "
                         "containers.")
 
+    parser.add_argument('--scheduling-policy',
+                        choices=['largest-first', 'smallest-first', 'none'],
+                        help="Order in which containers are dissected.")
+
     parser.add_argument('-m', '--magic-file',
                         help="Magic file to be used internally.")
 
@@ -113,6 +122,8 @@ def parse_args():
     parser.add_argument('--blacklist-config',
                         help="Specify a different blacklist db configuration "
                         "file.")
+    parser.add_argument('--blockhashdb-config',
+                        help="Specify a block hash db configuration file.")
     parser.add_argument('--dissection-config',
                         help="Specify a different dissection configuration "
                         "file.")
@@ -137,6 +148,13 @@ def parse_args():
                         action='store_true',
                         help="Do not hash containers. Warning: using this "
                         "option prevents the use of white/blacklists.")
+    parser.add_argument('--fuzzy-threshold', type=int,
+                        help="Flag containers whose fuzzy hash is at least "
+                        "this similar (0-100) to a blacklisted file.")
+    parser.add_argument('--fuzzy-python',
+                        action='store_true',
+                        help="Allow slow pure Python fuzzy hashing when the "
+                        "ssdeep module is missing, for testing purpose.")
 
     # action-specific arguments
     parser.add_argument('--max-lines', type=int, default=20,
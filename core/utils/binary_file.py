@@ -27,6 +27,8 @@
 # =============================================================================
 import os
 import io
+import mmap
+import errno
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.wrapper import trace_static
@@ -36,6 +38,73 @@ from utils.formatting import hexdump
 # GLOBALS
 # =============================================================================
 LGR = get_logger(__name__)
+# size of buffers used to copy data and to stand for holes of sparse files
+COPY_BLK_SZ = 1024 * 1024
+ZERO_BYTES = bytes(COPY_BLK_SZ)
+ZEROS = memoryview(ZERO_BYTES)
+# size of buffers used to copy ranges when kernel cannot copy them
+RANGE_BLK_SZ = 8 * 1024 * 1024
+# kernel copies data between files without passing it to user space
+HAS_COPY_FILE_RANGE = hasattr(os, 'copy_file_range')
+HAS_SENDFILE = hasattr(os, 'sendfile')
+# positional reads fill caller's buffer directly
+HAS_PREADV = hasattr(os, 'preadv')
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+##
+## @brief      Returns data and hole segments of a range of an open file
+##             using SEEK_DATA and SEEK_HOLE. The range is considered to be
+##             a single data segment when the file system does not report
+##             holes.
+##
+## @param      fd     The file descriptor, its offset is changed
+## @param      start  The start
+## @param      end    The end
+##
+## @return     list of (offset, size, is_data) tuples covering the range
+##
+def data_map(fd, start, end):
+    if not hasattr(os, 'SEEK_DATA'):
+        return [(start, end - start, True)] if end > start else []
+
+    segments = []
+    pos = start
+    try:
+        while pos < end:
+            try:
+                data = min(os.lseek(fd, pos, os.SEEK_DATA), end)
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+                # nothing but a hole up to end of file
+                data = end
+            if data > pos:
+                segments.append((pos, data - pos, False))
+            if data >= end:
+                break
+            hole = min(os.lseek(fd, data, os.SEEK_HOLE), end)
+            segments.append((data, hole - data, True))
+            pos = hole
+    except OSError:
+        return [(start, end - start, True)] if end > start else []
+
+    return segments
+##
+## @brief      Determines if data only holds zeros
+##
+## @param      data  bytes-like object
+##
+## @return     True if data only holds zeros, False otherwise.
+##
+def is_zero(data):
+    data = bytes(data)
+    for i in range(0, len(data), COPY_BLK_SZ):
+        chunk = data[i:i + COPY_BLK_SZ]
+        # bytes comparison is a plain memcmp
+        if chunk != ZERO_BYTES[:len(chunk)]:
+            return False
+    return True
 # =============================================================================
 #  CLASSES
 # =============================================================================
@@ -57,16 +126,27 @@ class BinaryFile(object):
     ##
     ## @brief      Constructs the object.
     ##
-    ## @param      fpath  File's path
-    ## @param      mode   Open mode ('r' or 'w')
+    ## @param      fpath       File's path
+    ## @param      mode        Open mode ('r' or 'w')
+    ## @param      positional  Reads at a given offset use pread() and leave
+    ##                         file position untouched, such reads can be
+    ##                         issued by several threads sharing the file.
+    ## @param      mapped      File opened for reading is memory-mapped and
+    ##                         read() returns memoryview slices of the
+    ##                         mapping instead of bytes copies.
     ##
-    def __init__(self, fpath, mode):
+    def __init__(self, fpath, mode, positional=False, mapped=False):
         self.fp = None
         self.path = fpath
         self.mode = mode
+        self.positional = positional
+        self.mapped = mapped
+        self._map = None
+        self._view = None
         self.dirname = os.path.dirname(fpath)
         self.basename = os.path.basename(fpath)
         self.abspath = os.path.abspath(fpath)
+        self.hasher = None
     ##
     ## @brief      { function_description }
     ##
@@ -106,6 +186,12 @@ class BinaryFile(object):
             self.fp = None
             return False
 
+        if self.mapped and self.mode == 'r' and self.size() > 0:
+            # an empty file cannot be mapped, it is read as usual
+            self._map = mmap.mmap(self.fp.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+            self._view = memoryview(self._map)
+
         return True
     ##
     ## @brief      Releases underlying file handle
@@ -115,6 +201,17 @@ class BinaryFile(object):
             LGR.warn("binary file is already closed.")
             return False
 
+        if self._map is not None:
+            self._view.release()
+            try:
+                self._map.close()
+            except BufferError:
+                # slices returned by read() are still in use, mapping is
+                # released when they are
+                LGR.debug("mapping still referenced, left to be collected.")
+            self._view = None
+            self._map = None
+
         self.fp.close()
         self.fp = None
         return True
@@ -133,6 +230,25 @@ class BinaryFile(object):
     def size(self):
         return self.stat().st_size
     ##
+    ## @brief      Returns data and hole segments of the file, holes of
+    ##             sparse files read as zeros and need not be read.
+    ##
+    ## @param      start  The start
+    ## @param      size   The size, up to the end of file if None
+    ##
+    ## @return     list of (offset, size, is_data) tuples
+    ##
+    def data_map(self, start=0, size=None):
+        end = self.size()
+        if size is not None:
+            end = min(end, start + size)
+        # a dedicated descriptor leaves file object position untouched
+        fd = os.open(self.abspath, os.O_RDONLY)
+        try:
+            return data_map(fd, start, end)
+        finally:
+            os.close(fd)
+    ##
     ## @brief      Places cursor at given offset in file using whence
     ##
     ## @param      offset  The offset
@@ -141,37 +257,104 @@ class BinaryFile(object):
     ## @return     { description_of_the_return_value }
     ##
     def seek(self, offset, whence=io.SEEK_SET):
+        if self.hasher is not None:
+            # written data is no longer a stream
+            LGR.debug("seek while hashing written data => hashing aborted.")
+            self.hasher = None
         return self.fp.seek(offset, whence)
     ##
     ## @brief      Reads n bytes from file as text using encoding.
     ##
-    ## @param      n         Number of bytes to read
+    ## @param      size      Number of bytes to read
     ## @param      encoding  Encoding to use for decoding read bytes
     ##
     ## @return     str
     ##
     def read_text(self, size=-1, seek=None, encoding='utf-8'):
-        return self.read(n, seek).decode(encoding)
+        return str(self.read(size, seek), encoding)
     ##
     ## @brief      Reads n bytes from file.
     ##
-    ## @param      n     Number of bytes to read
+    ## @param      size  Number of bytes to read
+    ## @param      seek  Offset to read from, file position is left
+    ##                   untouched when file is positional
     ##
-    ## @return     bytes
+    ## @return     bytes, or a memoryview when file is mapped
     ##
     def read(self, size=-1, seek=None):
+        if self._view is not None:
+            return self.__read_mapped(size, seek)
+        if self.positional and isinstance(seek, int):
+            if size is None or size < 0:
+                size = max(0, self.size() - seek)
+            fd = self.fp.fileno()
+            data = os.pread(fd, size, seek)
+            if len(data) == size or not data:
+                return data
+            # a single call may return less than requested for large reads
+            parts = [data]
+            done = len(data)
+            while done < size:
+                data = os.pread(fd, size - done, seek + done)
+                if not data:
+                    break
+                parts.append(data)
+                done += len(data)
+            return b''.join(parts)
         if isinstance(seek, int):
             self.seek(seek)
         return self.fp.read(size)
     ##
+    ## @brief      Slices n bytes of the mapping, no data is copied.
+    ##
+    ## @param      size  Number of bytes to read
+    ## @param      seek  Offset to read from
+    ##
+    ## @return     memoryview, valid until all views are released
+    ##
+    def __read_mapped(self, size, seek):
+        positional = self.positional and isinstance(seek, int)
+        if positional:
+            start = seek
+        else:
+            if isinstance(seek, int):
+                self.seek(seek)
+            start = self.fp.tell()
+        end = len(self._view)
+        if size is not None and size >= 0:
+            end = min(end, start + size)
+        data = self._view[start:max(start, end)]
+        if not positional:
+            self.fp.seek(start + len(data))
+        return data
+    ##
     ## @brief      Reads bytes N bytes into given buffer, N being buffer size.
     ##
-    ## @param      b     { parameter_description }
+    ## @param      b       Writable bytes-like object
+    ## @param      offset  Offset to read from using pread(), file position
+    ##                     is left untouched. Reads at file position if None.
     ##
-    ## @return     { description_of_the_return_value }
+    ## @return     number of bytes read, less than buffer size at end of file
     ##
-    def readinto(self, b):
-        return self.fp.readinto(b)
+    def readinto(self, b, offset=None):
+        if offset is None:
+            return self.fp.readinto(b)
+
+        fd = self.fp.fileno()
+        view = memoryview(b).cast('B')
+        done = 0
+        # a single call may return less than requested for large buffers
+        while done < len(view):
+            if HAS_PREADV:
+                n = os.preadv(fd, [view[done:]], offset + done)
+            else:
+                data = os.pread(fd, len(view) - done, offset + done)
+                n = len(data)
+                view[done:done + n] = data
+            if n == 0:
+                break
+            done += n
+        return done
     ##
     ## @brief      Writes bytes to file as text using encoding.
     ##
@@ -181,17 +364,149 @@ class BinaryFile(object):
     ## @return     { description_of_the_return_value }
     ##
     def write_text(self, text, encoding='utf-8'):
-        return self.fp.write(text.encode(encoding))
+        return self.write(text.encode(encoding))
     ##
-    ## @brief      Writes bytes to file.
+    ## @brief      Writes bytes to file, they are hashed as well when a
+    ##             hasher was set.
     ##
     ## @param      data  The data
     ##
     ## @return     { description_of_the_return_value }
     ##
     def write(self, data):
+        if self.hasher is not None:
+            self.hasher.update(data)
         return self.fp.write(data)
     ##
+    ## @brief      Moves forward without writing, skipped bytes are left as a
+    ##             hole which reads as zeros and are hashed as such.
+    ##
+    ## @param      size  The size
+    ##
+    def skip(self, size):
+        if size <= 0:
+            return
+        if self.hasher is not None:
+            remaining = size
+            while remaining > 0:
+                n = min(remaining, COPY_BLK_SZ)
+                self.hasher.update(ZEROS[:n])
+                remaining -= n
+        self.fp.seek(size, io.SEEK_CUR)
+        # extends the file when the hole is at its end
+        self.fp.truncate()
+    ##
+    ## @brief      Copies a range of this file at the current position of
+    ##             another file, holes are skipped instead of being read and
+    ##             written. Data is copied by the kernel when output file is
+    ##             not hashed, large buffered reads and writes are used
+    ##             otherwise.
+    ##
+    ## @param      obf     Output binary file
+    ## @param      offset  The offset
+    ## @param      size    The size
+    ##
+    ## @return     number of bytes copied
+    ##
+    def copy_range(self, obf, offset, size):
+        direct = (obf.hasher is None and (HAS_COPY_FILE_RANGE or
+                                          HAS_SENDFILE))
+        copied = 0
+        for (start, length, is_data) in self.data_map(offset, size):
+            if not is_data:
+                obf.skip(length)
+                copied += length
+                continue
+            if direct:
+                n = self.__copy_direct(obf, start, length)
+            else:
+                n = self.__copy_buffered(obf, start, length)
+            copied += n
+            if n < length:
+                break
+        return copied
+    ##
+    ## @brief      Copies a range using copy_file_range() or sendfile(),
+    ##             falls back to a buffered copy if kernel refuses to copy.
+    ##
+    ## @param      obf     Output binary file
+    ## @param      start   The start
+    ## @param      length  The length
+    ##
+    ## @return     number of bytes copied
+    ##
+    def __copy_direct(self, obf, start, length):
+        (src, dst) = (self.fp.fileno(), obf.fp.fileno())
+        # pending writes must reach dst before kernel writes after them
+        obf.fp.flush()
+        pos = obf.fp.tell()
+        done = 0
+        try:
+            while done < length:
+                if HAS_COPY_FILE_RANGE:
+                    n = os.copy_file_range(src, dst, length - done,
+                                           start + done, pos + done)
+                else:
+                    os.lseek(dst, pos + done, io.SEEK_SET)
+                    n = os.sendfile(dst, src, start + done, length - done)
+                if n == 0:
+                    break
+                done += n
+        except OSError as e:
+            LGR.debug("kernel copy failed ({}) => buffered copy.".format(e))
+            obf.fp.seek(pos + done)
+            return done + self.__copy_buffered(obf, start + done,
+                                               length - done)
+        # output file object does not know kernel moved its position
+        obf.fp.seek(pos + done)
+        return done
+    ##
+    ## @brief      Copies a range reading it into a page aligned buffer
+    ##
+    ## @param      obf     Output binary file
+    ## @param      start   The start
+    ## @param      length  The length
+    ##
+    ## @return     number of bytes copied
+    ##
+    def __copy_buffered(self, obf, start, length):
+        if length <= 0:
+            return 0
+        buf = mmap.mmap(-1, min(length, RANGE_BLK_SZ))
+        view = memoryview(buf)
+        done = 0
+        try:
+            while done < length:
+                n = self.readinto(view[:min(length - done, len(buf))],
+                                  start + done)
+                if not n:
+                    break
+                obf.write(view[:n])
+                done += n
+        finally:
+            view.release()
+            buf.close()
+        return done
+    ##
+    ## @brief      Hashes data written from now on, file must be written
+    ##             sequentially from its beginning.
+    ##
+    ## @param      hasher  Object having update(data) and digests() methods,
+    ##                     see utils.crypto.MultiHasher
+    ##
+    def set_hasher(self, hasher):
+        self.hasher = hasher
+    ##
+    ## @brief      Returns digests of data written so far
+    ##
+    ## @return     dict mapping hash function to digest or None if written
+    ##             data was not hashed
+    ##
+    def digests(self):
+        if self.hasher is None:
+            return None
+        return self.hasher.digests()
+    ##
     ## @brief      Flushes underlying file buffer
     ##
     def flush(self):
@@ -0,0 +1,194 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: bloom_filter.py
+#     date: 2018-02-10
+#   author: koromodako
+#  purpose:
+#       Compact probabilistic set of digests answering definite misses.
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2018 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import os
+import mmap
+import math
+import struct
+from utils.crypto import hashbuf
+from utils.wrapper import trace
+from utils.logging import get_logger
+from utils.wrapper import trace_static
+from utils.formatting import format_size
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# file header: magic, version, number of bits, number of hashes, capacity
+HEADER = struct.Struct('<4sIQIQ')
+MAGIC = b'DSBF'
+VERSION = 1
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Bloom filter of digests.
+##
+##             Digests being uniformly distributed, bit indexes are derived
+##             from the digest itself using double hashing.
+##
+class BloomFilter(object):
+    ##
+    ## @brief      Creates an empty filter sized for given capacity and false
+    ##             positive rate.
+    ##
+    ## @param      capacity  Expected number of digests
+    ## @param      fp_rate   Expected false positive rate
+    ##
+    ## @return     BloomFilter instance
+    ##
+    @staticmethod
+    @trace_static('BloomFilter')
+    def create(capacity, fp_rate):
+        capacity = max(capacity, 1)
+        num_bits = -capacity * math.log(fp_rate) / (math.log(2) ** 2)
+        num_bits = max(int(math.ceil(num_bits / 8)) * 8, 8)
+        num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        return BloomFilter(bytearray(num_bits // 8), num_bits, num_hashes,
+                           capacity)
+    ##
+    ## @brief      Loads a filter from a file, bits are mapped read-only so
+    ##             that processes loading the same file share its pages.
+    ##
+    ## @param      path  The path
+    ##
+    ## @return     BloomFilter instance or None
+    ##
+    @staticmethod
+    @trace_static('BloomFilter')
+    def load(path):
+        try:
+            with open(path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            LGR.error("failed to map bloom filter <{}>: {}".format(path, e))
+            return None
+
+        if len(mm) < HEADER.size:
+            LGR.error("truncated bloom filter <{}>.".format(path))
+            mm.close()
+            return None
+
+        (magic, version, num_bits, num_hashes, capacity) = \
+            HEADER.unpack_from(mm)
+        if (magic != MAGIC or version != VERSION or
+           len(mm) != HEADER.size + num_bits // 8):
+            LGR.error("invalid bloom filter <{}>.".format(path))
+            mm.close()
+            return None
+
+        bits = memoryview(mm)[HEADER.size:]
+        return BloomFilter(bits, num_bits, num_hashes, capacity, mm)
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      bits        The bits
+    ## @param      num_bits    The number of bits
+    ## @param      num_hashes  The number of hashes
+    ## @param      capacity    The capacity
+    ## @param      mm          Underlying memory map, if any
+    ##
+    def __init__(self, bits, num_bits, num_hashes, capacity, mm=None):
+        super(BloomFilter, self).__init__()
+        self.bits = bits
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.capacity = capacity
+        self._mm = mm
+    ##
+    ## @brief      Computes bit indexes of a digest
+    ##
+    ## @param      digest  The digest
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _indexes(self, digest):
+        if len(digest) < 16:
+            digest = hashbuf('sha256', digest)
+        h1 = int.from_bytes(digest[0:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits
+                for i in range(self.num_hashes)]
+    ##
+    ## @brief      Adds a digest to the filter
+    ##
+    ## @param      digest  The digest
+    ##
+    def add(self, digest):
+        for idx in self._indexes(digest):
+            self.bits[idx >> 3] |= (1 << (idx & 7))
+    ##
+    ## @brief      Determines if digest may be in the filter, False means it
+    ##             is definitely not.
+    ##
+    ## @param      digest  The digest
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def __contains__(self, digest):
+        for idx in self._indexes(digest):
+            if not self.bits[idx >> 3] & (1 << (idx & 7)):
+                return False
+        return True
+    ##
+    ## @brief      Saves the filter, file is replaced atomically.
+    ##
+    ## @param      path  The path
+    ##
+    ## @return     True if filter was saved, False otherwise.
+    ##
+    @trace()
+    def save(self, path):
+        tmp = '{}.tmp'.format(path)
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, VERSION, self.num_bits,
+                                    self.num_hashes, self.capacity))
+                f.write(self.bits)
+            os.replace(tmp, path)
+        except OSError as e:
+            LGR.warn("failed to save bloom filter <{}>: {}".format(path, e))
+            return False
+
+        return True
+    ##
+    ## @brief      Releases the memory map, if any.
+    ##
+    @trace()
+    def close(self):
+        if self._mm is not None:
+            self.bits.release()
+            self._mm.close()
+            self._mm = None
+    ##
+    ## @brief      Returns a string representation of the object.
+    ##
+    ## @return     String representation of the object.
+    ##
+    def __str__(self):
+        return "BloomFilter(size={},hashes={},capacity={})".format(
+            format_size(self.num_bits // 8), self.num_hashes, self.capacity)
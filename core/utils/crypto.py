@@ -25,6 +25,10 @@
 # IMPORTS
 # =============================================================================
 import os
+import hmac
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from Crypto.Hash import HMAC
 from Crypto.Hash import MD2
 from Crypto.Hash import MD4
@@ -38,17 +42,114 @@ from Crypto.Hash import SHA512
 from Crypto.Random import atfork
 from Crypto.Random import get_random_bytes
 from utils.logging import get_logger
+from utils.fuzzy_hash import FuzzyHash
+from utils.binary_file import ZEROS
+from utils.binary_file import data_map
+from utils.binary_file import HAS_PREADV
 from utils.binary_file import BinaryFile
 # =============================================================================
 # GLOBALS
 # =============================================================================
 LGR = get_logger(__name__)
 RD_BLK_SZ = 8192
+# size of buffer fed to hash objects, hashlib releases the GIL while hashing
+# buffers larger than 2 KiB so a large buffer lets threads hash in parallel
+MULTI_RD_BLK_SZ = 1024 * 1024
+# hashlib algorithm names, other algorithms fall back to PyCrypto
+HASHLIB_NAMES = {
+    'md4': 'md4',
+    'md5': 'md5',
+    'ripemd': 'ripemd160',
+    'sha': 'sha1',
+    'sha224': 'sha224',
+    'sha256': 'sha256',
+    'sha384': 'sha384',
+    'sha512': 'sha512'
+}
+HASHLIB_CACHE = {}
+PYCRYPTO_MODULES = {
+    'md2': MD2,
+    'md4': MD4,
+    'md5': MD5,
+    'ripemd': RIPEMD,
+    'sha': SHA,
+    'sha224': SHA224,
+    'sha256': SHA256,
+    'sha384': SHA384,
+    'sha512': SHA512
+}
+# context triggered piecewise hash, its digest is an ascii signature
+FUZZY_HASH_FUNC = 'ssdeep'
+# hash object types accepting memoryviews
+BUFFER_TYPES = (type(hashlib.sha256()), hmac.HMAC, FuzzyHash)
+# per-thread reusable read buffers
+LOCAL = threading.local()
+# per-process thread pool used by hashfiles(), created lazily
+EXECUTOR = None
+EXECUTOR_THREADS = 0
+# tree hash node prefixes, leaves and inner nodes can't be confused
+TREE_LEAF = b'\x00'
+TREE_NODE = b'\x01'
+# =============================================================================
+# CLASSES
+# =============================================================================
+##
+## @brief      Feeds data to several hash objects, see multihasher().
+##
+class MultiHasher(object):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      hashes  dict mapping hash function to hash object
+    ##
+    def __init__(self, hashes):
+        super(MultiHasher, self).__init__()
+        self.hashes = hashes
+        # PyCrypto objects only accept bytes
+        self.copy = not all(isinstance(h, BUFFER_TYPES)
+                            for h in hashes.values())
+    ##
+    ## @brief      Updates every hash object with data
+    ##
+    ## @param      data  bytes-like object
+    ##
+    def update(self, data):
+        if self.copy:
+            data = bytes(data)
+        for h in self.hashes.values():
+            h.update(data)
+    ##
+    ## @brief      Returns digests of data hashed so far
+    ##
+    ## @return     dict mapping hash function to digest
+    ##
+    def digests(self):
+        return {hash_func: h.digest()
+                for (hash_func, h) in self.hashes.items()}
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 ##
-## @brief      { function_description }
+## @brief      Determines if hashlib provides given algorithm
+##
+## @param      hash_func  The hash function
+##
+## @return     hashlib algorithm name or None
+##
+def __hashlib_name(hash_func):
+    if hash_func not in HASHLIB_CACHE:
+        name = HASHLIB_NAMES.get(hash_func)
+        if name is not None:
+            try:
+                hashlib.new(name)
+            except ValueError:
+                # listed but disabled by OpenSSL (e.g. md4 with OpenSSL 3)
+                name = None
+        HASHLIB_CACHE[hash_func] = name
+    return HASHLIB_CACHE[hash_func]
+##
+## @brief      Creates a hash object, hashlib is used when it provides the
+##             algorithm, PyCrypto otherwise.
 ##
 ## @param      hash_func  The hash function
 ##
@@ -64,35 +165,109 @@ def __new_hash(hash_func, key=None, digestmod=None):
         if key is None:
             LGR.error("key must be specified for hmac")
             return None
+        if digestmod is not None:
+            name = __hashlib_name(digestmod.lower())
+            if name is not None:
+                return hmac.new(key, digestmod=name)
         return HMAC.new(key, digestmod=__new_hash(digestmod))
-    elif hash_func == 'md2':
-        return MD2.new()
-    elif hash_func == 'md4':
-        return MD4.new()
-    elif hash_func == 'md5':
-        return MD5.new()
-    elif hash_func == 'ripemd':
-        return RIPEMD.new()
-    elif hash_func == 'sha':
-        return SHA.new()
-    elif hash_func == 'sha224':
-        return SHA224.new()
-    elif hash_func == 'sha256':
-        return SHA256.new()
-    elif hash_func == 'sha384':
-        return SHA384.new()
-    elif hash_func == 'sha512':
-        return SHA512.new()
+
+    if hash_func == FUZZY_HASH_FUNC:
+        return FuzzyHash()
+
+    name = __hashlib_name(hash_func)
+    if name is not None:
+        return hashlib.new(name)
+
+    module = PYCRYPTO_MODULES.get(hash_func)
+    if module is not None:
+        return module.new()
 
     LGR.warn("unknown hash_func value: <{}>".format(hash_func))
     return None
 ##
+## @brief      Feeds zeros standing for a hole of a sparse file to a hash
+##             object, nothing is read.
+##
+## @param      h     Hash object or MultiHasher
+## @param      size  The size
+##
+def __hash_zeros(h, size):
+    copy = not isinstance(h, BUFFER_TYPES + (MultiHasher,))
+    while size > 0:
+        data = ZEROS[:min(size, len(ZEROS))]
+        if copy:
+            data = bytes(data)
+        h.update(data)
+        size -= len(data)
+##
+## @brief      Creates a MultiHasher computing given digests in a single pass
+##
+## @param      hash_funcs  The hash functions
+##
+## @return     MultiHasher instance or None
+##
+def multihasher(hash_funcs, key=None, digestmod=None):
+    hashes = {}
+    for hash_func in hash_funcs:
+        h = __new_hash(hash_func, key, digestmod)
+        if h is None:
+            LGR.error("invalid hash object returned.")
+            return None
+        hashes[hash_func] = h
+    return MultiHasher(hashes)
+##
+## @brief      Returns a read buffer owned by calling thread, it is allocated
+##             once and reused for every file.
+##
+## @return     (bytearray, memoryview) tuple
+##
+def __buffer():
+    buf = getattr(LOCAL, 'buf', None)
+    if buf is None:
+        buf = bytearray(MULTI_RD_BLK_SZ)
+        LOCAL.buf = buf
+        LOCAL.view = memoryview(buf)
+    return (buf, LOCAL.view)
+##
+## @brief      Returns the thread pool of this process, it is (re)created
+##             when a different number of threads is requested.
+##
+## @param      num_threads  The number of threads
+##
+## @return     ThreadPoolExecutor instance
+##
+def __executor(num_threads):
+    global EXECUTOR, EXECUTOR_THREADS
+    if EXECUTOR is None or EXECUTOR_THREADS != num_threads:
+        if EXECUTOR is not None:
+            EXECUTOR.shutdown()
+        EXECUTOR = ThreadPoolExecutor(max_workers=num_threads)
+        EXECUTOR_THREADS = num_threads
+    return EXECUTOR
+##
 ## @brief      { function_description }
 ##
 ## @return     { description_of_the_return_value }
 ##
 def re_init():
+    global EXECUTOR, EXECUTOR_THREADS
     atfork()
+    # threads do not survive fork, parent's pool is unusable
+    EXECUTOR = None
+    EXECUTOR_THREADS = 0
+##
+## @brief      Converts a digest to text, fuzzy hash signatures are already
+##             printable.
+##
+## @param      hash_func  The hash function
+## @param      digest     The digest
+##
+## @return     hexdigest or signature
+##
+def hexdigest(hash_func, digest):
+    if hash_func.lower() == FUZZY_HASH_FUNC:
+        return digest.decode()
+    return digest.hex()
 ##
 ## @brief      { function_description }
 ##
@@ -120,24 +295,274 @@ def randstr(sz):
 ## @return     { description_of_the_return_value }
 ##
 def hashfile(hash_func, path, key=None, digestmod=None):
+    digests = hashfile_multi([hash_func], path, key, digestmod)
+    if digests is None:
+        return None
+
+    return digests[hash_func]
+##
+## @brief      Computes several digests of a file reading it only once, each
+##             buffer read is fed to every hash object. Holes of sparse
+##             files are hashed as zeros without being read.
+##
+## @param      hash_funcs  The hash functions
+## @param      path        The path
+##
+## @return     dict mapping hash function to digest or None
+##
+def hashfile_multi(hash_funcs, path, key=None, digestmod=None):
     if not BinaryFile.exists(path):
         LGR.error("file must exists to be hashed.")
         return None
 
-    h = __new_hash(hash_func, key, digestmod)
-    if h is None:
-        LGR.error("invalid hash object returned.")
+    with BinaryFile(path, 'r') as bf:
+        return hashbf_multi(hash_funcs, bf, key, digestmod)
+##
+## @brief      Computes several digests of an opened binary file or virtual
+##             file, see hashfile_multi().
+##
+## @param      hash_funcs  The hash functions
+## @param      bf          The opened file
+##
+## @return     dict mapping hash function to digest or None
+##
+def hashbf_multi(hash_funcs, bf, key=None, digestmod=None):
+    hasher = multihasher(hash_funcs, key, digestmod)
+    if hasher is None:
         return None
 
+    (buf, view) = __buffer()
+    for (offset, size, is_data) in bf.data_map():
+        if not is_data:
+            __hash_zeros(hasher, size)
+            continue
+        while size > 0:
+            sz = bf.readinto(view[:min(size, len(buf))], offset)
+            if not sz:
+                break
+            hasher.update(view[:sz])
+            offset += sz
+            size -= sz
+
+    return hasher.digests()
+##
+## @brief      Computes digests of several files concurrently using a pool
+##             of threads.
+##
+## @param      hash_funcs   The hash functions
+## @param      paths        The paths
+## @param      num_threads  The number of threads, files are hashed
+##                          sequentially by calling thread when lower than 2
+##
+## @return     generator of (path, digests) tuples in paths order, digests
+##             being None when the file could not be hashed
+##
+def hashfiles(hash_funcs, paths, num_threads=1):
+    def routine(path):
+        try:
+            return hashfile_multi(hash_funcs, path)
+        except OSError as e:
+            LGR.warn("failed to hash <{}>: {}".format(path, e))
+            return None
+
+    paths = list(paths)
+    if num_threads < 2:
+        results = map(routine, paths)
+    else:
+        results = __executor(num_threads).map(routine, paths)
+
+    return zip(paths, results)
+##
+## @brief      Computes digests of every aligned block of a file, a trailing
+##             partial block is ignored. Blocks lying in holes of sparse
+##             files are skipped without being read as they only hold zeros.
+##
+## @param      hash_func   The hash function
+## @param      path        The path
+## @param      block_size  The block size
+##
+## @return     generator of (offset, digest) tuples
+##
+def hashblocks(hash_func, path, block_size):
     with BinaryFile(path, 'r') as bf:
-        sz = bf.size()
+        yield from hashbf_blocks(hash_func, bf, block_size)
+##
+## @brief      Computes digests of every aligned block of an opened binary
+##             file or virtual file, see hashblocks().
+##
+## @param      hash_func   The hash function
+## @param      bf          The opened file
+## @param      block_size  The block size
+##
+## @return     generator of (offset, digest) tuples
+##
+def hashbf_blocks(hash_func, bf, block_size):
+    proto = __new_hash(hash_func)
+    if proto is None:
+        LGR.error("invalid hash object returned.")
+        return
 
-        while sz > 0:
-            h.update(bf.read(RD_BLK_SZ))
-            sz -= RD_BLK_SZ
+    copy = not isinstance(proto, BUFFER_TYPES)
+    # buffer holds a whole number of blocks
+    size = max(1, MULTI_RD_BLK_SZ // block_size) * block_size
+    buf = bytearray(size)
+    view = memoryview(buf)
+    end = bf.size() // block_size * block_size
+    # aligned ranges of blocks lying entirely within a hole
+    holes = []
+    for (start, length, is_data) in bf.data_map(0, end):
+        first = -(-start // block_size) * block_size
+        last = (start + length) // block_size * block_size
+        if not is_data and first < last:
+            holes.append((first, last))
+    holes.append((end, end))
 
+    offset = 0
+    for (hole_start, hole_end) in holes:
+        while offset < hole_start:
+            # fill buffer entirely to keep blocks aligned
+            want = min(size, hole_start - offset)
+            sz = 0
+            while sz < want:
+                n = bf.readinto(view[sz:want], offset + sz)
+                if not n:
+                    break
+                sz += n
+            for start in range(0, sz - block_size + 1, block_size):
+                data = view[start:start + block_size]
+                if copy:
+                    data = bytes(data)
+                h = proto.copy()
+                h.update(data)
+                yield (offset + start, h.digest())
+            if sz < want:
+                return
+            offset += sz
+        offset = hole_end
+##
+## @brief      Hashes a range of a file as a tree leaf, the range is read
+##             using positional reads so that threads can share fd. Holes
+##             are hashed as zeros without being read.
+##
+## @param      hash_func  The hash function
+## @param      fd         The file descriptor
+## @param      offset     The offset
+## @param      size       The size
+##
+## @return     leaf digest
+##
+def __hash_leaf(hash_func, fd, offset, size):
+    h = __new_hash(hash_func)
+    copy = not isinstance(h, BUFFER_TYPES)
+    (buf, view) = __buffer()
+    h.update(TREE_LEAF)
+    for (offset, size, is_data) in data_map(fd, offset, offset + size):
+        if not is_data:
+            __hash_zeros(h, size)
+            continue
+        while size > 0:
+            want = min(size, len(buf))
+            if HAS_PREADV:
+                sz = os.preadv(fd, [view[:want]], offset)
+                data = view[:sz]
+            else:
+                data = os.pread(fd, want, offset)
+                sz = len(data)
+            if sz == 0:
+                break
+            if copy:
+                data = bytes(data)
+            h.update(data)
+            offset += sz
+            size -= sz
     return h.digest()
 ##
+## @brief      Computes leaf digests of a tree hash, each chunk_size bytes
+##             chunk is hashed independently using a pool of threads.
+##
+## @param      hash_func    The hash function
+## @param      path         The path
+## @param      chunk_size   The chunk size
+## @param      indexes      Indexes of chunks to hash, all chunks when None.
+##                          Allows to re-hash damaged ranges only.
+## @param      num_threads  The number of threads
+##
+## @return     list of leaf digests ordered as indexes or None
+##
+def treehash_leaves(hash_func, path, chunk_size, indexes=None,
+                    num_threads=1):
+    if __new_hash(hash_func) is None:
+        LGR.error("invalid hash object returned.")
+        return None
+
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError as e:
+        LGR.error("failed to open <{}>: {}".format(path, e))
+        return None
+
+    try:
+        size = os.fstat(fd).st_size
+        if indexes is None:
+            # an empty file still has one (empty) leaf
+            indexes = range(max(1, -(-size // chunk_size)))
+
+        def routine(index):
+            offset = index * chunk_size
+            return __hash_leaf(hash_func, fd, offset,
+                               max(0, min(chunk_size, size - offset)))
+
+        if num_threads < 2:
+            leaves = list(map(routine, indexes))
+        else:
+            leaves = list(__executor(num_threads).map(routine, indexes))
+    except OSError as e:
+        LGR.error("failed to hash <{}>: {}".format(path, e))
+        return None
+    finally:
+        os.close(fd)
+
+    return leaves
+##
+## @brief      Combines leaf digests into root digest, nodes are paired level
+##             by level and an odd node is promoted to next level as is.
+##
+## @param      hash_func  The hash function
+## @param      leaves     The leaves
+##
+## @return     root digest
+##
+def treehash_root(hash_func, leaves):
+    level = list(leaves)
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level) - 1, 2):
+            h = __new_hash(hash_func)
+            h.update(TREE_NODE + level[i] + level[i + 1])
+            parents.append(h.digest())
+        if len(level) % 2 == 1:
+            parents.append(level[-1])
+        level = parents
+    return level[0]
+##
+## @brief      Computes a tree hash of a file: fixed size chunks are hashed
+##             in parallel then combined into a root digest.
+##
+## @param      hash_func    The hash function
+## @param      path         The path
+## @param      chunk_size   The chunk size
+## @param      num_threads  The number of threads
+##
+## @return     (root digest, leaf digests) tuple or None
+##
+def treehash(hash_func, path, chunk_size, num_threads=1):
+    leaves = treehash_leaves(hash_func, path, chunk_size,
+                             num_threads=num_threads)
+    if leaves is None:
+        return None
+
+    return (treehash_root(hash_func, leaves), leaves)
+##
 ## @brief      { function_description }
 ##
 ## @param      hash_func  The hash function
@@ -146,7 +571,7 @@ def hashfile(hash_func, path, key=None, digestmod=None):
 ## @return     { description_of_the_return_value }
 ##
 def hashbuf(hash_func, buf, key=None, digestmod=None):
-    h = __new_hash(hash_func)
+    h = __new_hash(hash_func, key, digestmod)
     if h is None:
         LGR.error("invalid hash object returned.")
         return None
@@ -50,7 +50,7 @@ class DBAdapter(object):
         self._conf = conf
         ## @brief Multiprocessing lock to prevent concurrency issues
         self._lock = mp.Lock()
-        ## @brief Open mode can be 'r' or 'w'
+        ## @brief Open mode can be 'r', 'w' or 'u'
         self.__mode = None
         ## @brief Is self a valid instance ?
         self.__valid = False
@@ -77,6 +77,16 @@ class DBAdapter(object):
     def _init_w(self):
         raise NotImplementedError
     ##
+    ## @brief      Opens an existing database to update its content.
+    ##             Subclasses supporting updates must override this method.
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def _init_u(self):
+        LGR.error("{} does not support update mode.".format(
+            type(self).__name__))
+        return False
+    ##
     ## @brief      { function_description }
     ##
     ## @return     { description_of_the_return_value }
@@ -108,8 +118,8 @@ class DBAdapter(object):
     ##
     @trace()
     def init(self, mode):
-        if mode not in ['r', 'w']:
-            raise ValueError("mode must be one of ['r', 'w']")
+        if mode not in ['r', 'w', 'u']:
+            raise ValueError("mode must be one of ['r', 'w', 'u']")
         self.__mode = mode
 
         if not self._check_conf():
@@ -118,10 +128,20 @@ class DBAdapter(object):
 
         if self.__mode == 'r':
             self.__valid = self._init_r()
+        elif self.__mode == 'u':
+            self.__valid = self._init_u()
         else:
             self.__valid = self._init_w()
     ##
-    ## @brief      { function_description }
+    ## @brief      Returns open mode
+    ##
+    ## @return     'r', 'w', 'u' or None
+    ##
+    @trace()
+    def mode(self):
+        return self.__mode
+    ##
+    ## @brief      Closes the database, update mode is closed as write mode.
     ##
     ## @return     { description_of_the_return_value }
     ##
@@ -0,0 +1,371 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: fuzzy_hash.py
+#     date: 2018-02-24
+#   author: koromodako
+#  purpose:
+#       Context triggered piecewise hashing compatible with ssdeep.
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2018 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import re
+from utils.logging import get_logger
+try:
+    import ssdeep
+except ImportError:
+    ssdeep = None
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# native implementation is required, pure Python one is meant for tests
+HAS_SSDEEP = (ssdeep is not None)
+B64 = b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+B64_INDEX = {c: i for (i, c) in enumerate(B64.decode())}
+ROLLING_WINDOW = 7
+MIN_BLOCKSIZE = 3
+SPAMSUM_LENGTH = 64
+NUM_BLOCKHASHES = 31
+# only the 6 lowest bits of the FNV sum hash are used, they only depend on
+# the 6 lowest bits of its state, prime and initial value
+HASH_PRIME = 0x01000193 & 63
+HASH_INIT = 0x28021967 & 63
+MASK32 = 0xffffffff
+# FNV_TABLES[c] maps every piece hash state to its successor after byte c
+FNV_TABLES = [bytes(((state * HASH_PRIME) ^ c) & 63 for state in range(256))
+              for c in range(256)]
+IDENTITY = bytes(range(64))
+# runs of more than 3 identical characters carry no information
+SEQUENCE = re.compile(r'(.)\1{3,}')
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Streaming fuzzy hash, digest() returns the ssdeep signature as
+##             ascii bytes: 'blocksize:hash1:hash2'.
+##
+##             The ssdeep module is used when installed, a pure Python
+##             implementation of the same algorithm is used otherwise, see
+##             available().
+##
+class FuzzyHash(object):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    def __init__(self):
+        super(FuzzyHash, self).__init__()
+        self._native = None
+        if ssdeep is not None:
+            self._native = ssdeep.Hash()
+            return
+        self.total_size = 0
+        self.bhstart = 0
+        self.bhend = 1
+        self.h = [HASH_INIT] * NUM_BLOCKHASHES
+        self.halfh = [HASH_INIT] * NUM_BLOCKHASHES
+        self.digest_chars = [bytearray(SPAMSUM_LENGTH)
+                             for i in range(NUM_BLOCKHASHES)]
+        self.halfdigest = [0] * NUM_BLOCKHASHES
+        self.dlen = [0] * NUM_BLOCKHASHES
+        self.window = bytearray(ROLLING_WINDOW)
+        self.h1 = 0
+        self.h2 = 0
+        self.h3 = 0
+        self.n = 0
+    ##
+    ## @brief      Starts hashing a block size twice larger than the largest
+    ##             one currently hashed.
+    ##
+    def _fork(self):
+        if self.bhend >= NUM_BLOCKHASHES:
+            return
+        i = self.bhend
+        self.h[i] = self.h[i - 1]
+        self.halfh[i] = self.halfh[i - 1]
+        self.digest_chars[i][0] = 0
+        self.halfdigest[i] = 0
+        self.dlen[i] = 0
+        self.bhend += 1
+    ##
+    ## @brief      Stops hashing the smallest block size once it can't be
+    ##             selected anymore.
+    ##
+    def _reduce(self):
+        if self.bhstart + 1 >= self.bhend:
+            return
+        if (MIN_BLOCKSIZE << self.bhstart) * SPAMSUM_LENGTH >= \
+           self.total_size:
+            return
+        if self.dlen[self.bhstart + 1] < SPAMSUM_LENGTH // 2:
+            return
+        self.bhstart += 1
+    ##
+    ## @brief      Updates the hash with data
+    ##
+    ## @param      data  bytes-like object
+    ##
+    def update(self, data):
+        if self._native is not None:
+            try:
+                self._native.update(data)
+            except TypeError:
+                # some bindings only take bytes
+                self._native.update(bytes(data))
+            return
+        self.total_size += len(data)
+        window = self.window
+        (h1, h2, h3, n) = (self.h1, self.h2, self.h3, self.n)
+        modulo = MIN_BLOCKSIZE << self.bhstart
+        start = 0
+        for (pos, c) in enumerate(data):
+            # rolling hash of the last ROLLING_WINDOW bytes, h1 and h2 are
+            # exact sums over the window and never overflow
+            h2 += ROLLING_WINDOW * c - h1
+            h1 += c - window[n]
+            window[n] = c
+            n += 1
+            if n == ROLLING_WINDOW:
+                n = 0
+            h3 = ((h3 << 5) ^ c) & MASK32
+            rh = (h1 + h2 + h3) & MASK32
+            # trigger points are rare, piece hashes are only brought up to
+            # date when one is reached
+            if (rh + 1) % modulo == 0:
+                self._fold(data[start:pos + 1])
+                start = pos + 1
+                self._trigger(rh)
+                modulo = MIN_BLOCKSIZE << self.bhstart
+        self._fold(data[start:])
+        (self.h1, self.h2, self.h3, self.n) = (h1, h2, h3, n)
+    ##
+    ## @brief      Updates piece hashes of every block size with data
+    ##
+    ## @param      data  bytes-like object
+    ##
+    def _fold(self, data):
+        # piece hashes only have 64 states, the images of all of them are
+        # computed at once
+        states = IDENTITY
+        for c in data:
+            states = states.translate(FNV_TABLES[c])
+        for i in range(self.bhstart, self.bhend):
+            self.h[i] = states[self.h[i]]
+            self.halfh[i] = states[self.halfh[i]]
+    ##
+    ## @brief      Ends pieces of every block size triggered by rolling hash
+    ##
+    ## @param      rh    The rolling hash
+    ##
+    def _trigger(self, rh):
+        i = self.bhstart
+        while i < self.bhend:
+            bs = MIN_BLOCKSIZE << i
+            if rh % bs != bs - 1:
+                break
+            if self.dlen[i] == 0:
+                self._fork()
+            self.digest_chars[i][self.dlen[i]] = B64[self.h[i]]
+            self.halfdigest[i] = B64[self.halfh[i]]
+            if self.dlen[i] < SPAMSUM_LENGTH - 1:
+                self.dlen[i] += 1
+                self.digest_chars[i][self.dlen[i]] = 0
+                self.h[i] = HASH_INIT
+                if self.dlen[i] < SPAMSUM_LENGTH // 2:
+                    self.halfh[i] = HASH_INIT
+                    self.halfdigest[i] = 0
+            else:
+                self._reduce()
+            i += 1
+    ##
+    ## @brief      Returns the signature of data hashed so far
+    ##
+    ## @return     ascii bytes
+    ##
+    def digest(self):
+        if self._native is not None:
+            return self._native.digest().encode()
+        bi = self.bhstart
+        rh = (self.h1 + self.h2 + self.h3) & MASK32
+        while (MIN_BLOCKSIZE << bi) * SPAMSUM_LENGTH < self.total_size:
+            bi += 1
+            if bi >= NUM_BLOCKHASHES:
+                raise OverflowError("input is too large to be fuzzy hashed.")
+        while bi >= self.bhend:
+            bi -= 1
+        while bi > self.bhstart and self.dlen[bi] < SPAMSUM_LENGTH // 2:
+            bi -= 1
+
+        result = bytearray('{}:'.format(MIN_BLOCKSIZE << bi).encode())
+        dlen = self.dlen[bi]
+        result += self.digest_chars[bi][:dlen]
+        if rh != 0:
+            result.append(B64[self.h[bi]])
+        elif self.digest_chars[bi][dlen] != 0:
+            result.append(self.digest_chars[bi][dlen])
+        result.append(ord(':'))
+        if bi < self.bhend - 1:
+            bi += 1
+            dlen = min(self.dlen[bi], SPAMSUM_LENGTH // 2 - 1)
+            result += self.digest_chars[bi][:dlen]
+            if rh != 0:
+                result.append(B64[self.halfh[bi]])
+            elif self.halfdigest[bi] != 0:
+                result.append(self.halfdigest[bi])
+        elif rh != 0:
+            if bi == 0:
+                result.append(B64[self.h[bi]])
+            else:
+                result.append(B64[self.halfh[bi]])
+        return bytes(result)
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+##
+## @brief      Determines if fuzzy hashing can be enabled. The pure Python
+##             implementation hashes about 1MB/s and would slow down every
+##             hashing pass, it must be explicitly allowed.
+##
+## @param      allow_python  Allow pure Python implementation
+##
+## @return     True if available, False otherwise.
+##
+def available(allow_python=False):
+    if HAS_SSDEEP:
+        return True
+
+    if not allow_python:
+        LGR.error("fuzzy hashing requires the ssdeep module, install it or "
+                  "use --fuzzy-python for testing purpose.")
+        return False
+
+    LGR.warn("ssdeep module missing => slow pure Python fuzzy hashing used.")
+    return True
+##
+## @brief      Splits a signature into its parts, sequences of more than 3
+##             identical characters are reduced to 3 characters as ssdeep
+##             does before comparing signatures.
+##
+## @param      signature  The signature
+##
+## @return     (block size, hash1, hash2) tuple
+##
+def parse(signature):
+    (block_size, hash1, hash2) = signature.split(':', 2)
+    return (int(block_size),
+            SEQUENCE.sub(r'\1\1\1', hash1),
+            SEQUENCE.sub(r'\1\1\1', hash2))
+##
+## @brief      Returns ROLLING_WINDOW characters long substrings of a hash
+##             encoded as integers. Two hashes can only be similar if they
+##             share at least one of them.
+##
+## @param      hash_part  The hash part
+##
+## @return     set of integers
+##
+def ngrams(hash_part):
+    values = set()
+    for i in range(len(hash_part) - ROLLING_WINDOW + 1):
+        value = 0
+        for c in hash_part[i:i + ROLLING_WINDOW]:
+            value = (value << 6) | B64_INDEX.get(c, 0)
+        values.add(value)
+    return values
+##
+## @brief      Returns (block size, n-gram) keys under which a signature is
+##             indexed. Signatures can only be similar when their hashes of
+##             a common block size share an n-gram, querying an index with
+##             the keys of a signature returns every signature that may be
+##             similar to it.
+##
+## @param      signature  The signature
+##
+## @return     set of (block size, n-gram) tuples
+##
+def index_keys(signature):
+    (block_size, hash1, hash2) = parse(signature)
+    keys = set((block_size, ngram) for ngram in ngrams(hash1))
+    keys.update((block_size * 2, ngram) for ngram in ngrams(hash2))
+    return keys
+##
+## @brief      Computes edit distance, insertions and deletions cost 1 and
+##             substitutions cost 2.
+##
+## @param      s1    The s 1
+## @param      s2    The s 2
+##
+## @return     distance
+##
+def _edit_distance(s1, s2):
+    previous = list(range(len(s2) + 1))
+    for (i, c1) in enumerate(s1, 1):
+        current = [i]
+        for (j, c2) in enumerate(s2, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (0 if c1 == c2 else 2)))
+        previous = current
+    return previous[-1]
+##
+## @brief      Scores two hash parts computed with the same block size
+##
+## @param      s1          The s 1
+## @param      s2          The s 2
+## @param      block_size  The block size
+##
+## @return     score between 0 and 100
+##
+def _score(s1, s2, block_size):
+    if len(s1) < ROLLING_WINDOW or len(s2) < ROLLING_WINDOW:
+        return 0
+    if ngrams(s1).isdisjoint(ngrams(s2)):
+        return 0
+    score = _edit_distance(s1, s2)
+    score = (score * SPAMSUM_LENGTH) // (len(s1) + len(s2))
+    score = (100 * score) // SPAMSUM_LENGTH
+    if score >= 100:
+        return 0
+    score = 100 - score
+    # small block sizes can't produce high confidence matches
+    limit = (99 + ROLLING_WINDOW) // ROLLING_WINDOW * MIN_BLOCKSIZE
+    if block_size < limit:
+        score = min(score,
+                    block_size // MIN_BLOCKSIZE * min(len(s1), len(s2)))
+    return score
+##
+## @brief      Compares two signatures
+##
+## @param      signature1  The signature 1
+## @param      signature2  The signature 2
+##
+## @return     similarity score between 0 and 100
+##
+def compare(signature1, signature2):
+    (bs1, s11, s12) = parse(signature1)
+    (bs2, s21, s22) = parse(signature2)
+    if bs1 == bs2:
+        if s11 == s21:
+            return 100
+        return max(_score(s11, s21, bs1), _score(s12, s22, bs1 * 2))
+    if bs1 == bs2 * 2:
+        return _score(s11, s22, bs1)
+    if bs2 == bs1 * 2:
+        return _score(s12, s21, bs2)
+    return 0
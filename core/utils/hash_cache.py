@@ -0,0 +1,241 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: hash_cache.py
+#     date: 2018-02-17
+#   author: koromodako
+#  purpose:
+#       Persistent cache of file digests keyed by file identity.
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2018 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import os
+import sqlite3
+import utils.crypto as crypto
+import utils.config as config
+from utils.wrapper import trace
+from utils.logging import get_logger
+from utils.wrapper import trace_func
+from utils.wrapper import trace_static
+# =============================================================================
+#  GLOBALS / CONFIG
+# =============================================================================
+LGR = get_logger(__name__)
+# seconds to wait for a lock held by another process
+BUSY_TIMEOUT = 30.0
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Cache of digests keyed by (device, inode, size, mtime_ns,
+##             hash_func). A file is hashed again as soon as one of these
+##             changes.
+##
+##             Each process opens its own connection, concurrent writers are
+##             serialized by sqlite.
+##
+class HashCache(object):
+    ##
+    ## Instance of current process
+    ##
+    INSTANCE = None
+    ##
+    ## @brief      Returns cache instance of current process
+    ##
+    ## @return     HashCache instance or None if cache is disabled
+    ##
+    @staticmethod
+    @trace_static('HashCache')
+    def instance():
+        path = config.value('hash_cache')
+        if path is None:
+            return None
+
+        cache = HashCache.INSTANCE
+        # connections must not be shared with forked processes
+        if cache is None or cache.pid != os.getpid():
+            cache = HashCache(os.path.expanduser(path))
+            if not cache.open():
+                cache = None
+            HashCache.INSTANCE = cache
+
+        return cache
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      path  The path
+    ##
+    def __init__(self, path):
+        super(HashCache, self).__init__()
+        self.path = path
+        self.pid = os.getpid()
+        self.conn = None
+    ##
+    ## @brief      Opens the cache, creating it if needed
+    ##
+    ## @return     True if cache is usable, False otherwise.
+    ##
+    @trace()
+    def open(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS file_hash("
+                              "dev INTEGER, ino INTEGER, size INTEGER, "
+                              "mtime_ns INTEGER, hash_func TEXT, digest BLOB, "
+                              "PRIMARY KEY(dev, ino, size, mtime_ns, "
+                              "hash_func)) WITHOUT ROWID")
+            self.conn.commit()
+        except (OSError, sqlite3.Error) as e:
+            LGR.warn("failed to open hash cache <{}>: {} => cache "
+                     "disabled.".format(self.path, e))
+            self.conn = None
+            return False
+
+        return True
+    ##
+    ## @brief      Looks up cached digests of a file
+    ##
+    ## @param      st          os.stat_result of the file
+    ## @param      hash_funcs  The hash functions
+    ##
+    ## @return     dict mapping found hash functions to digest
+    ##
+    @trace()
+    def lookup(self, st, hash_funcs):
+        digests = {}
+        if self.conn is None:
+            return digests
+
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        try:
+            for hash_func in hash_funcs:
+                row = self.conn.execute(
+                    "SELECT digest FROM file_hash WHERE dev=? AND ino=? AND "
+                    "size=? AND mtime_ns=? AND hash_func=?",
+                    key + (hash_func,)).fetchone()
+                if row is not None:
+                    digests[hash_func] = row[0]
+        except sqlite3.Error as e:
+            LGR.warn("hash cache lookup failed: {}".format(e))
+
+        return digests
+    ##
+    ## @brief      Stores digests of several files in a single transaction
+    ##
+    ## @param      entries  List of (os.stat_result, digests dict) tuples
+    ##
+    ## @return     True if digests were stored, False otherwise.
+    ##
+    @trace()
+    def store_many(self, entries):
+        if self.conn is None:
+            return False
+
+        rows = []
+        for (st, digests) in entries:
+            key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+            for (hash_func, digest) in digests.items():
+                rows.append(key + (hash_func, digest))
+
+        if len(rows) == 0:
+            return True
+
+        try:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO file_hash "
+                                      "VALUES (?,?,?,?,?,?)", rows)
+        except sqlite3.Error as e:
+            LGR.warn("failed to store digests in hash cache: {}".format(e))
+            return False
+
+        return True
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+##
+## @brief      Computes digests of a file, cached digests are used when
+##             available.
+##
+## @param      hash_funcs  The hash functions
+## @param      path        The path
+##
+## @return     dict mapping hash function to digest or None
+##
+@trace_func(__name__)
+def hashfile_multi(hash_funcs, path):
+    cache = HashCache.instance()
+    if cache is None:
+        return crypto.hashfile_multi(hash_funcs, path)
+
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        LGR.error("cannot stat <{}>: {}".format(path, e))
+        return None
+
+    digests = cache.lookup(st, hash_funcs)
+    missing = [hash_func for hash_func in hash_funcs
+               if hash_func not in digests]
+    if len(missing) > 0:
+        computed = crypto.hashfile_multi(missing, path)
+        if computed is None:
+            return None
+        cache.store_many([(st, computed)])
+        digests.update(computed)
+
+    return digests
+##
+## @brief      Computes digests of several files, only files missing from
+##             the cache are read, concurrently using crypto.hashfiles().
+##
+## @param      hash_funcs   The hash functions
+## @param      stats        dict mapping path to os.stat_result
+## @param      num_threads  The number of threads
+##
+## @return     list of (path, digests) tuples, digests being None when the
+##             file could not be hashed
+##
+@trace_func(__name__)
+def hashfiles(hash_funcs, stats, num_threads=1):
+    cache = HashCache.instance()
+    if cache is None:
+        return list(crypto.hashfiles(hash_funcs, stats.keys(), num_threads))
+
+    found = {}
+    missing = []
+    for (path, st) in stats.items():
+        digests = cache.lookup(st, hash_funcs)
+        if len(digests) == len(hash_funcs):
+            found[path] = digests
+        else:
+            missing.append(path)
+
+    LGR.debug("{} digest(s) found in cache, {} file(s) to "
+              "hash.".format(len(found), len(missing)))
+    entries = []
+    for (path, digests) in crypto.hashfiles(hash_funcs, missing, num_threads):
+        found[path] = digests
+        if digests is not None:
+            entries.append((stats[path], digests))
+    cache.store_many(entries)
+
+    return [(path, found[path]) for path in stats.keys()]
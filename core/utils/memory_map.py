@@ -25,6 +25,7 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
+from time import time
 from utils.wrapper import trace
 from utils.logging import get_logger
 from utils.formatting import format_size
@@ -79,6 +80,24 @@ class MemoryMap(object):
         return self._bf.read(self.unit * self.size,
                              self.unit * self.start)
     ##
+    ## @brief      Copies mapped data at the current position of an output
+    ##             file, holes are not read, see BinaryFile.copy_range().
+    ##
+    ## @param      obf   Output binary file
+    ##
+    ## @return     number of bytes copied
+    ##
+    @trace()
+    def copy_to(self, obf):
+        start = time()
+        copied = self._bf.copy_range(obf,
+                                     self.unit * self.start,
+                                     self.unit * self.size)
+        elapsed = max(time() - start, 1e-6)
+        LGR.info("{} copied in {:.3f}s ({}/s).".format(
+            format_size(copied), elapsed, format_size(copied / elapsed)))
+        return copied
+    ##
     ## @brief      Returns a string representation of the object.
     ##
     ## @return     String representation of the object.
@@ -75,4 +75,5 @@ class ByteArrayMember(Member):
     ## @return     { description_of_the_return_value }
     ##
     def _read(self, data):
-        return data[0:self.size()]
+        # value outlives the buffer it is decoded from
+        return bytes(data[0:self.size()])
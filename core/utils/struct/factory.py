@@ -123,7 +123,8 @@ class StructFactory:
         if not StructFactory.st_exists(st_type, log=True):
             return None
 
-        bytes = bytes[oft:]   # keep data if and only if behind oft in buffer
+        # members decode slices of a view, data is never copied
+        bytes = memoryview(bytes).cast('B')[oft:]
 
         if len(bytes) < StructFactory.st_size(st_type):
             LGR.warn("given bytearray size is to short to match <{}> "
@@ -25,9 +25,8 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
-from struct import calcsize
+import struct
 from utils.logging import get_logger
-from utils.converting import unpack_one
 from utils.struct.member import Member
 # =============================================================================
 #  GLOBALS / CONFIG
@@ -52,6 +51,8 @@ class SimpleMember(Member):
         self.fmt = fmt
         self.formatter = fmtr
         super(SimpleMember, self).__init__(name, load, valid)
+        # compiled once, unpacks from any buffer without copying it
+        self._st = struct.Struct(fmt) if self.valid else None
     ##
     ## @brief      { function_description }
     ##
@@ -74,7 +75,7 @@ class SimpleMember(Member):
     ## @return     { description_of_the_return_value }
     ##
     def _size(self):
-        return calcsize(self.fmt)
+        return struct.calcsize(self.fmt)
     ##
     ## @brief      { function_description }
     ##
@@ -83,4 +84,4 @@ class SimpleMember(Member):
     ## @return     { description_of_the_return_value }
     ##
     def _read(self, data):
-        return unpack_one(self.fmt, data)
+        return self._st.unpack_from(data)[0]
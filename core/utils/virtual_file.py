@@ -0,0 +1,486 @@
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+#     file: virtual_file.py
+#     date: 2018-03-03
+#   author: koromodako
+#  purpose:
+#       Read-only files whose data is computed on demand from another file,
+#       they can be used wherever an input BinaryFile is expected.
+#
+#  license:
+#    Datashark <progdesc>
+#    Copyright (C) 2017 koromodako
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+#
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# =============================================================================
+#  IMPORTS
+# =============================================================================
+import io
+import os
+from copy import copy
+from utils.logging import get_logger
+from utils.memory_map import MemoryMap
+from utils.formatting import hexdump
+from utils.binary_file import BinaryFile
+from utils.binary_file import COPY_BLK_SZ
+# =============================================================================
+# GLOBALS
+# =============================================================================
+LGR = get_logger(__name__)
+# =============================================================================
+#  FUNCTIONS
+# =============================================================================
+##
+## @brief      Opens the file backing a virtual file
+##
+## @param      source  A path or a closed virtual file, virtual files can
+##                     then be stacked
+##
+## @return     opened BinaryFile or VirtualFile, None on error
+##
+def open_source(source):
+    if isinstance(source, VirtualFile):
+        # source is kept closed to be sent to workers
+        bf = copy(source)
+    else:
+        bf = BinaryFile(source, 'r', positional=True)
+
+    if not bf.open():
+        return None
+
+    return bf
+# =============================================================================
+#  CLASSES
+# =============================================================================
+##
+## @brief      Base class of read-only virtual files, it implements the read
+##             interface of BinaryFile on top of _read() and _size() which
+##             subclasses must define.
+##
+##             Instances are pickled to be handed over to workers: they only
+##             hold paths and parameters until they are opened, backing
+##             files must be opened by _open().
+##
+class VirtualFile(object):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      vpath  Virtual path of the file, it does not exist on disk
+    ##
+    def __init__(self, vpath):
+        super(VirtualFile, self).__init__()
+        self.path = vpath
+        self.dirname = os.path.dirname(vpath)
+        self.basename = os.path.basename(vpath)
+        self.abspath = os.path.abspath(vpath)
+        self.opened = False
+        self.pos = 0
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def __enter__(self):
+        self.open()
+        return self
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    ##
+    ## @brief      Returns a string representation of the object.
+    ##
+    ## @return     String representation of the object.
+    ##
+    def __str__(self):
+        return "{}({})".format(self.__class__.__name__, self.path)
+    ##
+    ## @brief      Opens backing files, implemented by subclasses.
+    ##
+    ## @return     True on success, False otherwise.
+    ##
+    def _open(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Closes backing files, implemented by subclasses.
+    ##
+    def _close(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Returns virtual file size, implemented by subclasses.
+    ##
+    ## @return     Number of bytes in file.
+    ##
+    def _size(self):
+        raise NotImplementedError
+    ##
+    ## @brief      Reads data, implemented by subclasses.
+    ##
+    ## @param      offset  The offset
+    ## @param      size    The size, range never exceeds file size
+    ##
+    ## @return     bytes-like object of given size
+    ##
+    def _read(self, offset, size):
+        raise NotImplementedError
+    ##
+    ## @brief      Returns data and hole segments of a range, subclasses
+    ##             knowing which parts of the file read as zeros override it.
+    ##
+    ## @param      start  The start
+    ## @param      end    The end
+    ##
+    ## @return     list of (offset, size, is_data) tuples covering the range
+    ##
+    def _data_map(self, start, end):
+        return [(start, end - start, True)]
+    ##
+    ## @brief      Determines if valid.
+    ##
+    ## @return     True if valid, False otherwise.
+    ##
+    def is_valid(self):
+        return self.opened
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def open(self):
+        if self.opened:
+            LGR.warn("virtual file is already opened.")
+            return False
+
+        if not self._open():
+            LGR.error("failed to open <{}>.".format(self))
+            return False
+
+        self.opened = True
+        self.pos = 0
+        return True
+    ##
+    ## @brief      Releases backing files
+    ##
+    def close(self):
+        if not self.opened:
+            LGR.warn("virtual file is already closed.")
+            return False
+
+        self._close()
+        self.opened = False
+        return True
+    ##
+    ## @brief      Returns file size.
+    ##
+    ## @return     Number of bytes in file.
+    ##
+    def size(self):
+        return self._size()
+    ##
+    ## @brief      Returns data and hole segments of the file, see
+    ##             BinaryFile.data_map().
+    ##
+    ## @param      start  The start
+    ## @param      size   The size, up to the end of file if None
+    ##
+    ## @return     list of (offset, size, is_data) tuples
+    ##
+    def data_map(self, start=0, size=None):
+        end = self.size()
+        if size is not None:
+            end = min(end, start + size)
+        if start >= end:
+            return []
+        return self._data_map(start, end)
+    ##
+    ## @brief      Places cursor at given offset in file using whence
+    ##
+    ## @param      offset  The offset
+    ## @param      whence  The whence
+    ##
+    ## @return     new position
+    ##
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size()
+        self.pos = max(0, offset)
+        return self.pos
+    ##
+    ## @brief      Returns cursor position.
+    ##
+    def tell(self):
+        return self.pos
+    ##
+    ## @brief      Reads n bytes from file as text using encoding.
+    ##
+    ## @param      size      Number of bytes to read
+    ## @param      encoding  Encoding to use for decoding read bytes
+    ##
+    ## @return     str
+    ##
+    def read_text(self, size=-1, seek=None, encoding='utf-8'):
+        return self.read(size, seek).decode(encoding)
+    ##
+    ## @brief      Reads n bytes from file.
+    ##
+    ## @param      size  Number of bytes to read, up to the end if negative
+    ##
+    ## @return     bytes
+    ##
+    def read(self, size=-1, seek=None):
+        if isinstance(seek, int):
+            self.seek(seek)
+        remaining = max(0, self.size() - self.pos)
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        if size == 0:
+            return b''
+        data = bytes(self._read(self.pos, size))
+        self.pos += len(data)
+        return data
+    ##
+    ## @brief      Reads bytes N bytes into given buffer, N being buffer size.
+    ##
+    ## @param      b       Writable bytes-like object
+    ## @param      offset  Offset to read from, file position is left
+    ##                     untouched. Reads at file position if None.
+    ##
+    ## @return     number of bytes read
+    ##
+    def readinto(self, b, offset=None):
+        pos = self.pos if offset is None else offset
+        view = memoryview(b).cast('B')
+        size = min(len(view), max(0, self.size() - pos))
+        if size == 0:
+            return 0
+        view[:size] = self._read(pos, size)
+        if offset is None:
+            self.pos += size
+        return size
+    ##
+    ## @brief      Copies a range of this file at the current position of
+    ##             another file, see BinaryFile.copy_range().
+    ##
+    ## @param      obf     Output binary file
+    ## @param      offset  The offset
+    ## @param      size    The size
+    ##
+    ## @return     number of bytes copied
+    ##
+    def copy_range(self, obf, offset, size):
+        copied = 0
+        for (start, length, is_data) in self.data_map(offset, size):
+            if not is_data:
+                obf.skip(length)
+                copied += length
+                continue
+            for pos in range(start, start + length, COPY_BLK_SZ):
+                obf.write(self._read(pos, min(COPY_BLK_SZ,
+                                              start + length - pos)))
+            copied += length
+        return copied
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @param      start  The start
+    ## @param      size   The size
+    ## @param      unit   The unit
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def mmap(self, start, size, unit=1):
+        return MemoryMap(self, start, size, unit)
+    ##
+    ## @brief      { function_description }
+    ##
+    ## @param      start  The start
+    ## @param      size   The size
+    ##
+    ## @return     { description_of_the_return_value }
+    ##
+    def dump(self, size=-1, seek=None):
+        return hexdump(self.read(size, seek))
+##
+## @brief      Virtual file made of fixed size blocks, it is the base class of
+##             virtual disk devices. Subclasses define _read_block() and
+##             _is_allocated(), they set block_size and block_count when
+##             opened.
+##
+class BlockDevice(VirtualFile):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      vpath  Virtual path of the device
+    ##
+    def __init__(self, vpath):
+        super(BlockDevice, self).__init__(vpath)
+        self.block_size = 0
+        self.block_count = 0
+        self._cached = (None, None)
+    ##
+    ## @brief      Reads a block, implemented by subclasses.
+    ##
+    ## @param      n     Index of the block starting from 0
+    ##
+    ## @return     block data or None on error
+    ##
+    def _read_block(self, n):
+        raise NotImplementedError
+    ##
+    ## @brief      Determines if a block is allocated, implemented by
+    ##             subclasses. Unallocated blocks read as zeros.
+    ##
+    ## @param      n     Index of the block starting from 0
+    ##
+    ## @return     True if allocated, False otherwise.
+    ##
+    def _is_allocated(self, n):
+        raise NotImplementedError
+    ##
+    ## @brief      Returns a block, last block read is kept as consecutive
+    ##             small reads often hit the same block.
+    ##
+    ## @param      n     Index of the block starting from 0
+    ##
+    ## @return     block data
+    ##
+    def __block(self, n):
+        (idx, data) = self._cached
+        if idx != n:
+            if self._is_allocated(n):
+                data = self._read_block(n)
+                if data is None or len(data) != self.block_size:
+                    raise IOError("failed to read block {} of "
+                                  "<{}>.".format(n, self))
+            else:
+                data = bytes(self.block_size)
+            self._cached = (n, data)
+        return data
+    ##
+    ## @brief      Virtual file size
+    ##
+    def _size(self):
+        return self.block_size * self.block_count
+    ##
+    ## @brief      Reads data from the blocks covering the range
+    ##
+    def _read(self, offset, size):
+        (n, start) = divmod(offset, self.block_size)
+        if start + size <= self.block_size:
+            return memoryview(self.__block(n))[start:start + size]
+
+        data = bytearray()
+        while len(data) < size:
+            want = min(self.block_size - start, size - len(data))
+            data += memoryview(self.__block(n))[start:start + want]
+            (n, start) = (n + 1, 0)
+        return data
+    ##
+    ## @brief      Unallocated blocks are holes
+    ##
+    def _data_map(self, start, end):
+        segments = []
+        n = start // self.block_size
+        while start < end:
+            stop = min(end, (n + 1) * self.block_size)
+            is_data = self._is_allocated(n)
+            if len(segments) > 0 and segments[-1][2] == is_data:
+                (oft, size, _) = segments[-1]
+                segments[-1] = (oft, stop - oft, is_data)
+            else:
+                segments.append((start, stop - start, is_data))
+            (n, start) = (n + 1, stop)
+        return segments
+    ##
+    ## @brief      Releases cached block
+    ##
+    def _close(self):
+        self._cached = (None, None)
+##
+## @brief      Bounded window over a range of another file, data is read from
+##             the source file and never copied.
+##
+class WindowFile(VirtualFile):
+    ##
+    ## @brief      Constructs the object.
+    ##
+    ## @param      source  The source path or virtual file
+    ## @param      offset  Offset of the window in source
+    ## @param      length  Length of the window, it is truncated to the end
+    ##                     of source when opened
+    ## @param      vpath   Virtual path of the window
+    ##
+    def __init__(self, source, offset, length, vpath):
+        super(WindowFile, self).__init__(vpath)
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self._bf = None
+        self._length = 0
+    ##
+    ## @brief      Opens source file
+    ##
+    def _open(self):
+        self._bf = open_source(self.source)
+        if self._bf is None:
+            return False
+
+        self._length = max(0, min(self.length,
+                                  self._bf.size() - self.offset))
+        if self._length < self.length:
+            LGR.warn("<{}> is truncated to {} bytes.".format(self,
+                                                             self._length))
+        return True
+    ##
+    ## @brief      Closes source file
+    ##
+    def _close(self):
+        self._bf.close()
+        self._bf = None
+    ##
+    ## @brief      Window size
+    ##
+    def _size(self):
+        return self._length
+    ##
+    ## @brief      Reads data from source
+    ##
+    def _read(self, offset, size):
+        return self._bf.read(size, self.offset + offset)
+    ##
+    ## @brief      Holes of source within the window
+    ##
+    def _data_map(self, start, end):
+        return [(oft - self.offset, size, is_data)
+                for (oft, size, is_data)
+                in self._bf.data_map(self.offset + start, end - start)]
+    ##
+    ## @brief      Copies a range of the window, source copies it itself so
+    ##             that a window over a file on disk is copied by the kernel.
+    ##
+    ## @param      obf     Output binary file
+    ## @param      offset  The offset
+    ## @param      size    The size
+    ##
+    ## @return     number of bytes copied
+    ##
+    def copy_range(self, obf, offset, size):
+        size = max(0, min(size, self._length - offset))
+        return self._bf.copy_range(obf, self.offset + offset, size)
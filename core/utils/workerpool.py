@@ -24,7 +24,12 @@
 # =============================================================================
 # IMPORTS
 # =============================================================================
+import gc
+import queue
+import heapq
+from time import time
 import multiprocessing as mp
+import utils.config as config
 import utils.crypto as crypto
 from utils.wrapper import trace
 from utils.logging import get_logger
@@ -33,23 +38,40 @@ from utils.wrapper import trace_func
 # GLOBALS
 # =============================================================================
 LGR = get_logger(__name__)
+# kinds of messages sent by workers to the pool on the output queue
+MSG_TASK = 0    # payload is a new task produced by the routine
+MSG_RESULT = 1  # payload is a result produced by the routine
+MSG_DONE = 2    # task processing is over, payload is (task, wall time)
+# seconds to wait for a message before checking workers liveness
+POLL_TIMEOUT = 1.0
 # =============================================================================
 # FUNCTIONS
 # =============================================================================
 
 @trace_func(__name__)
-def worker_routine(iqueue, oqueue, routine, kwargs):
+def worker_routine(iqueue, oqueue, routine, kwargs, init):
     """
     @brief      This generic routine implements a specific producer-consumer
                 relation as the consumer here can also be a producer.
 
+                Workers never push tasks back in the input queue themselves:
+                new tasks and results are sent to the pool on the output
+                queue which decides when to schedule them. A MSG_DONE
+                message is always sent last for each task so the pool can
+                keep track of in-flight tasks.
+
     @param      iqueue   Input queue shared between workers
-    @param      oqueue   Output queue collecting workers' results
+    @param      oqueue   Output queue collecting workers' messages
     @param      routine  Routine used to process input queue tasks
     @param      kwargs   Keyword arguments to be passed to the routine
+    @param      init     Callable taking no argument called once after fork,
+                         may be None
     """
     # re-init crypto context after worker fork
     crypto.re_init()
+    # per-worker initialization, e.g. open connections
+    if init is not None:
+        init()
     # enter worker infinite loop
     while True:
         # take next available task
@@ -58,24 +80,24 @@ def worker_routine(iqueue, oqueue, routine, kwargs):
         # if next task is None it means EXIT NOW
         if task is None:
             LGR.debug('process exiting!')
-            iqueue.task_done()  # validate None task
             break
         # perform routine on task
         LGR.debug('calling routine...')
+        start = time()
         try:
             (iq, oq) = routine(task, **kwargs)
         except Exception as e:
             LGR.exception("a worker caught an internal exception; details "
                           "below:")
         else:
-            # re-inject results if needed
+            # send new tasks and results to the pool
             for e in iq:
-                iqueue.put(e)
+                oqueue.put((MSG_TASK, e))
             for e in oq:
-                oqueue.put(e)
+                oqueue.put((MSG_RESULT, e))
         finally:
             # task has been processed
-            iqueue.task_done()
+            oqueue.put((MSG_DONE, (str(task), time() - start)))
         LGR.debug('task done.')
 # =============================================================================
 # CLASSES
@@ -85,61 +107,259 @@ def worker_routine(iqueue, oqueue, routine, kwargs):
 class WorkerPool(object):
     """
     @brief      Creates a pool of workers able to process tasks in parallel
-                until input task queue is empty.
+                until there is no more task to process.
     """
-    def __init__(self, num_workers):
+    def __init__(self, num_workers, max_inflight=None, priority=None):
         """
         @brief      Constructor
 
-        @param      num_workers Number of workers to spawn
+        @param      num_workers   Number of workers to spawn
+        @param      max_inflight  Maximum number of tasks queued or being
+                                  processed at the same time. Defaults to
+                                  'max_inflight_tasks' configuration value or
+                                  twice the number of workers.
+        @param      priority      Callable returning a sortable key for a
+                                  task, pending tasks having the lowest key
+                                  are scheduled first. When None, last
+                                  produced tasks are scheduled first.
         """
         super(WorkerPool, self).__init__()
+        if max_inflight is None:
+            max_inflight = config.value('max_inflight_tasks', 0)
+        if max_inflight <= 0:
+            max_inflight = 2 * num_workers
         self.num_workers = num_workers
+        self.max_inflight = max_inflight
+        self.priority = priority
         self.workers = []
-        self.iqueue = mp.JoinableQueue()
+        self.iqueue = mp.Queue()
         self.oqueue = mp.Queue()
 
     @trace()
-    def map(self, routine, kwargs, tasks):
+    def is_running(self):
         """
-        @brief      Maps tasks to be processed by routine on underlying workers
+        @brief      Determines if workers are running.
+        """
+        return len(self.workers) > 0
 
-        @param      routine Routine to be mapped on multiple workers.
+    @trace()
+    def start(self, routine, kwargs, init=None):
+        """
+        @brief      Forks workers once, they will process tasks using routine
+                    until stop() is called.
+
+                    Everything loaded before this call (plugins,
+                    configuration, magic databases, ...) is shared with
+                    workers. Objects are moved to a permanent generation
+                    before forking so that the garbage collector does not
+                    touch their pages and break copy-on-write.
+
+        @param      routine Routine to be run by workers.
         @param      kwargs  Keyword arguments to be passed to the routine.
                             Keep in mind that these arguments will be shared
                             between workers.
-        @param      tasks   Tasks to be processed by workers using routine
+        @param      init    Callable taking no argument called by each worker
+                            once after fork. Resources which can't be shared
+                            across fork (e.g. database connections) must be
+                            opened here.
 
-        @return     processing results
+        @return     True if workers were started, False otherwise.
         """
-        # add tasks to fifo
-        LGR.debug('adding tasks to input queue...')
-        for task in tasks:
-            self.iqueue.put(task)
-        # create as much workers as needed
+        if self.is_running():
+            LGR.error("worker pool is already running.")
+            return False
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
         LGR.debug('creating {} workers...'.format(self.num_workers))
         for i in range(self.num_workers):
             worker = mp.Process(
                 target=worker_routine,
-                args=(self.iqueue, self.oqueue, routine, kwargs))
+                args=(self.iqueue, self.oqueue, routine, kwargs, init))
             worker.start()
             self.workers.append(worker)
-        # wait for the fifo to be empty
-        LGR.debug('waiting for iqueue to be empty...')
-        self.iqueue.join()
+        if hasattr(gc, 'unfreeze'):
+            gc.unfreeze()
+        return True
+
+    @trace()
+    def stop(self):
+        """
+        @brief      Stops workers and waits for them to terminate
+        """
+        # discard tasks which were not retrieved by a worker yet
+        try:
+            while True:
+                self.iqueue.get_nowait()
+        except queue.Empty:
+            pass
         # stop all workers
         LGR.debug('stoping processes...')
-        for i in range(self.num_workers):
+        for worker in self.workers:
             self.iqueue.put(None)
-        # fill results array
-        LGR.debug('consume results...')
-        results = []
-        while not self.oqueue.empty():
-            results.append(self.oqueue.get())
-        # wait for all workers to terminate
+        # wait for all workers to terminate, a worker can't terminate until
+        # all the messages it sent are consumed
         for i in range(len(self.workers)):
             LGR.debug('waiting worker n°{} to terminate...'.format(i))
-            self.workers[i].join()
+            while self.workers[i].is_alive():
+                self.__discard_messages()
+                self.workers[i].join(POLL_TIMEOUT)
         self.workers = []
-        # finally returns all results
-        return results
+
+    @trace()
+    def __discard_messages(self):
+        """
+        @brief      Discards messages remaining in output queue
+        """
+        try:
+            while True:
+                self.oqueue.get_nowait()
+        except queue.Empty:
+            pass
+
+    @trace()
+    def __next_message(self):
+        """
+        @brief      Waits for next worker message
+
+        @return     (kind, payload) tuple
+        """
+        while True:
+            try:
+                return self.oqueue.get(timeout=POLL_TIMEOUT)
+            except queue.Empty:
+                dead = [w for w in self.workers if not w.is_alive()]
+                if len(dead) > 0:
+                    raise RuntimeError("{} worker(s) died unexpectedly, "
+                                       "in-flight tasks are "
+                                       "lost.".format(len(dead)))
+
+    @trace()
+    def __account(self, stats, task, elapsed):
+        """
+        @brief      Accounts for a processed task
+        """
+        LGR.info("<{}> processed in {:.3f}s".format(task, elapsed))
+        stats['count'] += 1
+        stats['busy'] += elapsed
+        if elapsed >= stats['longest'][1]:
+            stats['longest'] = (task, elapsed)
+
+    @trace()
+    def __summary(self, stats, elapsed):
+        """
+        @brief      Logs a summary of processed tasks
+        """
+        if stats['count'] == 0:
+            return
+        usage = 0.0
+        if elapsed > 0:
+            usage = 100 * stats['busy'] / (elapsed * self.num_workers)
+        LGR.info("{} task(s) processed in {:.3f}s, workers busy {:.1f}% of "
+                 "the time, longest task: <{}> ({:.3f}s)".format(
+                    stats['count'], elapsed, usage, *stats['longest']))
+
+    @trace()
+    def process(self, tasks):
+        """
+        @brief      Processes tasks on running workers and yields results as
+                    soon as they are produced.
+
+                    At most max_inflight tasks are queued or processed at the
+                    same time. Tasks produced by workers are scheduled before
+                    remaining input tasks, ordered by priority if any, last
+                    produced first otherwise, which keeps the backlog of
+                    pending tasks small.
+
+                    Wall time of each task is logged along with a summary
+                    once all tasks are processed.
+
+        @param      tasks   Iterable of tasks to be processed by workers, it
+                            is consumed lazily. None is not a valid task.
+
+        @return     generator of processing results
+        """
+        if not self.is_running():
+            raise RuntimeError("worker pool must be started before "
+                               "processing tasks.")
+        tasks = iter(tasks)
+        pending = []
+        inflight = 0
+        seq = 0
+        stats = {'count': 0, 'busy': 0.0, 'longest': (None, 0.0)}
+        start = time()
+        try:
+            while True:
+                # feed workers until high-water mark is reached
+                while inflight < self.max_inflight:
+                    if len(pending) > 0:
+                        task = heapq.heappop(pending)[2]
+                    else:
+                        task = next(tasks, None)
+                        if task is None:
+                            break
+                    self.iqueue.put(task)
+                    inflight += 1
+                # no more task in-flight and nothing left to schedule
+                if inflight == 0:
+                    break
+                # wait for next worker message
+                (kind, payload) = self.__next_message()
+                if kind == MSG_TASK:
+                    seq += 1
+                    if self.priority is None:
+                        key = (0, -seq)
+                    else:
+                        key = (self.priority(payload), seq)
+                    heapq.heappush(pending, (key, seq, payload))
+                elif kind == MSG_RESULT:
+                    yield payload
+                else:
+                    inflight -= 1
+                    self.__account(stats, *payload)
+        finally:
+            self.__summary(stats, time() - start)
+            # interrupted: workers can't be reused as they might still send
+            # messages related to abandoned tasks
+            if inflight > 0:
+                self.stop()
+
+    @trace()
+    def imap(self, routine, kwargs, tasks):
+        """
+        @brief      Starts workers, maps tasks to be processed by routine on
+                    them, yields results as soon as they are produced and
+                    finally stops workers.
+
+        @param      routine Routine to be mapped on multiple workers.
+        @param      kwargs  Keyword arguments to be passed to the routine.
+                            Keep in mind that these arguments will be shared
+                            between workers.
+        @param      tasks   Iterable of tasks to be processed by workers using
+                            routine, it is consumed lazily. None is not a
+                            valid task.
+
+        @return     generator of processing results
+        """
+        if not self.start(routine, kwargs):
+            return
+        try:
+            for result in self.process(tasks):
+                yield result
+        finally:
+            self.stop()
+
+    @trace()
+    def map(self, routine, kwargs, tasks):
+        """
+        @brief      Maps tasks to be processed by routine on underlying workers
+
+        @param      routine Routine to be mapped on multiple workers.
+        @param      kwargs  Keyword arguments to be passed to the routine.
+                            Keep in mind that these arguments will be shared
+                            between workers.
+        @param      tasks   Tasks to be processed by workers using routine
+
+        @return     processing results
+        """
+        return list(self.imap(routine, kwargs, tasks))
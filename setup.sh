@@ -62,6 +62,7 @@ makedirs ${CONF_DST_DIR}
 deploy_conf datashark
 deploy_conf whitelist
 deploy_conf blacklist
+deploy_conf blockhashdb
 deploy_conf dissection
 ##
 ## Create symlinks
@@ -27,6 +27,7 @@
 # =============================================================================
 #  IMPORTS
 # =============================================================================
+import struct
 from os import makedirs
 from shutil import which
 from subprocess import getstatusoutput
@@ -63,16 +64,19 @@ class Test(object):
     ## @param      name         The name
     ## @param      cmd          The command
     ## @param      init         The initialize
-    ## @param      term         The term
-    ## @param      expect_code  The expect code
+    ## @param      term           The term
+    ## @param      expect_code    The expect code
+    ## @param      expect_output  Text command output must contain, if any
     ##
-    def __init__(self, name, cmd, init=stub, term=stub, expect_code=0):
+    def __init__(self, name, cmd, init=stub, term=stub, expect_code=0,
+                 expect_output=None):
         super(Test, self).__init__()
         self.name = name
         self.cmd = cmd
         self.init = init
         self.term = term
         self.expect_code = expect_code
+        self.expect_output = expect_output
     ##
     ## @brief      { function_description }
     ##
@@ -84,6 +88,8 @@ class Test(object):
         (exit_ok, exit_code, output) = self.exec_cmd(self.cmd,
                                                      self.expect_code)
         self.term()
+        if self.expect_output is not None:
+            exit_ok = exit_ok and (self.expect_output in output)
         return (exit_ok, exit_code, output)
 # =============================================================================
 #  FUNCTIONS
@@ -143,6 +149,8 @@ def run_tests(tests):
 DATA_DIR = 'data/'
 SUBDIR_DIR = '{}subdir'.format(DATA_DIR)
 RENZIK_JPG = '{}renzik_sm.jpg'.format(DATA_DIR)
+RENZIK_PATCHED_JPG = '{}/renzik_sm_patched.jpg'.format(SUBDIR_DIR)
+MBR_DISK = 'tmp/mbr_disk.raw'
 # =============================================================================
 # TEST FUNCTIONS
 # =============================================================================
@@ -162,6 +170,34 @@ def hashdb_merge_init():
     if not exit_ok:
         return False
 
+    return True
+##
+## @brief      Builds a disk holding RENZIK_JPG at the start of its single
+##             partition, MBR partitions are block scanned.
+##
+## @return     { description_of_the_return_value }
+##
+def mbr_disk_init():
+    (exit_ok, _, output) = Test.exec_cmd(['datashark', '-r', 'hashdb.create',
+                                      'config/bkdb.conf', DATA_DIR])
+    if not exit_ok:
+        return False
+
+    with open(RENZIK_JPG, 'rb') as f:
+        data = f.read()
+    # partition is 4096 bytes aligned in the disk, size is given in sectors
+    start = 8
+    size = (len(data) + 511) // 512
+    mbr = bytearray(512)
+    mbr[446:462] = struct.pack('<B3sB3sII', 0x00, b'\x00\x02\x00', 0x83,
+                               b'\x00\x00\x00', start, size)
+    mbr[510:512] = b'\x55\xaa'
+    with open(MBR_DISK, 'wb') as f:
+        f.write(mbr)
+        f.seek(start * 512)
+        f.write(data)
+        f.truncate((start + size) * 512)
+
     return True
 # =============================================================================
 # TESTS ARRAY
@@ -180,10 +216,24 @@ TESTS = [
          ['datashark', 'hashdb.adapters']),
     Test("hashdb.create",
          ['datashark', 'hashdb.create', 'config/whdb.conf', DATA_DIR]),
+    Test("hashdb.create.update",
+         ['datashark', '-u', 'hashdb.create', 'config/whdb.conf', DATA_DIR]),
+    Test("hashdb.create.sorted",
+         ['datashark', '-r', 'hashdb.create', 'config/bhdb-sorted.conf',
+          DATA_DIR]),
+    Test("hashdb.create.blocks",
+         ['datashark', '-r', 'hashdb.create', 'config/bkdb.conf', DATA_DIR]),
+    Test("hashdb.create.fuzzy",
+         ['datashark', '--fuzzy-python',
+          'hashdb.create', 'config/fzdb.conf', DATA_DIR]),
     Test("hashdb.merge",
          ['datashark', 'hashdb.merge',
           'config/bhdb.conf', 'config/bhdb-1.conf', 'config/bhdb-2.conf'],
           init=hashdb_merge_init),
+    Test("hashdb.merge.sorted",
+         ['datashark', 'hashdb.merge', 'config/bhdb-sorted-merged.conf',
+          'config/bhdb-sorted.conf', 'config/bhdb-1.conf',
+          'config/bhdb-2.conf']),
     # -------------------------------------------------------------------------
     #  CONTAINER
     # -------------------------------------------------------------------------
@@ -206,6 +256,29 @@ TESTS = [
          ['datashark',
           '--dissection-config=config/dissection.conf',
           'dissection.dissect', RENZIK_JPG]),
+    Test("dissection.dissect.multiple",
+         ['datashark',
+          '--dissection-config=config/dissection.conf',
+          'dissection.dissect', RENZIK_JPG, RENZIK_PATCHED_JPG]),
+    Test("dissection.dissect.whitelist",
+         ['datashark',
+          '--whitelist-config=config/whdb.conf',
+          '--dissection-config=config/dissection.conf',
+          'dissection.dissect', RENZIK_JPG]),
+    Test("dissection.dissect.blockhash",
+         ['datashark',
+          '--blockhashdb-config=config/bkdb.conf',
+          '--dissection-config=config/dissection.conf',
+          'dissection.dissect', MBR_DISK],
+          init=mbr_disk_init,
+          expect_output="5 block(s) of <"),
+    Test("dissection.dissect.fuzzy",
+         ['datashark',
+          '--blacklist-config=config/fzdb.conf',
+          '--dissection-config=config/dissection.conf',
+          '--fuzzy-threshold=50',
+          '--fuzzy-python',
+          'dissection.dissect', RENZIK_PATCHED_JPG]),
     # -------------------------------------------------------------------------
     #  DISSECTIONDB
     # -------------------------------------------------------------------------